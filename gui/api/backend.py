@@ -146,7 +146,8 @@ class PyPlanScoringKernel(BackEnd):
         return dcm_files, flag
 
     def setup_case(self, rs_file_path, file_path, sheet_name):
-        structures = PyDicomParser(filename=rs_file_path).GetStructures()
+        # only the structures on the criteria sheet get their contours decoded
+        structures = PyDicomParser(filename=rs_file_path).GetStructures(lazy=True)
         self._plan_eval.read(file_path, sheet_name=sheet_name)
         # todo implement setup case by id
         self._case = RTCase(sheet_name, 1, structures,
@@ -166,7 +167,9 @@ class PyPlanScoringKernel(BackEnd):
                 plan_dcm = PyDicomParser(filename=self.dcm_files['rtplan'])
                 dose_dcm = PyDicomParser(filename=self.dcm_files['rtdose'])
                 plan_dict = plan_dcm.GetPlan()
-                dose_3d = dose_dcm.get_dose_3d()
+                dose_3d = dose_dcm.get_dose_3d(
+                    self.dvh_calculator.dose_precision,
+                    self.dvh_calculator.dose_memmap)
                 self._planning_item = PyPlanningItem(
                     plan_dict, self.case, dose_3d, self.dvh_calculator)
 
@@ -220,11 +223,11 @@ class PyPlanScoringKernel(BackEnd):
             if not file_name:
                 dvh_file = os.path.join(diretory, filename + '.dvh')
                 self._io.dvh_data = self._dvh_data
-                self._io.to_json_file(dvh_file)
+                self._io.to_json_file(dvh_file, self.dvh_calculator.dvh_format)
             else:
                 dvh_file = os.path.join(diretory, file_name + '.dvh')
                 self._io.dvh_data = self._dvh_data
-                self._io.to_json_file(dvh_file)
+                self._io.to_json_file(dvh_file, self.dvh_calculator.dvh_format)
 
     def save_report_data(self, file_name=''):
         if self._report_data_frame is not None:
@@ -265,10 +268,16 @@ class DoseAccumulationBackEnd(PyPlanScoringKernel):
                         for f in self.dcm_files['rtdose']
                     ]
                     if len(dcm_objs) == 1:
-                        dose_3d = dcm_objs[0].get_dose_3d()
+                        dose_3d = dcm_objs[0].get_dose_3d(
+                            self.dvh_calculator.dose_precision,
+                            self.dvh_calculator.dose_memmap)
                     else:
                         # add 3D doses
-                        doses_3d = [obj.get_dose_3d() for obj in dcm_objs]
+                        doses_3d = [
+                            obj.get_dose_3d(self.dvh_calculator.dose_precision,
+                                            self.dvh_calculator.dose_memmap)
+                            for obj in dcm_objs
+                        ]
                         # Sum DVHs
                         acc = DoseAccumulation(doses_3d)
                         dose_3d = acc.get_plan_sum()
@@ -283,11 +292,11 @@ class DoseAccumulationBackEnd(PyPlanScoringKernel):
             if not file_name:
                 dvh_file = os.path.join(diretory, filename + '.dvh')
                 self._io.dvh_data = self._dvh_data
-                self._io.to_json_file(dvh_file)
+                self._io.to_json_file(dvh_file, self.dvh_calculator.dvh_format)
             else:
                 dvh_file = os.path.join(diretory, file_name + '.dvh')
                 self._io.dvh_data = self._dvh_data
-                self._io.to_json_file(dvh_file)
+                self._io.to_json_file(dvh_file, self.dvh_calculator.dvh_format)
 
     def save_report_data(self, file_name=''):
         if self._report_data_frame is not None:
@@ -1,6 +1,5 @@
-import os
 import re
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 import matplotlib.pyplot as plt
 
@@ -8,7 +7,8 @@ import numpy as np
 
 import pandas as pd
 
-from pyplanscoring.core.dicom_reader import PyDicomParser
+from pyplanscoring.core.dicom_reader import get_dicom_types
+from pyplanscoring.core.io import DicomIndex, get_dicom_files
 
 from xlsxwriter.utility import xl_rowcol_to_cell
 
@@ -85,25 +85,21 @@ def plot_dvh(dvh_calc, title):
     plt.title(title)
 
 
-def get_dicom_data(root_path: str) -> Dict[str, List[str]]:
+def get_dicom_data(root_path: str, index: Optional[DicomIndex] = None) -> Dict[str, List[str]]:
     """
         Provide all participant required files (RP,RS an RD DICOM FILES)
     :param root_path: participant folder
+    :param index: optional DicomIndex. Only new or changed files are read again.
     :return: Pandas DataFrame containing path to files
     """
-    files = [
-        os.path.join(root, name) for root, dirs, files in os.walk(root_path)
-        for name in files if name.endswith(('.dcm', '.DCM'))
-    ]
+    if index is not None:
+        typed_files = index.scan(root_path)
+    else:
+        # only the DICOM headers are read
+        typed_files = get_dicom_types(get_dicom_files(root_path))
 
     filtered_files = []
-    for f in files:
-        obj = PyDicomParser(filename=f)
-        rt_type = obj.GetSOPClassUID()
-        # fix halcyon SOP class UI
-        if rt_type is None:
-            rt_type = obj.ds.Modality.lower()
-
+    for rt_type, f in typed_files:
         if rt_type in ['rtdose', 'rtplan', 'rtss']:
             filtered_files.append([rt_type, f])
 
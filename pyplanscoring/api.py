@@ -56,8 +56,14 @@ class PyPlanScoringAPI:
         Class to Calculate a DVH from DICOM RT data
     """
 
-    def __init__(self, rs_file_path: str, rd_file_path: str) -> None:
+    def __init__(self, rs_file_path: str, rd_file_path: str, dose_precision: str = 'float64') -> None:
+        """
+        :param rs_file_path: RTSTRUCT file path
+        :param rd_file_path: RTDOSE file path
+        :param dose_precision: dose storage - 'float64', 'float32' or 'raw'
+        """
         self._structures = None
+        self.dose_precision = dose_precision
         self._dose_3d = None
         self._dvhs = {}
         self.rs_dcm = PyDicomParser(filename=rs_file_path)
@@ -73,7 +79,8 @@ class PyPlanScoringAPI:
 
     @structures.setter
     def structures(self, value):
-        self._structures = value.GetStructures()
+        # ROI contours are decoded on first use
+        self._structures = value.GetStructures(lazy=True)
 
     @property
     def dose_3d(self):
@@ -81,7 +88,7 @@ class PyPlanScoringAPI:
 
     @dose_3d.setter
     def dose_3d(self, value):
-        self._dose_3d = value.get_dose_3d()
+        self._dose_3d = value.get_dose_3d(self.dose_precision)
 
     @property
     def dvhs(self):
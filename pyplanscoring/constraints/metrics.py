@@ -16,7 +16,7 @@ from ..core.calculation import PyStructure
 from ..core.dvhdoses import get_dvh_max, get_dvh_mean, get_dvh_min
 
 from ..core.types import (DICOMType, DoseUnit, DoseValue,
-                          DoseValuePresentation, DVHData)
+                          DoseValuePresentation, DVHData, QueryType)
 
 from .query import PyQueryExtensions, QueryExtensions
 
@@ -318,12 +318,164 @@ class ConstrainMetric:
         self._target = value
 
 
+def interp_scores(values, x0, x1, y0, y1):
+    """
+        Element-wise np.interp(value, [x0, x1], [y0, y1]) of arrays of two point score functions
+    :param values: query results
+    :param x0: first x point
+    :param x1: second x point
+    :param y0: score at x0
+    :param y1: score at x1
+    :return: scores array
+    """
+    values = np.asarray(values, dtype=float)
+    x0, x1, y0, y1 = (np.asarray(v, dtype=float) for v in (x0, x1, y0, y1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (y1 - y0) / (x1 - x0)
+        scores = slope * (values - x0) + y0
+    # same boundary order of np.interp
+    scores = np.where(values == x0, y0, scores)
+    scores = np.where(values == x1, y1, scores)
+    scores = np.where(values < x0, y0, scores)
+    return np.where(values > x1, y1, scores)
+
+
+class CompiledPlanEvaluation:
+    """
+        Scoring criteria parsed once into query objects and score arrays.
+        Dose at volume and volume at dose queries of a PyPlanningItem are evaluated in batches on each
+        structure DVH and all rows are scored in a single array operation. Other queries and planning
+        items run through pi.execute_query, as ConstrainMetric does.
+
+    Example::
+
+        compiled = CompiledPlanEvaluation(criteria)
+        results, scores = compiled.evaluate_plans(planning_items)
+    """
+    # query types evaluated by the vectorized DVHData methods
+    BATCH_QUERIES = (QueryType.DOSE_AT_VOLUME, QueryType.VOLUME_AT_DOSE)
+
+    def __init__(self, criteria):
+        """
+        :param criteria: scoring criteria DataFrame
+        """
+        self._criteria = criteria
+        self._query = PyQueryExtensions()
+        self._structure_names = []
+        self._query_strings = []
+        self._queries = []
+        self._batches = {}
+        n_rows = len(criteria)
+        self._x0 = np.full(n_rows, np.nan)
+        self._x1 = np.full(n_rows, np.nan)
+        self._y0 = np.full(n_rows, np.nan)
+        self._y1 = np.full(n_rows, np.nan)
+        # rows scored by min/max metrics, other metric types have no score
+        self._scored = np.zeros(n_rows, dtype=bool)
+        self._compile()
+
+    @property
+    def criteria(self):
+        return self._criteria
+
+    def _compile(self):
+        """
+            Parses the queries and groups them by structure and query parameters.
+        """
+        for i, (_, row) in enumerate(self.criteria.iterrows()):
+            structure_name = row['Structure Name']
+            query = PyQueryExtensions().read(row['Query'])
+            self._structure_names.append(structure_name)
+            self._query_strings.append(row['Query'])
+            self._queries.append(query)
+
+            # two point score function [x0, x1] -> [y0, y1]
+            target, tolerance, score = row['Target'], row['Tolerance'], row['Score']
+            if row['Metric Type'] == MetricType.MAX:
+                self._x0[i], self._x1[i], self._y0[i], self._y1[i] = target, tolerance, score, 0
+                self._scored[i] = True
+            elif row['Metric Type'] == MetricType.MIN:
+                self._x0[i], self._x1[i], self._y0[i], self._y1[i] = tolerance, target, 0, score
+                self._scored[i] = True
+
+            if query.query_type in self.BATCH_QUERIES:
+                key = (structure_name, query.query_type) + self._query.get_query_parameters(query)
+                self._batches.setdefault(key, []).append(i)
+
+        self._batches = {k: np.array(v) for k, v in self._batches.items()}
+
+    def run_query(self, i, pi):
+        """
+            Runs a single criteria row query
+        :param i: row number
+        :param pi: PlanningItem or PyPlanningItem
+        :return: query result
+        """
+        return float(pi.execute_query(self._query_strings[i], self._structure_names[i]))
+
+    def evaluate(self, pi):
+        """
+            Query results and scores of a planning item
+        :param pi: PlanningItem or PyPlanningItem
+        :return: results and scores arrays, scores of rows without min/max metric are NaN
+        """
+        results = np.full(len(self._queries), np.nan)
+        # batches use the PyQueryExtensions DVH methods, other planning items keep their own queries
+        batches = self._batches.items() if isinstance(pi, PyPlanningItem) else ()
+        for (structure_name, query_type, d_pres, dose_unit, v_pres), rows in batches:
+            dvh = pi.get_dvh_cumulative_data(structure_name, d_pres, v_pres)
+            values = np.array([self._queries[i].query_value for i in rows])
+            if query_type == QueryType.DOSE_AT_VOLUME:
+                doses = dvh.get_dose_at_volumes(values, v_pres)
+                results[rows] = (doses * dvh.dose_unit).rescale(dose_unit).magnitude
+            else:
+                results[rows] = dvh.get_volume_at_doses(values, dose_unit, v_pres)
+
+        # other query types and undefined batch results run one query at a time
+        for i in np.flatnonzero(np.isnan(results)):
+            results[i] = self.run_query(i, pi)
+
+        return results, self.score(results)
+
+    def evaluate_plans(self, planning_items):
+        """
+            Query results and scores of many planning items, one plan per row
+        :param planning_items: list of PlanningItem or PyPlanningItem
+        :return: results and scores 2D arrays
+        """
+        results = np.array([self.evaluate(pi)[0] for pi in planning_items]).reshape(-1, len(self._queries))
+        return results, self.score(results)
+
+    def score(self, results):
+        """
+            Scores query results of all criteria rows
+        :param results: results array, the last axis is the criteria row
+        :return: scores array
+        """
+        return interp_scores(results, self._x0, self._x1, self._y0, self._y1)
+
+    def eval_plan(self, pi):
+        """
+            Criteria report of a planning item
+        :param pi: PlanningItem or PyPlanningItem
+        :return: criteria DataFrame with Result and Raw score columns
+        """
+        results, scores = self.evaluate(pi)
+        report_data = self.criteria.copy()
+        report_data['Result'] = results
+        # None score of metric types without a score function, as ConstrainMetric.metric_function
+        report_data['Raw score'] = [s if scored else None for s, scored in zip(scores, self._scored)]
+
+        return report_data
+
+
 class PlanEvaluation:
     def __init__(self):
         self._criteria = None
+        self._compiled = None
 
     def read(self, file_path, sheet_name):
-        self._criteria = pd.read_excel(file_path, sheet_name=sheet_name)
+        self.criteria = pd.read_excel(file_path, sheet_name=sheet_name)
         return self._criteria
 
     @property
@@ -333,27 +485,19 @@ class PlanEvaluation:
     @criteria.setter
     def criteria(self, value):
         self._criteria = value
+        self._compiled = None
 
-    def eval_plan(self, pi):
-        report_data = self.criteria.copy()
-        score_res = []
-        constraint_result = []
-        for row in self.criteria.iterrows():
-            row_val = row[1].to_dict()
-            structure_name = row_val['Structure Name']
-            query = row_val['Query']
-            metric_type = row_val['Metric Type']
-            target = [row_val['Target'], row_val['Tolerance']]
-            score = row_val['Score']
-            # eval metrics
-            cm = ConstrainMetric(structure_name, query, metric_type, target, score)
-            sc = cm.metric_function(pi)
-            score_res.append(sc)
-            constraint_result.append(cm.query_result)
-        report_data['Result'] = constraint_result
-        report_data['Raw score'] = score_res
+    def compile(self):
+        """
+            Criteria compiled on first use. Assign criteria again after changing it in place.
+        :return: CompiledPlanEvaluation
+        """
+        if self._compiled is None:
+            self._compiled = CompiledPlanEvaluation(self.criteria)
+        return self._compiled
 
-        return report_data
+    def eval_plan(self, pi):
+        return self.compile().eval_plan(pi)
 
 
 class StringMatcher:
@@ -500,6 +644,9 @@ class PyPlanningItem:
         self.dose_3d = dose_3d
         self.dvh_calculator = dvh_calculator
         self._dvh_data = {}
+        # memoized structure name matches and DVHData objects
+        self._structure_names = {}
+        self._dvh_cache = {}
 
     @property
     def dvh_data(self):
@@ -508,6 +655,15 @@ class PyPlanningItem:
     @dvh_data.setter
     def dvh_data(self, value):
         self._dvh_data = dict(value)
+        self.clear_dvh_cache()
+
+    def clear_dvh_cache(self):
+        """
+            Clears the memoized structure matches and DVHData objects.
+            Call it after changing rt_case, plan_dict or the DVH data in place.
+        """
+        self._structure_names = {}
+        self._dvh_cache = {}
 
     @property
     def external_name(self):
@@ -519,26 +675,43 @@ class PyPlanningItem:
 
     def calculate_dvh(self):
         if not self._dvh_data:
-            self._dvh_data = self.dvh_calculator.calculate_all(self.dose_3d)
+            self._dvh_data = self.dvh_calculator.calculate(self.dose_3d)
+            self.clear_dvh_cache()
+
+    def get_structure_name(self, structure):
+        """
+            Name of the rt_case structure matching the input structure id
+        :param structure: Structure id
+        :return: structure name
+        """
+        if structure not in self._structure_names:
+            self._structure_names[structure] = self.rt_case.get_structure(structure)['name']
+        return self._structure_names[structure]
 
     def get_dvh_cumulative_data(self, structure, dose_presentation, volume_presentation=None):
         """
-            Get CDVH data from DICOM-RTDOSE file
+            Get CDVH data from DICOM-RTDOSE file.
+            DVHData objects are memoized by structure, dose and volume presentation.
         :param structure: Structure
         :param dose_presentation: DoseValuePresentation
         :param volume_presentation: VolumePresentation
         :return: DVHData
         """
         if self._dvh_data:
-            struc_dict = self.rt_case.get_structure(structure)
-            for k, v in self._dvh_data.items():
-                if struc_dict['name'] == v['name']:
-                    dvh = DVHData(v)
-                    if dose_presentation == DoseValuePresentation.Absolute:
-                        return dvh
-                    if dose_presentation == DoseValuePresentation.Relative:
-                        dvh.to_relative_dose(self.total_prescribed_dose)
-                        return dvh
+            key = (self.get_structure_name(structure), dose_presentation, volume_presentation)
+            if key not in self._dvh_cache:
+                self._dvh_cache[key] = self._get_dvh_data(key[0], dose_presentation)
+            return self._dvh_cache[key]
+
+    def _get_dvh_data(self, structure_name, dose_presentation):
+        for k, v in self._dvh_data.items():
+            if structure_name == v['name']:
+                dvh = DVHData(v)
+                if dose_presentation == DoseValuePresentation.Absolute:
+                    return dvh
+                if dose_presentation == DoseValuePresentation.Relative:
+                    dvh.to_relative_dose(self.total_prescribed_dose)
+                    return dvh
 
     def get_dose_at_volume(self, ss, volume, v_pres, d_pres):
         """
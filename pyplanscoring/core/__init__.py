@@ -5,3 +5,8 @@ import numba as nb
 # add numba global compilation directives
 njit = functools.partial(nb.njit, cache=False, nogil=True)
 
+# hot kernels - cached on disk and releasing the GIL.
+# Serial, so they are safe to call from thread pools under any numba threading layer
+# and the callers' thread count (num_cores, plane threads) is the only parallelism.
+cnjit = functools.partial(nb.njit, cache=True, nogil=True)
+
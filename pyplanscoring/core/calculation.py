@@ -7,16 +7,30 @@ Copyright (c) 2017      Victor Gabriel Leandro Alves
 
 """
 import configparser
+import logging
+import os
+import shutil
+import tempfile
 import time
-
-from joblib import Parallel, delayed
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
-from numpy import ma
 
 from .dvhdoses import get_cdvh_numba, get_dvh_max, get_dvh_mean, get_dvh_min
-from .geometry import calc_area, check_contour_inside, get_contour_mask_wn, get_oversampled_structure
-from .types import DoseValue, StructureBase
+from .geometry import (calc_area, check_contour_inside, get_axis_grid_cached, get_contour_mask_scanline,
+                       get_contour_mask_wn_grid, get_oversampled_structure)
+from .scheduler import DVHScheduler
+from .types import Dose3D, DoseValue, StructureBase
+
+DVH_ENGINES = ('plane', 'stack')
+MASK_BACKENDS = ('scanline', 'wn')
+# dose bins - fixed width in dose unit or relative width (fraction of the maximum dose)
+BINNING_MODES = ('fixed', 'relative')
+
+# weights of the DVH calculation cost model terms
+COST_WEIGHTS = {'voxels': 1.0, 'vertices': 20.0, 'planes': 500.0}
+
+logger = logging.getLogger(__name__)
 
 
 def timeit(method):
@@ -125,7 +139,7 @@ class PyStructure(StructureBase):
                 structure = get_oversampled_structure(self.structure,
                                                       z_grid_resolution)
                 self._structure_dict = structure
-                self._planes = structure['planes']
+                self.planes = structure['planes']
                 self._contour_spacing = z_grid_resolution
                 # set high resolution structure
                 self.is_high_resolution = True
@@ -180,7 +194,8 @@ class DVHCalculation:
         class to encapsulate pyplanscoring upsampling and dvh calculation
     """
 
-    def __init__(self, structure, dose, calc_grid=None):
+    def __init__(self, structure, dose, calc_grid=None, engine='plane', mask_backend='scanline', n_threads=1,
+                 binning='fixed', bin_width=0.01):
         """
             Class to encapsulate PyPlanScoring DVH calculation methods
         :param structure: PyStructure instance
@@ -189,14 +204,35 @@ class DVHCalculation:
         :type dose: Dose3D
         :param calc_grid: (dx,dy,dz) up-sampling grid delta in mm
         :type calc_grid: tuple
+        :param engine: DVH engine - 'plane' (per plane histograms) or 'stack' (whole structure at once)
+        :type engine: str
+        :param mask_backend: contour rasterization - 'scanline' (even-odd fill) or 'wn' (winding number)
+        :type mask_backend: str
+        :param n_threads: number of threads splitting the structure planes
+        :type n_threads: int
+        :param binning: dose bins - 'fixed' (bin_width in dose unit) or 'relative' (bin_width fraction of max dose)
+        :type binning: str
+        :param bin_width: bin width, e.g. 0.01 Gy fixed or 0.001 relative (1000 bins)
+        :type bin_width: float
         """
         self._structure = None
         self._dose = None
+        self._dose_roi = None
         self._calc_grid = None
+        self._engine = None
+        self._mask_backend = None
+        self._n_threads = 1
+        self._binning = None
+        self._bin_width = None
         # setters
         self.structure = structure
         self.dose = dose
         self.calc_grid = calc_grid
+        self.engine = engine
+        self.mask_backend = mask_backend
+        self.n_threads = n_threads
+        self.binning = binning
+        self.bin_width = bin_width
 
         if calc_grid is not None:
             # To high resolution z axis
@@ -210,13 +246,37 @@ class DVHCalculation:
     def structure(self, value):
         self._structure = value
 
+    @property
+    def binning(self):
+        return self._binning
+
+    @binning.setter
+    def binning(self, value):
+        if value not in BINNING_MODES:
+            raise ValueError('Binning should be one of {}'.format(BINNING_MODES))
+        self._binning = value
+
+    @property
+    def bin_width(self):
+        return self._bin_width
+
+    @bin_width.setter
+    def bin_width(self, value):
+        if not float(value) > 0:
+            raise ValueError('Bin width should be positive')
+        self._bin_width = float(value)
+
     # Create an empty array of bins to store the histogram in Gy
     @property
     def bin_size(self):
-        return DoseValue(0.01, self.dose.unit)
+        if self.binning == 'relative':
+            return DoseValue(float(self.dose.dose_max_3d) / self.n_bins, self.dose.unit)
+        return DoseValue(self.bin_width, self.dose.unit)
 
     @property
     def n_bins(self):
+        if self.binning == 'relative':
+            return max(int(round(1.0 / self.bin_width)), 1)
         return int(float(self.dose.dose_max_3d / self.bin_size))
 
     @property
@@ -234,6 +294,7 @@ class DVHCalculation:
         #     raise TypeError('Dose instance should be type Dose3D')
 
         self._dose = value
+        self._dose_roi = None
 
     def get_dose_plane(self, z, ctr_dose_lut):
         """
@@ -243,7 +304,23 @@ class DVHCalculation:
         :param ctr_dose_lut: Lookup table
         :return: Dose plane
         """
-        return self.dose.get_z_dose_plane(float(z), ctr_dose_lut)
+        return self.dose_roi.get_z_dose_plane(float(z), ctr_dose_lut)
+
+    @property
+    def dose_roi(self):
+        """
+            Dose cropped to the structure bounding box. Its z planes are interpolated
+            over the structure extent only, instead of the whole dose grid.
+        :return: Dose3D view
+        """
+        if self._dose_roi is None:
+            if isinstance(self.dose, Dose3D):
+                # ROI grids extend one calculation voxel beyond the contours
+                margin = 2 * max(self.calc_grid)
+                self._dose_roi = self.dose.crop(self.structure.bounding_box, margin)
+            else:
+                self._dose_roi = self.dose
+        return self._dose_roi
 
     @property
     def calc_grid(self):
@@ -261,6 +338,36 @@ class DVHCalculation:
         else:
             self._calc_grid = value
 
+    @property
+    def engine(self):
+        return self._engine
+
+    @engine.setter
+    def engine(self, value):
+        if value not in DVH_ENGINES:
+            raise ValueError('DVH engine should be one of {}'.format(DVH_ENGINES))
+        self._engine = value
+
+    @property
+    def mask_backend(self):
+        return self._mask_backend
+
+    @mask_backend.setter
+    def mask_backend(self, value):
+        if value not in MASK_BACKENDS:
+            raise ValueError('Mask backend should be one of {}'.format(MASK_BACKENDS))
+        self._mask_backend = value
+
+    @property
+    def n_threads(self):
+        return self._n_threads
+
+    @n_threads.setter
+    def n_threads(self, value):
+        if int(value) < 1:
+            raise ValueError('Number of threads should be at least 1')
+        self._n_threads = int(value)
+
     # @timeit
     def calculate(self, verbose=False):
         """
@@ -279,11 +386,43 @@ class DVHCalculation:
             print('{} volume [cc]: {:0.1f}'.format(self.structure.name,
                                                    self.structure.volume))
 
+        if self.engine == 'stack':
+            return self.calculate_stack()
+
         max_dose = float(self.dose.dose_max_3d)
-        hist = np.zeros(self.n_bins)
+        z_planes = list(self.structure.planes.keys())
+        n_chunks = min(self.n_threads, len(z_planes))
+        if n_chunks > 1:
+            # interleaved chunks balance the small end planes against the large central ones
+            chunks = [z_planes[i::n_chunks] for i in range(n_chunks)]
+            with ThreadPoolExecutor(n_chunks) as executor:
+                res = list(executor.map(lambda c: self.calculate_planes(c, max_dose), chunks))
+            hist = np.sum([r[0] for r in res], axis=0)
+            plane_volumes = [None] * len(z_planes)
+            for i, r in enumerate(res):
+                plane_volumes[i::n_chunks] = r[1]
+        else:
+            hist, plane_volumes = self.calculate_planes(z_planes, max_dose)
+
+        # accumulate volumes in plane order
         volume = 0
+        for volume_plane in plane_volumes:
+            volume += volume_plane
+
+        # generate dvh dictionary
+        return self.prepare_dvh_data(volume, hist)
+
+    def calculate_planes(self, z_planes, max_dose):
+        """
+            Integrate the DVH over a subset of the structure planes
+        :param z_planes: plane positions (keys of structure planes)
+        :param max_dose: maximum dose of the histogram range
+        :return: partial histogram and the volume of each plane
+        """
+        hist = np.zeros(self.n_bins)
+        plane_volumes = []
         # integrate DVH over all planes (z axis)
-        for z in self.structure.planes.keys():
+        for z in z_planes:
             # Get the contours with calculated areas and the largest contour index
             contours, largest_index = self.structure.get_plane_contours_areas(
                 z)
@@ -293,30 +432,97 @@ class DVHCalculation:
                 contours, max_dose, z)
 
             hist += hist_plane
-            volume += volume_plane
+            plane_volumes.append(volume_plane)
 
-        # generate dvh dictionary
-        return self.prepare_dvh_data(volume, hist)
+        return hist, plane_volumes
 
-    def calculate_plane_dvh(self, contours, max_dose, z):
+    def calculate_stack(self):
+        """
+            Calculate a DVH sampling the dose once for the whole structure.
 
-        # Get Grid and Dose plane for the largest contour
-        plane_contour_points = np.vstack([c['data'] for c in contours])
-        contour_dose_grid, ctr_dose_lut = self.get_contour_roi_grid(
-            plane_contour_points, self.calc_grid)
+            Each plane is rasterized on its own contour ROI grid, as in the plane by plane
+            integration, so the sampled voxels are exactly the same. The voxel centers inside
+            the structure are stacked and the dose is interpolated and binned in a single call.
+        :return: dvh dict
+        """
+        max_dose = float(self.dose.dose_max_3d)
+        n_bins = self.n_bins
 
-        dose_plane = self.get_dose_plane(z, ctr_dose_lut)
+        z_planes = list(self.structure.planes.keys())
+        n_workers = min(self.n_threads, len(z_planes))
+        if n_workers > 1:
+            with ThreadPoolExecutor(n_workers) as executor:
+                plane_points = list(executor.map(self.get_plane_points, z_planes))
+        else:
+            plane_points = [self.get_plane_points(z) for z in z_planes]
+        x_stack, y_stack, z_stack = zip(*plane_points)
+
+        n_planes = len(z_stack)
+        plane_index = np.repeat(
+            np.arange(n_planes), [len(zs) for zs in z_stack])
+        points = np.column_stack((np.concatenate(x_stack),
+                                  np.concatenate(y_stack),
+                                  np.concatenate(z_stack)))
+        doses = self.dose_roi.get_values_to_points(points)
+
+        hist, edges = np.histogram(doses, bins=n_bins, range=(0, max_dose))
+
+        # voxels counted per plane, accumulated in plane order as in calculate()
+        in_range = (doses >= 0) & (doses <= max_dose)
+        plane_counts = np.bincount(
+            plane_index, weights=in_range, minlength=n_planes).astype(int)
+        volume = 0
+        for count in plane_counts:
+            volume += count * self.calc_grid[0] * self.calc_grid[
+                1] * self.calc_grid[2]
+
+        return self.prepare_dvh_data(volume, hist.astype(float))
+
+    def get_plane_points(self, z):
+        """
+            Voxel centers inside the structure at a plane
+        :param z: plane position (key of structure planes)
+        :return: x, y, z coordinates in mm
+        """
+        contours, largest_index = self.structure.get_plane_contours_areas(z)
+        grid, ctr_dose_lut = self.get_plane_mask(contours)
+        yi, xi = np.nonzero(grid)
+
+        return ctr_dose_lut[0][xi], ctr_dose_lut[1][yi], np.full(len(xi), float(z))
+
+    def get_plane_mask(self, contours):
+        """
+            Rasterize all contours of a plane on its contour ROI grid
+        :param contours: plane contours with calculated areas
+        :return: boolean mask and contour lookup table (x_lut, y_lut)
+        """
+        plane_contour_points = np.vstack([c['data'] for c in contours])
+        ctr_dose_lut = self.get_contour_roi_lut(plane_contour_points,
+                                                self.calc_grid)
+        if self.mask_backend == 'scanline':
+            # even-odd fill of all contours removes the holes
+            grid = get_contour_mask_scanline(ctr_dose_lut,
+                                             [c['data'] for c in contours])
+            return grid, ctr_dose_lut
 
         # pre allocate dose grid matrix
         grid = np.zeros(
-            (len(ctr_dose_lut[1]), len(ctr_dose_lut[0])), dtype=np.uint8)
+            (len(ctr_dose_lut[1]), len(ctr_dose_lut[0])), dtype=bool)
         for _, contour in enumerate(contours):
-            # rasterized dose plane inside contour
-            m = get_contour_mask_wn(ctr_dose_lut, contour_dose_grid,
-                                    contour['data'])
+            # rasterized dose plane inside contour (implicit grid points)
+            m = get_contour_mask_wn_grid(ctr_dose_lut, contour['data'])
 
             # using exclusive or operator to remove holes from each rasterized contour
-            grid = np.logical_xor(m.astype(np.uint8), grid).astype(np.bool)
+            np.logical_xor(grid, m, out=grid)
+
+        return grid, ctr_dose_lut
+
+    def calculate_plane_dvh(self, contours, max_dose, z):
+
+        # Get Grid and Dose plane for the largest contour
+        grid, ctr_dose_lut = self.get_plane_mask(contours)
+
+        dose_plane = self.get_dose_plane(z, ctr_dose_lut)
 
         hist_plane, volume_plane = self.calculate_contour_dvh(
             grid, dose_plane, self.n_bins, max_dose, self.calc_grid)
@@ -360,6 +566,21 @@ class DVHCalculation:
         :param fac:  number of margin delta of ROI
         :return: contour_grid and contour lookup table (mesh)
         """
+        contour_lut = self.get_contour_roi_lut(contour_points, delta_mm, fac)
+        xg, yg = np.meshgrid(contour_lut[0], contour_lut[1])
+        xf, yf = xg.flatten(), yg.flatten()
+        contour_grid = np.vstack((xf, yf)).T
+
+        return contour_grid, contour_lut
+
+    def get_contour_roi_lut(self, contour_points, delta_mm, fac=1):
+        """
+            Returns a boundary contour ROI lookup table
+        :param contour_points:
+        :param delta_mm: (dx,dy) in mm
+        :param fac:  number of margin delta of ROI
+        :return: contour lookup table [x_lut, y_lut]
+        """
         x = contour_points[:, 0]
         y = contour_points[:, 1]
         x_min = x.min() - delta_mm[0] * fac
@@ -368,44 +589,31 @@ class DVHCalculation:
         y_max = y.max() + delta_mm[1] * fac
         x_lut, x_delta = self.get_axis_grid(delta_mm[0], [x_min, x_max])
         y_lut, y_delta = self.get_axis_grid(delta_mm[1], [y_min, y_max])
-        xg, yg = np.meshgrid(x_lut, y_lut)
-        xf, yf = xg.flatten(), yg.flatten()
-        contour_grid = np.vstack((xf, yf)).T
-        contour_lut = [x_lut, y_lut]
 
-        return contour_grid, contour_lut
+        return [x_lut, y_lut]
 
     @staticmethod
     def get_axis_grid(delta_mm, grid_axis):
         """
-            Returns the up sampled axis by given resolution in mm
+            Returns the up sampled axis by given resolution in mm.
+            Axes are cached (LRU) and read-only.
 
         :param delta_mm: desired resolution
         :param grid_axis: x,y,x axis from LUT
         :return: up sampled axis and delta grid
         """
-        fc = (delta_mm + abs(grid_axis[-1] - grid_axis[0])) / (
-            delta_mm * len(grid_axis))
-        n_grid = int(round(len(grid_axis) * fc))
-
-        up_sampled_axis, dt = np.linspace(
-            grid_axis[0], grid_axis[-1], n_grid, retstep=True)
-
-        # avoid inverted axis swap.  Always absolute step
-        dt = abs(dt)
-
-        return up_sampled_axis, dt
+        return get_axis_grid_cached(delta_mm, grid_axis)
 
     @staticmethod
     def calculate_contour_dvh(mask, doseplane, bins, maxdose, grid_delta):
         """Calculate the differential DVH for the given contour and dose plane."""
 
-        # Multiply the structure mask by the dose plane to get the dose mask
-        mask1 = ma.array(doseplane, mask=~mask)
+        # dose voxels inside the structure mask
+        dose_inside = doseplane[mask]
 
         # Calculate the differential dvh
         hist, edges = np.histogram(
-            mask1.compressed(), bins=bins, range=(0, maxdose))
+            dose_inside, bins=bins, range=(0, maxdose))
 
         # Calculate the volume for the contour for the given dose plane
         vol = np.sum(hist) * grid_delta[0] * grid_delta[1] * grid_delta[2]
@@ -414,7 +622,6 @@ class DVHCalculation:
 
     def prepare_dvh_data(self, volume, hist):
         # TODO prepare it to be like DICOM RD dvh data
-        # TODO create a serialised DVH storage format
         # volume units are given in cm^3
         volume /= 1000
         # Rescale the histogram to reflect the total volume
@@ -446,8 +653,9 @@ class DVHCalculation:
         #     'mean': get_dvh_mean(cdvh) * scaling
         # }
 
+        # ndarray data, converted to lists only when saved to JSON
         dvh_data = {
-            'data': list(np.round(cdvh, 2)),  # round 3 decimal
+            'data': np.round(cdvh, 2),  # round 2 decimal
             'bins': len(cdvh),
             'type': 'CUMULATIVE',
             'doseunits': units,
@@ -455,21 +663,29 @@ class DVHCalculation:
             'scaling': scaling,
             'roi_number': self.structure.roi_number,
             'name': self.structure.name,
-            'min': np.round(get_dvh_min(cdvh) * scaling, 2),
-            'max': np.round(get_dvh_max(cdvh, scaling) * scaling, 2),
-            'mean': np.round(get_dvh_mean(cdvh) * scaling, 2)
+            'min': float(np.round(get_dvh_min(cdvh) * scaling, 2)),
+            'max': float(np.round(get_dvh_max(cdvh, scaling) * scaling, 2)),
+            'mean': float(np.round(get_dvh_mean(cdvh) * scaling, 2))
         }
 
         return dvh_data
 
 
 class DVHCalculationMP:
-    def __init__(self, dose, structures, grids, verbose=True):
+    def __init__(self, dose, structures, grids, verbose=True, engine='plane', mask_backend='scanline',
+                 mp_backend='loky', num_cores=-1, n_threads=1, binning='fixed', bin_width=0.01, scheduler=None):
         self._grids = None
         self._dose = None
         self._structures = None
         self.dvhs = {}
         self.verbose = verbose
+        self.engine = engine
+        self.mask_backend = mask_backend
+        self.n_threads = n_threads
+        self.binning = binning
+        self.bin_width = bin_width
+        # a given scheduler keeps the timings of this run, e.g. the DVHCalculator one
+        self.scheduler = scheduler if scheduler is not None else DVHScheduler(mp_backend, num_cores)
         # setters
         self.structures = structures
         self.dose = dose
@@ -527,8 +743,39 @@ class DVHCalculationMP:
     def calc_data(self):
         return dict(zip(self.structures, self.grids))
 
+    def estimate_cost(self, structure, grid):
+        """
+            Estimated relative cost of a structure DVH calculation.
+            Linear model on the number of calculation voxels, contour vertices and planes
+            weighted by COST_WEIGHTS.
+        :param structure: PyStructure instance
+        :param grid: grid delta (dx, dy, dz) or None
+        :return: estimated cost
+        """
+        planes = structure.planes
+        n_planes = len(planes)
+        n_vertices = sum(len(c['contourData']) for plane in planes.values() for c in plane)
+
+        dz = structure.contour_spacing
+        if grid is not None:
+            dx, dy, dz_up = grid
+            # z up-sampling interpolates new planes between the contours
+            z_factor = max(dz / dz_up, 1.0)
+            dz = dz_up
+        elif isinstance(self.dose, Dose3D):
+            dx, dy, z_factor = self.dose.x_res, self.dose.y_res, 1.0
+        else:
+            dx, dy, z_factor = dz, dz, 1.0
+
+        n_voxels = structure.volume * 1000.0 / (dx * dy * dz)
+
+        return (COST_WEIGHTS['voxels'] * n_voxels +
+                COST_WEIGHTS['vertices'] * n_vertices * z_factor +
+                COST_WEIGHTS['planes'] * n_planes * z_factor)
+
     @staticmethod
-    def calculate(structure, grid, dose, verbose):
+    def calculate(structure, grid, dose, verbose, engine='plane', mask_backend='scanline', n_threads=1,
+                  binning='fixed', bin_width=0.01):
         """
             Calculate DVH per structure
 
@@ -540,24 +787,67 @@ class DVHCalculationMP:
         :type dose: Dose3D
         :param verbose: Prints message to terminal
         :type verbose: bool
+        :param engine: DVH engine - 'plane' or 'stack'
+        :type engine: str
+        :param mask_backend: contour rasterization - 'scanline' or 'wn'
+        :type mask_backend: str
+        :param n_threads: number of threads splitting the structure planes
+        :type n_threads: int
+        :param binning: dose bins - 'fixed' or 'relative'
+        :type binning: str
+        :param bin_width: bin width
+        :type bin_width: float
         :return: DVH calculated
         :rtype: dict
         """
 
-        dvh_calc = DVHCalculation(structure, dose, calc_grid=grid)
+        dvh_calc = DVHCalculation(
+            structure, dose, calc_grid=grid, engine=engine, mask_backend=mask_backend, n_threads=n_threads,
+            binning=binning, bin_width=bin_width)
         res = dvh_calc.calculate(verbose)
         # map thread/process result to its roi number
         res['roi_number'] = structure.roi_number
         return res
 
+    def _remove_tmp_dir(self, tmp_dir):
+        try:
+            shutil.rmtree(tmp_dir)
+        except OSError:
+            # Windows does not remove files still mapped by worker processes
+            self.scheduler.shutdown()
+            try:
+                shutil.rmtree(tmp_dir)
+            except OSError as e:
+                logger.warning('Temporary dose directory %s not removed: %s', tmp_dir, e)
+
     # @timeit
     def calculate_dvh_mp(self):
 
         if self.verbose:
             print(" ---- Starting multiprocessing -----")
 
-        res = Parallel(n_jobs=-1)(delayed(self.calculate)(s, g, self.dose, self.verbose)
-                         for s, g in self.calc_data.items())
+        # workers attach to a memory-mapped copy of the dose matrix instead of
+        # receiving the full Dose3D pickled within each task
+        tmp_dir = tempfile.mkdtemp(prefix='pyplanscoring_')
+        try:
+            dose = self.dose
+            if (isinstance(dose, Dose3D) and self.scheduler.uses_processes
+                    and not isinstance(dose.values, np.memmap)):
+                dose = dose.to_memmap(os.path.join(tmp_dir, 'dose.npy'))
+
+            tasks = [(s, g, dose, self.verbose, self.engine, self.mask_backend, self.n_threads,
+                      self.binning, self.bin_width)
+                     for s, g in zip(self.structures, self.grids)]
+            costs = [self.estimate_cost(s, g) for s, g in zip(self.structures, self.grids)]
+            res = self.scheduler.map(self.calculate, tasks, costs)
+        finally:
+            # drop the memory map references before removing its file
+            dose = tasks = None
+            self._remove_tmp_dir(tmp_dir)
+
+        for s, cost, elapsed in zip(self.structures, costs, self.scheduler.timings):
+            logger.info('DVH %s - estimated cost: %.4g - elapsed: %.3f s', s.name, cost, elapsed)
+
         # map name, grid and roi_number
         cdvh = {}
         for struc_dvh in res:
@@ -574,6 +864,8 @@ class DVHCalculator:
         self._rt_case = None
         self._calculation_options = None
         self._dvh_data = {}
+        self._scheduler = None
+        self._scheduler_options = None
         self.iteration = 0
 
         # setters
@@ -598,6 +890,7 @@ class DVHCalculator:
     @calculation_options.setter
     def calculation_options(self, value):
         self._calculation_options = value
+        self._scheduler = None
 
     @property
     def dvh_data(self):
@@ -636,6 +929,92 @@ class DVHCalculator:
     def up_sampling(self):
         return self.calculation_options['up_sampling']
 
+    @property
+    def engine(self):
+        """
+            Return the DVH engine. Defaults to the plane by plane integration.
+        :return: 'plane' or 'stack'
+        """
+        return self.calculation_options.get('dvh_engine', 'plane')
+
+    @property
+    def mask_backend(self):
+        """
+            Return the contour rasterization backend. Defaults to the even-odd scanline fill.
+        :return: 'scanline' or 'wn'
+        """
+        return self.calculation_options.get('mask_backend', 'scanline')
+
+    @property
+    def mp_backend(self):
+        """
+            Return the execution backend - serial, threading, multiprocessing or loky
+        """
+        return self.calculation_options.get('mp_backend', 'loky')
+
+    @property
+    def num_cores(self):
+        """
+            Return the maximum number of cores. Values <= 0 use all cpus.
+        """
+        return self.calculation_options.get('num_cores', -1)
+
+    @property
+    def plane_threads(self):
+        """
+            Return the number of threads splitting the planes of each structure
+        """
+        return self.calculation_options.get('plane_threads', 1)
+
+    @property
+    def binning(self):
+        """
+            Return the DVH dose binning - 'fixed' or 'relative'
+        """
+        return self.calculation_options.get('dvh_binning', 'fixed')
+
+    @property
+    def bin_width(self):
+        """
+            Return the DVH bin width - dose unit (fixed) or fraction of the maximum dose (relative)
+        """
+        return self.calculation_options.get('dvh_bin_width', 0.01)
+
+    @property
+    def dvh_format(self):
+        """
+            Return the DVH storage format - 'dense', 'rle' or 'adaptive'
+        """
+        return self.calculation_options.get('dvh_format', 'dense')
+
+    @property
+    def dose_precision(self):
+        """
+            Return the dose storage precision. float32 and raw (pixel data plus DoseGridScaling)
+            trade a small round-off for half or less of the dose matrix memory.
+        :return: 'float64', 'float32' or 'raw'
+        """
+        return self.calculation_options.get('dose_precision', 'float64')
+
+    @property
+    def dose_memmap(self):
+        """
+            Return True if the RTDOSE pixel data is memory-mapped instead of loaded
+        """
+        return self.calculation_options.get('dose_memmap', False)
+
+    @property
+    def scheduler(self):
+        """
+            Return the DVHScheduler of the mp_backend and num_cores options.
+            It keeps the timings of the last calculation and is built again when these options change.
+        """
+        options = (self.mp_backend, self.num_cores)
+        if self._scheduler is None or self._scheduler_options != options:
+            self._scheduler = DVHScheduler(*options)
+            self._scheduler_options = options
+        return self._scheduler
+
     def get_grid_array(self, structures_py):
         grids = []
         for s in structures_py:
@@ -660,17 +1039,33 @@ class DVHCalculator:
         :return:
         """
         structures_py, grids = self.calculation_setup
-        calc_mp = DVHCalculationMP(dose_3d, structures_py, grids)
+        calc_mp = DVHCalculationMP(
+            dose_3d, structures_py, grids, engine=self.engine, mask_backend=self.mask_backend,
+            n_threads=self.plane_threads, binning=self.binning, bin_width=self.bin_width,
+            scheduler=self.scheduler)
         self._dvh_data = calc_mp.calculate_dvh_mp()
         return dict(self._dvh_data)
 
+    def calculate(self, dose_3d):
+        """
+            Calculate DVH's using the mp_backend and num_cores calculation options
+        :param dose_3d: Dose3D object
+        :return: dvh dict
+        """
+        if self.scheduler.backend == 'serial' or self.num_cores == 1:
+            return self.calculate_all(dose_3d)
+
+        return self.calculate_mp(dose_3d)
+
     @timeit
     def calculate_all(self, dose_3d):
         structures_py, grids = self.calculation_setup
 
         cdvh = {}
         for structure, grid in zip(structures_py, grids):
-            dvh_calc = DVHCalculation(structure, dose_3d, calc_grid=grid)
+            dvh_calc = DVHCalculation(
+                structure, dose_3d, calc_grid=grid, engine=self.engine, mask_backend=self.mask_backend,
+                n_threads=self.plane_threads, binning=self.binning, bin_width=self.bin_width)
             res = dvh_calc.calculate(True)
             # map thread/process result to its roi number
             res['roi_number'] = structure.roi_number
@@ -710,5 +1105,21 @@ def get_calculation_options(ini_file_path):
     calculation_options['save_dvh_data'] = config.getboolean(
         'DEFAULT', 'save_dvh_data')
     calculation_options['mp_backend'] = config['DEFAULT']['mp_backend']
+    calculation_options['dvh_engine'] = config.get(
+        'DEFAULT', 'dvh_engine', fallback='plane')
+    calculation_options['mask_backend'] = config.get(
+        'DEFAULT', 'mask_backend', fallback='scanline')
+    calculation_options['plane_threads'] = config.getint(
+        'DEFAULT', 'plane_threads', fallback=1)
+    calculation_options['dose_precision'] = config.get(
+        'DEFAULT', 'dose_precision', fallback='float64')
+    calculation_options['dose_memmap'] = config.getboolean(
+        'DEFAULT', 'dose_memmap', fallback=False)
+    calculation_options['dvh_binning'] = config.get(
+        'DEFAULT', 'dvh_binning', fallback='fixed')
+    calculation_options['dvh_bin_width'] = config.getfloat(
+        'DEFAULT', 'dvh_bin_width', fallback=0.01)
+    calculation_options['dvh_format'] = config.get(
+        'DEFAULT', 'dvh_format', fallback='dense')
 
     return calculation_options
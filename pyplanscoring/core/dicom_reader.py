@@ -4,7 +4,12 @@
 # Copyright (c) 2009-2010 Roy Keyes
 # This file based on part of dicompyler-core, released under a BSD license.
 
+import os
 import random
+import threading
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from math import pow, sqrt
 
 from PIL import Image
@@ -12,11 +17,39 @@ from PIL import Image
 import numpy as np
 
 import pydicom as dicom
+from pydicom.filereader import read_partial
 
 from scipy.interpolate import RegularGridInterpolator, interp1d
 
-from .geometry import centroid_of_polygon
-from .types import Dose3D, DoseUnit
+from .geometry import centroids_of_polygons
+from .types import DOSE_PRECISIONS, Dose3D, DoseUnit
+
+# ContourData (3006,0050)
+CONTOUR_DATA_TAG = 0x30060050
+
+# Modality (0008,0060)
+MODALITY_TAG = 0x00080060
+
+# ROIContourSequence (3006,0039) - the bulky part of RT structure sets
+ROI_CONTOUR_SEQUENCE_TAG = 0x30060039
+
+# ReferencedStructureSetSequence (300C,0060) - the last UID reference of RT plans and doses
+REFERENCED_STRUCTURE_SET_TAG = 0x300C0060
+
+# Tags read by get_dicom_header
+HEADER_TAGS = ['SOPClassUID', 'SOPInstanceUID', 'Modality', 'FrameOfReferenceUID',
+               'ReferencedFrameOfReferenceSequence', 'ReferencedRTPlanSequence', 'ReferencedStructureSetSequence']
+
+# DICOM object type of each SOP Class UID - http://www.dicomlibrary.com/dicom/sop/
+SOP_CLASS_TYPES = {
+    '1.2.840.10008.5.1.4.1.1.481.2': 'rtdose',
+    '1.2.840.10008.5.1.4.1.1.481.3': 'rtss',
+    '1.2.840.10008.5.1.4.1.1.481.5': 'rtplan',
+    # Radiation Therapy Ion Plan Storage
+    '1.2.840.10008.5.1.4.1.1.481.8': 'rtplan',
+    '1.2.840.10008.5.1.4.1.1.2': 'ct',
+}
+
 '''
 
 http://dicom.nema.org/medical/Dicom/2016b/output/chtml/part03/sect_C.8.8.html
@@ -25,6 +58,145 @@ http://dicom.nema.org/medical/Dicom/2016b/output/chtml/part03/sect_C.7.6.2.html#
 '''
 
 
+def _after_modality(tag, vr, length):
+    # SOPClassUID (0008,0016) and Modality (0008,0060) are at the start of the dataset
+    return tag > MODALITY_TAG
+
+
+def get_dicom_type(filename):
+    """
+        DICOM object type of a file, reading only the file meta and the SOPClassUID and Modality tags.
+        Parsing stops right after the Modality tag, well before the pixel data.
+        Unknown SOP classes fall back to the modality, e.g. Halcyon RT objects.
+    :param filename: DICOM file path
+    :return: 'rtdose', 'rtss', 'rtplan', 'ct', the lower case modality or None
+    """
+    with open(filename, 'rb') as fp:
+        ds = read_partial(fp, stop_when=_after_modality, force=True, specific_tags=['SOPClassUID', 'Modality'])
+
+    return _get_rt_type(ds, filename)
+
+
+def _get_rt_type(ds, filename):
+    # no SOPClassUID - it probably isn't DICOM
+    if 'SOPClassUID' not in ds:
+        raise AttributeError('SOPClassUID not found: %s' % filename)
+
+    rt_type = SOP_CLASS_TYPES.get(ds.SOPClassUID)
+    if rt_type is None and 'Modality' in ds:
+        rt_type = ds.Modality.lower()
+
+    return rt_type
+
+
+def _after_references(tag, vr, length):
+    # stops before the ROI contours of structure sets and the pixel data of doses
+    return tag == ROI_CONTOUR_SEQUENCE_TAG or tag > REFERENCED_STRUCTURE_SET_TAG
+
+
+def _uid_str(uid):
+    return None if uid is None else str(uid)
+
+
+def _referenced_uid(ds, keyword, uid_keyword='ReferencedSOPInstanceUID'):
+    sequence = ds.get(keyword)
+    if sequence:
+        return _uid_str(sequence[0].get(uid_keyword))
+
+
+def get_dicom_header(filename):
+    """
+        DICOM object type and the UIDs linking RT objects, reading only the header tags listed on HEADER_TAGS
+    :param filename: DICOM file path
+    :return: dict with rt_type, sop_class_uid, sop_instance_uid, frame_of_reference_uid,
+        referenced_rtss_uid and referenced_plan_uid. Missing UIDs are None.
+    """
+    with open(filename, 'rb') as fp:
+        ds = read_partial(fp, stop_when=_after_references, force=True, specific_tags=HEADER_TAGS)
+
+    rt_type = _get_rt_type(ds, filename)
+    frame_of_reference_uid = _uid_str(ds.get('FrameOfReferenceUID'))
+    # RT structure sets hold it on the referenced frame of reference sequence
+    if frame_of_reference_uid is None:
+        frame_of_reference_uid = _referenced_uid(ds, 'ReferencedFrameOfReferenceSequence', 'FrameOfReferenceUID')
+
+    return {'rt_type': rt_type,
+            'sop_class_uid': str(ds.SOPClassUID),
+            'sop_instance_uid': _uid_str(ds.get('SOPInstanceUID')),
+            'frame_of_reference_uid': frame_of_reference_uid,
+            'referenced_rtss_uid': _referenced_uid(ds, 'ReferencedStructureSetSequence'),
+            'referenced_plan_uid': _referenced_uid(ds, 'ReferencedRTPlanSequence')}
+
+
+def get_dicom_types(files, max_workers=None):
+    """
+        DICOM object types of many files, read concurrently on a thread pool
+    :param files: DICOM file paths
+    :param max_workers: number of threads. None uses the ThreadPoolExecutor default.
+    :return: list of (rt_type, filename) in files order
+    """
+    files = list(files)
+    if len(files) < 2:
+        return [(get_dicom_type(f), f) for f in files]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(zip(executor.map(get_dicom_type, files), files))
+
+
+class LazyStructure(MutableMapping):
+    """
+        Structure dict that decodes the ROI contours on first access of a key it does not hold yet.
+        The id, name and RTROIType keys are available without decoding.
+        Copies and pickles as a plain dict.
+    """
+
+    def __init__(self, data, loader):
+        """
+        :param data: ROI keys already read
+        :param loader: callable returning the remaining ROI keys
+        """
+        self._data = dict(data)
+        self._loader = loader
+        self._lock = threading.Lock()
+
+    @property
+    def is_loaded(self):
+        return self._loader is None
+
+    def load(self):
+        with self._lock:
+            if self._loader is not None:
+                self._data.update(self._loader())
+                self._loader = None
+
+    def __getitem__(self, key):
+        if key not in self._data:
+            self.load()
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self.load()
+        self._data[key] = value
+
+    def __delitem__(self, key):
+        self.load()
+        del self._data[key]
+
+    def __iter__(self):
+        self.load()
+        return iter(self._data)
+
+    def __len__(self):
+        self.load()
+        return len(self._data)
+
+    def __reduce__(self):
+        return dict, (dict(self), )
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
 class DicomParserBase(object):
     """Class that parses and returns formatted DICOM RT data."""
     """Parses DICOM / DICOM RT files."""
@@ -59,6 +231,10 @@ class DicomParserBase(object):
         else:
             raise AttributeError
 
+        # cached image transforms
+        self._pixel_to_patient = None
+        self._patient_to_pixel_lut = None
+
             ######################## SOP Class and Instance Methods ########################
 
     def GetSOPClassUID(self):
@@ -263,31 +439,68 @@ class DicomParserBase(object):
         # an 8-bit grayscale LUT since the range is only from 0 to 255
         return np.array(lutvalue, dtype=np.uint8)
 
+    def _get_grid_affine(self):
+        # image transformation matrix with the reader conventions, computed once per parser, read only
+        if self._pixel_to_patient is None:
+            di = float(self.ds.PixelSpacing[0])
+            dj = float(self.ds.PixelSpacing[1])
+            orientation = [float(v) for v in self.ds.ImageOrientationPatient]
+            affine = np.eye(4)
+            affine[0, 0] = orientation[0] * di
+            affine[1, 1] = orientation[4] * dj
+            affine[2, 2] = orientation[0]
+            affine[:3, 3] = [float(v) for v in self.ds.ImagePositionPatient]
+            affine.flags.writeable = False
+            self._pixel_to_patient = affine
+
+        return self._pixel_to_patient
+
+    def get_pixel_to_patient_affine(self):
+        """
+            Image transformation matrix of the grid returned by get_grid_3d.
+            Maps (column, row, frame offset, 1) to patient (x, y, z, 1) in mm, where frame offsets are
+            GridFrameOffsetVector values. Columns are scaled by PixelSpacing[0], rows by PixelSpacing[1]
+            and frame offsets by the ImageOrientationPatient[0] sign, as GetPatientToPixelLUT and get_grid_3d.
+            The matrix is cached on the parser and read only.
+        :return: 4x4 numpy.ndarray
+        """
+        self._check_axis_aligned()
+        return self._get_grid_affine()
+
+    def is_axis_aligned(self, tolerance=1e-4):
+        """
+            Whether image rows run along the patient x axis and columns along the y axis
+        :param tolerance: direction cosine tolerance
+        :return: bool
+        """
+        orientation = np.abs(np.array(self.ds.ImageOrientationPatient, dtype=float))
+        return bool(np.allclose(orientation, [1, 0, 0, 0, 1, 0], atol=tolerance))
+
+    def _check_axis_aligned(self):
+        if not self.is_axis_aligned():
+            raise ValueError('Oblique ImageOrientationPatient {} is not supported on dose grids'.format(
+                list(self.ds.ImageOrientationPatient)))
+
+    def _get_patient_to_pixel_lut(self):
+        # x and y lookup tables computed once per parser, read only
+        if self._patient_to_pixel_lut is None:
+            affine = self._get_grid_affine()
+            x = affine[0, 0] * np.arange(self.ds.Columns) + affine[0, 3]
+            y = affine[1, 1] * np.arange(self.ds.Rows) + affine[1, 3]
+            x.flags.writeable = False
+            y.flags.writeable = False
+            self._patient_to_pixel_lut = x, y
+
+        return self._patient_to_pixel_lut
+
     def GetPatientToPixelLUT(self):
-        """Get the image transformation matrix from the DICOM standard Part 3
-            Section C.7.6.2.1.1"""
-
-        di = self.ds.PixelSpacing[0]
-        dj = self.ds.PixelSpacing[1]
-        orientation = self.ds.ImageOrientationPatient
-        position = self.ds.ImagePositionPatient
-
-        m = np.matrix(
-            [[orientation[0] * di, orientation[3] * dj, 0, position[0]],
-             [orientation[1] * di, orientation[4] * dj, 0, position[1]],
-             [orientation[2] * di, orientation[5] * dj, 0,
-              position[2]], [0, 0, 0, 1]])
-
-        x = []
-        y = []
-        for i in range(0, self.ds.Columns):
-            imat = m * np.matrix([[i], [0], [0], [1]])
-            x.append(float(imat[0]))
-        for j in range(0, self.ds.Rows):
-            jmat = m * np.matrix([[0], [j], [0], [1]])
-            y.append(float(jmat[1]))
-
-        return x, y
+        """
+            Patient x coordinate of each column and y coordinate of each row, the first row and column of
+            the image transformation matrix with x scaled by PixelSpacing[0] and y by PixelSpacing[1].
+        :return: x, y lists
+        """
+        x, y = self._get_patient_to_pixel_lut()
+        return x.tolist(), y.tolist()
 
     ########################### RT Structure Set Methods ###########################
 
@@ -766,8 +979,40 @@ class PyDicomParser(DicomParserBase):
         :return: array of contour points
         :rtype:numpy.ndarray
         """
+        points = np.asarray(array, dtype=float)
+        # incomplete trailing points are dropped
+        return points[:len(points) // 3 * 3].reshape(-1, 3)
 
-        return np.asarray(list(zip(*[iter(array)] * 3)), dtype=float)
+    def get_contour_data(self, contour):
+        """
+            ContourData of a ContourSequence item as a (n, 3) array.
+            Not yet converted elements are parsed straight from the raw DS bytes,
+            without creating one DSfloat per coordinate. Malformed values raise ValueError.
+        :param contour: ContourSequence item
+        :return: array of contour points
+        """
+        value = contour.get_item(CONTOUR_DATA_TAG).value
+        if isinstance(value, bytes):
+            text = value.decode('ascii').rstrip('\x00 ')
+            if text:
+                return self.GetContourPoints(np.array(text.split('\\'), dtype=float))
+
+        return self.GetContourPoints(contour.ContourData)
+
+    @staticmethod
+    def set_contours_centroids(planes):
+        """
+            Adds the centroid of each contour to its plane dictionary
+        :param planes: list of plane dictionaries
+        """
+        if not planes:
+            return
+        points = [p['contourData'] for p in planes]
+        starts = np.cumsum([0] + [len(c) for c in points[:-1]])
+        points = np.concatenate(points)
+        centroids, _ = centroids_of_polygons(points[:, 0], points[:, 1], starts)
+        for plane, (x, y) in zip(planes, centroids.tolist()):
+            plane['centroid'] = (x, y)
 
     def GetStructureInfo(self):
         structure = {}
@@ -778,8 +1023,13 @@ class PyDicomParser(DicomParserBase):
 
         return structure
 
-    def GetStructures(self):
-        """Returns the structures (ROIs) with their coordinates."""
+    def GetStructures(self, lazy=False):
+        """Returns the structures (ROIs) with their coordinates.
+
+        :param lazy: decode the contours of each ROI only on first access of its color, thickness or planes
+        :type lazy: bool
+        :return: structures dict by ROI number
+        """
 
         structures = {}
 
@@ -805,102 +1055,155 @@ class PyDicomParser(DicomParserBase):
 
         # The coordinate data of each ROI is stored within ROIContourSequence
         if 'ROIContourSequence' in self.ds:
+            # plane keys of each z position
+            z_keys = {}
             for roi in self.ds.ROIContourSequence:
                 number = roi.ReferencedROINumber
+                if lazy:
+                    structures[number] = LazyStructure(structures[number], partial(self.get_roi_contours, roi, z_keys))
+                else:
+                    structures[number].update(self.get_roi_contours(roi, z_keys))
 
-                # Generate a random color for the current ROI
-                structures[number]['color'] = np.array(
-                    (random.randint(0, 255), random.randint(0, 255),
-                     random.randint(0, 255)),
-                    dtype=float)
-                # Get the RGB color triplet for the current ROI if it exists
-                if 'ROIDisplayColor' in roi:
-                    # Make sure the color is not none
-                    if not (roi.ROIDisplayColor is None):
-                        color = roi.ROIDisplayColor
-                    # Otherwise decode values separated by forward slashes
-                    else:
-                        value = roi[0x3006, 0x002a].repval
-                        color = value.strip("'").split("/")
-                    # Try to convert the detected value to a color triplet
-                    try:
-                        structures[number]['color'] = \
-                            np.array(color, dtype=float)
-                    # Otherwise fail and fallback on the random color
-                    except:
-                        pass
-
-                        # logger.debug(
-                        #     "Unable to decode display color for ROI #%s",
-                        #     str(number))
-
-                planes = {}
-                if 'ContourSequence' in roi:
-                    # Locate the contour sequence for each referenced ROI
-                    for contour in roi.ContourSequence:
-                        # For each plane, initialize a new plane dictionary
-                        plane = {}
-
-                        # Determine all the plane properties
-                        plane['geometricType'] = contour.ContourGeometricType
-                        plane[
-                            'numContourPoints'] = contour.NumberOfContourPoints
-                        contour_data = self.GetContourPoints(
-                            contour.ContourData)
-                        plane['contourData'] = contour_data
-                        # add info about contour centroid
-
-                        # TODO DEBUG centroid calculation on XiO
-                        # if contour.roi not in ['POINT', 'ISOCENTER']:
-                        try:
-                            plane['centroid'] = centroid_of_polygon(
-                                contour_data[:, 0], contour_data[:, 1])
-                            # Each plane which coincides with a image slice will have a unique ID
-                        except:
-                            plane['centroid'] = (contour_data[:, 0].mean(),
-                                                 contour_data[:, 1].mean())
-                        # plane['centroid'] = np.median(contour_data[:, 0]), np.median(contour_data[:, 1])
-
-                        if 'ContourImages' in contour:
-                            plane['UID'] = contour.ContourImages[
-                                0].ReferencedSOPInstanceUID
-
-                        # Add each plane to the planes dictionary of the current ROI
-                        if 'geometricType' in plane:
-                            # Fixed bug on import z Position on -1.0 < z < 0.0 not using #.replace('-0', '0')
-                            z = ('%.2f' % plane['contourData'][0][2])
-                            if z not in planes.keys():
-                                planes[z] = []
-                            planes[z].append(plane)
+        return structures
 
-                # Calculate the plane thickness for the current ROI
-                structures[number]['thickness'] = self.CalculatePlaneThickness(
-                    planes)
+    def get_roi_contours(self, roi, z_keys=None):
+        """
+            Decodes the color, plane thickness and planes of a ROIContourSequence item
+        :param roi: ROIContourSequence item
+        :param z_keys: cache of plane keys by z position
+        :return: dict with color, thickness and planes keys
+        """
+        if z_keys is None:
+            z_keys = {}
+        data = {}
 
-                # Add the planes dictionary to the current ROI
-                # print(planes)
-                structures[number]['planes'] = planes
+        # Generate a random color for the current ROI
+        data['color'] = np.array(
+            (random.randint(0, 255), random.randint(0, 255),
+             random.randint(0, 255)),
+            dtype=float)
+        # Get the RGB color triplet for the current ROI if it exists
+        if 'ROIDisplayColor' in roi:
+            # Make sure the color is not none
+            if not (roi.ROIDisplayColor is None):
+                color = roi.ROIDisplayColor
+            # Otherwise decode values separated by forward slashes
+            else:
+                value = roi[0x3006, 0x002a].repval
+                color = value.strip("'").split("/")
+            # Try to convert the detected value to a color triplet
+            try:
+                data['color'] = np.array(color, dtype=float)
+            # Otherwise fail and fallback on the random color
+            except:
+                pass
+
+                # logger.debug(
+                #     "Unable to decode display color for ROI #%s",
+                #     str(number))
+
+        planes = {}
+        if 'ContourSequence' in roi:
+            roi_planes = []
+            # Locate the contour sequence for each referenced ROI
+            for contour in roi.ContourSequence:
+                # For each plane, initialize a new plane dictionary
+                plane = {}
+
+                # Determine all the plane properties
+                plane['geometricType'] = contour.ContourGeometricType
+                plane['numContourPoints'] = contour.NumberOfContourPoints
+                plane['contourData'] = self.get_contour_data(contour)
+
+                if 'ContourImages' in contour:
+                    plane['UID'] = contour.ContourImages[
+                        0].ReferencedSOPInstanceUID
+
+                roi_planes.append(plane)
+
+            # add info about contour centroids, calculated for all ROI contours at once
+            # TODO DEBUG centroid calculation on XiO
+            self.set_contours_centroids(roi_planes)
+
+            for plane in roi_planes:
+                # Add each plane to the planes dictionary of the current ROI
+                # Fixed bug on import z Position on -1.0 < z < 0.0 not using #.replace('-0', '0')
+                z_pos = plane['contourData'][0][2]
+                if z_pos not in z_keys:
+                    z_keys[z_pos] = '%.2f' % z_pos
+                planes.setdefault(z_keys[z_pos], []).append(plane)
+
+        # Calculate the plane thickness for the current ROI
+        data['thickness'] = self.CalculatePlaneThickness(planes)
+
+        # Add the planes dictionary to the current ROI
+        data['planes'] = planes
 
-        return structures
+        return data
 
     def get_grid_3d(self):
+        """
+            x, y and z axes of an axis aligned dose grid, in patient coordinates
+        :return: x, y, z numpy.ndarray
+        """
+        self._check_axis_aligned()
         # Get the dose to pixel LUT
-        doselut = self.GetPatientToPixelLUT()
-        # Get the initial self grid Position (z) in patient coordinates
-        imagepatpos = float(self.ds.ImagePositionPatient[2])
-        orientation = float(self.ds.ImageOrientationPatient[0])
+        x, y = self._get_patient_to_pixel_lut()
+        affine = self._get_grid_affine()
 
         # Add the Position to the offset vector to determine the
         # z coordinate of each dose plane
-        z = orientation * np.array(self.ds.GridFrameOffsetVector) + imagepatpos
-        x = np.asarray(doselut[0])
-        y = np.asarray(doselut[1])
+        z = affine[2, 2] * np.array(self.ds.GridFrameOffsetVector, dtype=float) + affine[2, 3]
 
-        return x, y, z
+        return np.array(x), np.array(y), z
 
-    def get_dose_matrix(self):
-        return self.ds.pixel_array * float(
-            self.ds.DoseGridScaling)  # 3D dose matrix in Gy
+    def get_dose_matrix(self, precision='float64'):
+        """
+            3D dose matrix in Gy
+        :param precision: 'float64', 'float32' or 'raw' (pixel data, not scaled by DoseGridScaling)
+        :return: numpy.ndarray
+        """
+        if precision not in DOSE_PRECISIONS:
+            raise ValueError('Dose precision should be one of {}'.format(DOSE_PRECISIONS))
+        if precision == 'raw':
+            return self.ds.pixel_array
+        if precision == 'float32':
+            return self.ds.pixel_array.astype(np.float32) * np.float32(self.ds.DoseGridScaling)
+        return self.ds.pixel_array * float(self.ds.DoseGridScaling)
+
+    def get_dose_memmap(self):
+        """
+            Raw RTDOSE pixel data memory-mapped from the DICOM file.
+            Pages are read from disk only when the frames are accessed.
+        :return: read-only numpy.memmap (frames, rows, columns), not scaled by DoseGridScaling
+        """
+        filename = getattr(self.ds, 'filename', None)
+        if not isinstance(filename, str) or not os.path.isfile(filename):
+            raise ValueError('Memory-mapped dose requires a dataset read from a file')
+        transfer_syntax = self.ds.file_meta.TransferSyntaxUID
+        if transfer_syntax.is_compressed or transfer_syntax.is_deflated:
+            raise ValueError('Memory-mapped dose requires uncompressed pixel data')
+
+        is_implicit_vr = self.ds.is_implicit_VR
+        endian = '<' if self.ds.is_little_endian else '>'
+        with open(filename, 'rb') as fp:
+            # header only read, the file position stops at the Pixel Data tag
+            dicom.dcmread(fp, stop_before_pixels=True, force=True)
+            offset = fp.tell()
+            header = fp.read(8 if is_implicit_vr else 12)
+
+        group, element = np.frombuffer(header[:4], dtype=endian + 'u2')
+        if (group, element) != (0x7FE0, 0x0010):
+            raise ValueError('Pixel Data element not found')
+        length = np.frombuffer(header[-4:], dtype=endian + 'u4')[0]
+        if length == 0xFFFFFFFF:
+            raise ValueError('Memory-mapped dose requires native (not encapsulated) pixel data')
+
+        kind = 'i' if self.ds.PixelRepresentation == 1 else 'u'
+        dtype = np.dtype('{}{}{}'.format(endian, kind, self.ds.BitsAllocated // 8))
+        shape = (int(getattr(self.ds, 'NumberOfFrames', 1)), self.ds.Rows, self.ds.Columns)
+
+        return np.memmap(filename, dtype=dtype, mode='r', offset=offset + len(header), shape=shape)
 
     def DoseRegularGridInterpolator(self):
 
@@ -927,15 +1230,23 @@ class PyDicomParser(DicomParserBase):
 
         return dose_interp, (x, y, z), (fx, fy, fz)
 
-    def get_dose_3d(self):
+    def get_dose_3d(self, precision='float64', memmap=False):
         """
             Return an instance of Dose3D class to 3D interpolate the dose matrix
+        :param precision: 'float64', 'float32' or 'raw'. 'raw' keeps the integer pixel data
+            and decodes it by DoseGridScaling on demand.
+        :param memmap: memory-map the raw pixel data from the file instead of loading it (implies 'raw')
         :return: Dose3D
         """
-        dose_values = self.get_dose_matrix()
+        if memmap:
+            precision = 'raw'
+            dose_values = self.get_dose_memmap()
+        else:
+            dose_values = self.get_dose_matrix(precision)
         grid = self.get_grid_3d()
+        scaling = float(self.ds.DoseGridScaling) if precision == 'raw' else 1.0
 
-        return Dose3D(dose_values, grid, DoseUnit.Gy)
+        return Dose3D(dose_values, grid, DoseUnit.Gy, scaling=scaling)
 
     def HasDVHs(self):
         """Returns whether dose-volume histograms (DVHs) exist."""
@@ -1007,19 +1318,7 @@ class PyDicomParser(DicomParserBase):
             http://www.dicomlibrary.com/dicom/sop/
         """
 
-        if self.ds.SOPClassUID == '1.2.840.10008.5.1.4.1.1.481.2':
-            return 'rtdose'
-        elif self.ds.SOPClassUID == '1.2.840.10008.5.1.4.1.1.481.3':
-            return 'rtss'
-        elif self.ds.SOPClassUID == '1.2.840.10008.5.1.4.1.1.481.5':
-            return 'rtplan'
-        # Radiation Therapy Ion Plan Storage
-        elif self.ds.SOPClassUID == '1.2.840.10008.5.1.4.1.1.481.8':
-            return 'rtplan'
-        elif self.ds.SOPClassUID == '1.2.840.10008.5.1.4.1.1.2':
-            return 'ct'
-        else:
-            return None
+        return SOP_CLASS_TYPES.get(self.ds.SOPClassUID)
 
     ############################### RT Plan Methods ###############################
 
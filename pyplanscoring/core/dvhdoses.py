@@ -131,6 +131,76 @@ def get_cdvh_numba(ddvh):
     return cdvh
 
 
+@njit
+def get_adaptive_knots(cdvh, tolerance):
+    """
+        Knots of a piecewise linear cDVH (Ramer-Douglas-Peucker on the bin axis).
+        Knots are dense where the DVH bends and sparse along flat or linear segments.
+    :param cdvh: Cumulative volume DVH
+    :param tolerance: maximum volume deviation of the linear interpolation between knots
+    :return: knot bin indexes
+    """
+    n = len(cdvh)
+    keep = np.zeros(n, dtype=np.bool_)
+    if n == 0:
+        return np.flatnonzero(keep)
+    keep[0] = True
+    keep[n - 1] = True
+
+    # segments to split
+    stack = np.empty((n, 2), dtype=np.int64)
+    stack[0, 0] = 0
+    stack[0, 1] = n - 1
+    top = 1
+    while top > 0:
+        top -= 1
+        i0 = stack[top, 0]
+        i1 = stack[top, 1]
+        if i1 - i0 < 2:
+            continue
+        slope = (cdvh[i1] - cdvh[i0]) / (i1 - i0)
+        d_max = -1.0
+        i_max = i0
+        for i in range(i0 + 1, i1):
+            d = abs(cdvh[i] - (cdvh[i0] + slope * (i - i0)))
+            if d > d_max:
+                d_max = d
+                i_max = i
+        if d_max > tolerance:
+            keep[i_max] = True
+            stack[top, 0] = i0
+            stack[top, 1] = i_max
+            stack[top + 1, 0] = i_max
+            stack[top + 1, 1] = i1
+            top += 2
+
+    return np.flatnonzero(keep)
+
+
+def encode_rle(data):
+    """
+        Run-length encoding of a DVH array
+    :param data: DVH array
+    :return: run values and run lengths
+    """
+    data = np.asarray(data)
+    if len(data) == 0:
+        return data, np.zeros(0, dtype=int)
+    starts = np.flatnonzero(np.r_[True, data[1:] != data[:-1]])
+    counts = np.diff(np.r_[starts, len(data)])
+
+    return data[starts], counts
+
+
+def decode_rle(values, counts):
+    """
+        DVH array from its run-length encoding
+    :param values: run values
+    :param counts: run lengths
+    :return: DVH array
+    """
+    return np.repeat(np.asarray(values), np.asarray(counts, dtype=int))
+
 #
 # def test_all():
 #     doses = np.arange(150, 100004)
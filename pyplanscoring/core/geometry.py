@@ -1,14 +1,16 @@
 from __future__ import division
 
+import functools
 from copy import deepcopy
 from math import factorial
 
-from scipy.interpolate import interp1d
-
 import numba as nb
 import numpy as np
 
-from . import njit
+from . import cnjit, njit
+
+# maximum number of up sampled axes kept by get_axis_grid_cached
+AXIS_GRID_CACHE_SIZE = 4096
 
 
 def cn_PnPoly(P, V):
@@ -109,7 +111,7 @@ def point_in_contour(P, polygon):
     return wn
 
 
-@njit(nb.boolean[:](nb.boolean[:], nb.double[:, :], nb.double[:, :]))
+@cnjit(nb.boolean[:](nb.boolean[:], nb.double[:, :], nb.double[:, :]))
 def wn_contains_points(out, poly, points):
     """
         Winding number test for a list of point in a polygon
@@ -123,32 +125,37 @@ def wn_contains_points(out, poly, points):
 
     """
     n = len(points)
+    N = len(poly)
 
     for i in range(n):
-        point = points[i]
+        px = points[i, 0]
+        py = points[i, 1]
         wn = 0  # the  winding number counter
-        N = len(poly)
         # loop through all edges of the polygon
         for k in range(N - 1):  # edge from V[i] to  V[i+1]
-
-            if poly[k][1] <= point[1]:  # start y <= P[1]
-                if poly[k + 1][1] > point[1]:  # an upward crossing
-                    is_left_value = is_left(poly[k], poly[k + 1], point)
+            x0 = poly[k, 0]
+            y0 = poly[k, 1]
+            x1 = poly[k + 1, 0]
+            y1 = poly[k + 1, 1]
+            if y0 <= py:  # start y <= P[1]
+                if y1 > py:  # an upward crossing
+                    # is_left(poly[k], poly[k + 1], point)
+                    is_left_value = (x1 - x0) * (py - y0) - (px - x0) * (y1 - y0)
                     if is_left_value >= 0:  # P left of  edge
                         wn += 1  # have  a valid up intersect
 
             else:  # start y > P[1] (no test needed)
-                if poly[k + 1][1] <= point[1]:  # a downward crossing
-                    is_left_value = is_left(poly[k], poly[k + 1], point)
+                if y1 <= py:  # a downward crossing
+                    is_left_value = (x1 - x0) * (py - y0) - (px - x0) * (y1 - y0)
                     if is_left_value <= 0:  # P right of  edge
                         wn -= 1  # have  a valid down intersect
 
-            out[i] = wn
+        out[i] = wn != 0
 
     return out
 
 
-@njit(nb.boolean(nb.double, nb.double, nb.double[:, :]))
+@njit(nb.boolean(nb.double, nb.double, nb.double[:, :]), cache=True)
 def point_inside_polygon(x, y, poly):
     n = len(poly)
     # determine if a point is inside a given polygon or not
@@ -187,39 +194,278 @@ def point_inside_polygon(x, y, poly):
     return inside
 
 
-@njit(nb.boolean[:](nb.boolean[:], nb.double[:, :], nb.double[:, :]))
+@cnjit(nb.boolean[:](nb.boolean[:], nb.double[:, :], nb.double[:, :]))
 def contains_points(out, poly, points):
     n = len(points)
     for i in range(n):
-        point = points[i]
-        tmp = point_inside_polygon(point[0], point[1], poly)
-        out[i] = tmp
+        out[i] = point_inside_polygon(points[i, 0], points[i, 1], poly)
+    return out
+
+
+@njit(cache=True)
+def bisect_left(a, v):
+    """
+        Index of the first element of the ascending array a that is >= v
+    """
+    lo = 0
+    hi = len(a)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if a[mid] < v:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+@njit(cache=True)
+def bisect_right(a, v):
+    """
+        Index of the first element of the ascending array a that is > v
+    """
+    lo = 0
+    hi = len(a)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if v < a[mid]:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+@njit(cache=True)
+def get_edge_buckets(poly, y_lut):
+    """
+        Interval table of polygon edges per grid row.
+        Edge k crosses row y if min(y0, y1) <= y < max(y0, y1), the same half-open rule of the
+        winding number test, so rows outside the polygon y-range get empty buckets.
+    :param poly: closed polygon (first vertex repeated at end)
+    :param y_lut: ascending y axis in mm
+    :return: row_start (len(y_lut) + 1) and edge indexes of each row
+    """
+    n_rows = len(y_lut)
+    n_edges = len(poly) - 1
+    r0 = np.zeros(n_edges, dtype=np.int64)
+    r1 = np.zeros(n_edges, dtype=np.int64)
+    row_start = np.zeros(n_rows + 1, dtype=np.int64)
+    for k in range(n_edges):
+        y0 = poly[k, 1]
+        y1 = poly[k + 1, 1]
+        if y0 != y1:
+            r0[k] = bisect_left(y_lut, min(y0, y1))
+            r1[k] = bisect_left(y_lut, max(y0, y1))
+            for r in range(r0[k], r1[k]):
+                row_start[r + 1] += 1
+
+    for r in range(n_rows):
+        row_start[r + 1] += row_start[r]
+
+    edges = np.zeros(row_start[n_rows], dtype=np.int64)
+    filled = row_start[:-1].copy()
+    for k in range(n_edges):
+        for r in range(r0[k], r1[k]):
+            edges[filled[r]] = k
+            filled[r] += 1
+
+    return row_start, edges
+
+
+@cnjit
+def wn_contains_grid(out, poly, x_lut, y_lut, starts, ends, edges):
+    """
+        Winding number test of the implicit grid (x_lut, y_lut) using per row edge buckets.
+        Each row only visits the edges crossing its y; rows without edges exit early.
+    :param out: output boolean array, row major (len(y_lut) * len(x_lut))
+    :param poly: closed polygon (first vertex repeated at end)
+    :param x_lut: x axis in mm
+    :param y_lut: y axis in mm
+    :param starts: first bucket index of each row on edges
+    :param ends: last bucket index (exclusive) of each row on edges
+    :param edges: edge indexes bucketed by row
+    :return: Boolean array
+    """
+    n_rows = len(y_lut)
+    n_cols = len(x_lut)
+    for r in range(n_rows):
+        if starts[r] == ends[r]:
+            continue
+        py = y_lut[r]
+        for c in range(n_cols):
+            px = x_lut[c]
+            wn = 0
+            for e in range(starts[r], ends[r]):
+                k = edges[e]
+                x0 = poly[k, 0]
+                y0 = poly[k, 1]
+                x1 = poly[k + 1, 0]
+                y1 = poly[k + 1, 1]
+                is_left_value = (x1 - x0) * (py - y0) - (px - x0) * (y1 - y0)
+                if y0 <= py:  # an upward crossing
+                    if is_left_value >= 0:
+                        wn += 1
+                else:  # a downward crossing
+                    if is_left_value <= 0:
+                        wn -= 1
+            out[r * n_cols + c] = wn != 0
+
     return out
 
 
 def get_contour_mask_wn(doselut, dosegrid_points, poly):
     """
         Get the mask for the contour with respect to the dose plane.
+        Every point is tested against every edge. Use get_contour_mask_wn_grid for the meshgrid of doselut.
     :param doselut: Dicom 3D dose LUT (x,y)
-    :param dosegrid_points: dosegrid_points
+    :param dosegrid_points: dosegrid_points, the meshgrid of doselut
     :param poly: contour
     :return: contour mask on grid
     """
-
     n = len(dosegrid_points)
     out = np.zeros(n, dtype=bool)
     # preparing data to wn test
     # repeat the first vertex at end
-    poly_wn = np.zeros((poly.shape[0] + 1, poly.shape[1]))
-    poly_wn[:-1] = poly
-    poly_wn[-1] = poly[0]
+    poly_wn = np.zeros((poly.shape[0] + 1, 2))
+    poly_wn[:-1] = poly[:, :2]
+    poly_wn[-1] = poly[0, :2]
 
-    grid = wn_contains_points(out, poly_wn, dosegrid_points)
+    grid = wn_contains_points(out, poly_wn, np.ascontiguousarray(dosegrid_points[:, :2], dtype=float))
     grid = grid.reshape((len(doselut[1]), len(doselut[0])))
 
     return grid
 
 
+def get_contour_mask_wn_grid(doselut, poly):
+    """
+        Get the mask for the contour with respect to the dose plane, testing the implicit grid of doselut.
+        Each grid row only visits the edges crossing it (edge buckets), so no grid points are built.
+    :param doselut: Dicom 3D dose LUT (x,y)
+    :param poly: contour
+    :return: contour mask on grid
+    """
+    x_lut = np.asarray(doselut[0], dtype=float)
+    y_lut = np.asarray(doselut[1], dtype=float)
+    # preparing data to wn test
+    # repeat the first vertex at end
+    poly_wn = np.zeros((poly.shape[0] + 1, 2))
+    poly_wn[:-1] = poly[:, :2]
+    poly_wn[-1] = poly[0, :2]
+
+    # edge buckets require an ascending y axis
+    flip_y = len(y_lut) > 1 and y_lut[0] > y_lut[-1]
+    row_start, edges = get_edge_buckets(poly_wn, y_lut[::-1].copy() if flip_y else y_lut)
+    starts = row_start[:-1]
+    ends = row_start[1:]
+    if flip_y:
+        starts = starts[::-1].copy()
+        ends = ends[::-1].copy()
+
+    out = np.zeros(len(x_lut) * len(y_lut), dtype=bool)
+    grid = wn_contains_grid(out, poly_wn, x_lut, y_lut, starts, ends, edges)
+    grid = grid.reshape((len(y_lut), len(x_lut)))
+
+    return grid
+
+
+# index coordinates closer than this to a node are snapped to it
+INDEX_SNAP_TOLERANCE = 1e-9
+
+
+@njit(cache=True)
+def linear_index_weight(t, n):
+    """
+        Lower index, upper index and weight of the linear interpolation at index coordinate t.
+        Coordinates within INDEX_SNAP_TOLERANCE of a node are snapped to it.
+        Returns a negative index if t is outside the axis [0, n - 1].
+    """
+    ti = np.rint(t)
+    if abs(t - ti) < INDEX_SNAP_TOLERANCE:
+        t = ti
+    if not (0.0 <= t <= n - 1):
+        return -1, -1, 0.0
+    if n == 1:
+        return 0, 0, 0.0
+    i0 = min(int(t), n - 2)
+    return i0, i0 + 1, t - i0
+
+
+@cnjit
+def trilinear_points(values, zi, yi, xi, out):
+    """
+        Trilinear interpolation of a 3D matrix (z, y, x) at index coordinates.
+        It interpolates z first, then x and y, the same order of bilinear_plane on a z plane.
+        Points outside the matrix are set to 0.
+    :param values: 3D matrix
+    :param zi: z index coordinates
+    :param yi: y index coordinates
+    :param xi: x index coordinates
+    :param out: output array
+    :return: interpolated values
+    """
+    nz, ny, nx = values.shape
+    for p in range(len(out)):
+        z0, z1, wz = linear_index_weight(zi[p], nz)
+        y0, y1, wy = linear_index_weight(yi[p], ny)
+        x0, x1, wx = linear_index_weight(xi[p], nx)
+        if z0 < 0 or y0 < 0 or x0 < 0:
+            out[p] = 0.0
+            continue
+        p00 = values[z0, y0, x0] * (1.0 - wz) + values[z1, y0, x0] * wz
+        p01 = values[z0, y0, x1] * (1.0 - wz) + values[z1, y0, x1] * wz
+        p10 = values[z0, y1, x0] * (1.0 - wz) + values[z1, y1, x0] * wz
+        p11 = values[z0, y1, x1] * (1.0 - wz) + values[z1, y1, x1] * wz
+        c0 = p00 * (1.0 - wx) + p01 * wx
+        c1 = p10 * (1.0 - wx) + p11 * wx
+        out[p] = c0 * (1.0 - wy) + c1 * wy
+
+    return out
+
+
+@njit(cache=True)
+def interpolate_z_plane(values, z0, z1, wz, out):
+    """
+        Full resolution plane linearly interpolated between planes z0 and z1
+    :param out: output 2D array, its dtype sets the plane precision
+    """
+    ny, nx = out.shape
+    for r in range(ny):
+        for c in range(nx):
+            out[r, c] = values[z0, r, c] * (1.0 - wz) + values[z1, r, c] * wz
+    return out
+
+
+@cnjit
+def bilinear_plane(plane, yi, xi, out):
+    """
+        Bilinear interpolation of a 2D matrix (y, x) over the tensor grid yi x xi.
+        Points outside the matrix are set to 0.
+    :param plane: 2D matrix
+    :param yi: y index coordinates (rows)
+    :param xi: x index coordinates (columns)
+    :param out: output 2D array (len(yi), len(xi))
+    :return: interpolated plane
+    """
+    ny, nx = plane.shape
+    n_cols = len(xi)
+    x0 = np.empty(n_cols, dtype=np.int64)
+    x1 = np.empty(n_cols, dtype=np.int64)
+    wx = np.empty(n_cols)
+    for c in range(n_cols):
+        x0[c], x1[c], wx[c] = linear_index_weight(xi[c], nx)
+
+    for r in range(len(yi)):
+        y0, y1, wy = linear_index_weight(yi[r], ny)
+        for c in range(n_cols):
+            if y0 < 0 or x0[c] < 0:
+                out[r, c] = 0.0
+                continue
+            c0 = plane[y0, x0[c]] * (1.0 - wx[c]) + plane[y0, x1[c]] * wx[c]
+            c1 = plane[y1, x0[c]] * (1.0 - wx[c]) + plane[y1, x1[c]] * wx[c]
+            out[r, c] = c0 * (1.0 - wy) + c1 * wy
+
+    return out
+
+
 def poly_area(x, y):
     """
          Calculate the area based on the Surveyor's formula
@@ -255,6 +501,42 @@ def centroid_of_polygon(x, y):
     return result_x, result_y
 
 
+def centroids_of_polygons(x, y, starts):
+    """
+        Centroids and areas of polygons stored back to back, calculated in batch.
+        Same formulas of centroid_of_polygon and calc_area on each polygon.
+        Polygons with zero area get the mean of their vertices.
+    :param x: x-axis coordinates of all polygons
+    :param y: y-axis coordinates of all polygons
+    :param starts: index of the first vertex of each polygon
+    :return: centroids (n, 2) and areas (n,) arrays
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    starts = np.asarray(starts, dtype=np.intp)
+    counts = np.diff(np.append(starts, len(x)))
+
+    # next vertex of each vertex, closing every polygon
+    next_vertex = np.arange(1, len(x) + 1)
+    next_vertex[starts + counts - 1] = starts
+    x1 = x[next_vertex]
+    y1 = y[next_vertex]
+    cross = x * y1 - x1 * y
+
+    areas = np.abs(np.add.reduceat(cross, starts) / 2.0)
+    centroids = np.empty((len(starts), 2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        centroids[:, 0] = np.add.reduceat((x + x1) * cross, starts) / (areas * 6.0)
+        centroids[:, 1] = np.add.reduceat((y + y1) * cross, starts) / (areas * 6.0)
+
+    degenerate = areas == 0
+    if degenerate.any():
+        centroids[degenerate, 0] = np.add.reduceat(x, starts)[degenerate] / counts[degenerate]
+        centroids[degenerate, 1] = np.add.reduceat(y, starts)[degenerate] / counts[degenerate]
+
+    return centroids, areas
+
+
 #
 @njit(nb.boolean(nb.double[:, :], nb.double[:, :]))
 def check_contour_inside(contour, largest):
@@ -500,6 +782,32 @@ def get_axis_grid(delta_mm, grid_axis):
     return up_sampled_axis, dt
 
 
+@functools.lru_cache(maxsize=AXIS_GRID_CACHE_SIZE)
+def _axis_grid_lru(delta_mm, start, stop, size):
+    grid_axis = np.empty(size)
+    grid_axis[0] = start
+    grid_axis[-1] = stop
+    up_sampled_axis, dt = get_axis_grid(delta_mm, grid_axis)
+    # shared between callers
+    up_sampled_axis.flags.writeable = False
+
+    return up_sampled_axis, dt
+
+
+def get_axis_grid_cached(delta_mm, grid_axis):
+    """
+        Returns the up sampled axis by given resolution in mm.
+        Axes are kept on a LRU cache keyed by (delta, first, last, size), so the same
+        contour extents (e.g. one structure set scored against many plans) are not recomputed.
+        The returned axis is read-only.
+
+    :param delta_mm: desired resolution
+    :param grid_axis: x,y,x axis from LUT
+    :return: up sampled axis and delta grid
+    """
+    return _axis_grid_lru(float(delta_mm), float(grid_axis[0]), float(grid_axis[-1]), len(grid_axis))
+
+
 def get_dose_grid_3d(grid_3d, delta_mm=(2, 2, 2)):
     """
      Generate a 3d mesh grid to create a polygon mask in dose coordinates
@@ -997,143 +1305,144 @@ def calculate_contour_areas(plane):
     return contours, largestIndex
 
 
-def contour_rasterization(dose_lut, dosegrid_points, contour, fx, fy, y_cord):
-    polyY = fy(contour['data'][:, 1])
-    polyX = fx(contour['data'][:, 0])
-
-    n = len(dosegrid_points)
-    out = np.zeros(n, dtype=bool)
-    out = out.reshape((len(dose_lut[1]), len(dose_lut[0])))
-
-    IMAGE_TOP = 0
-    IMAGE_BOT = out.shape[0]
-    IMAGE_RIGHT = out.shape[1]
-    IMAGE_LEFT = 0
-    polyCorners = len(contour['data'])
-    # Loop through the rows of the image.
-    for pixelY in range(IMAGE_TOP, IMAGE_BOT):
-
-        # Build a list of nodes.
-        nodes = 0
-        j = polyCorners - 1
-        nodeX = np.zeros(polyCorners, dtype=int)
-        for i in range(polyCorners):
-            b1 = (polyY[i] < y_cord[pixelY]) and (polyY[j] >= y_cord[pixelY])
-            b2 = (polyY[j] < y_cord[pixelY]) and (polyY[i] >= y_cord[pixelY])
-            if b1 or b2:
-                f1 = pixelY - polyY[i]
-                f2 = polyY[j] - polyY[i]
-                f3 = polyX[j] - polyX[i]
-                nodeX[nodes] = (polyX[i] + (f1 / f2) * f3)
-                nodes += 1
-
-            j = i
-
-        # Sort the nodes, via a simple "Bubble" sort.
-        i = 0
-        while i < nodes - 1:
-            if nodeX[i] > nodeX[i + 1]:
-                swap = nodeX[i]
-                nodeX[i] = nodeX[i + 1]
-                nodeX[i + 1] = swap
-                if i > 0:
-                    i -= 1
-            else:
-                i += 1
-
-        # Fill the pixels between node pairs.
-        for i in range(0, nodes, 2):
-            if nodeX[i] >= IMAGE_RIGHT:
-                break
-            if nodeX[i + 1] > IMAGE_LEFT:
-                if nodeX[i] < IMAGE_LEFT:
-                    nodeX[i] = IMAGE_LEFT
-                if nodeX[i + 1] > IMAGE_RIGHT:
-                    nodeX[i + 1] = IMAGE_RIGHT
-
-                for pixelX in range(nodeX[i], nodeX[i + 1]):
-                    out[pixelY, pixelX] = True
-
-    return out
-
-
-@njit
-def raster(out, polyX, polyY, y_cord):
-    # /  public-domain code by Darel Rex Finley, 2007
-
-    IMAGE_TOP = 0
-    IMAGE_BOT = out.shape[0]
-    IMAGE_RIGHT = out.shape[1] - 1
-    IMAGE_LEFT = 0
-    polyCorners = len(polyX)
-    # Loop through the rows of the image.
-    for pixelY in range(IMAGE_TOP, IMAGE_BOT):
-
-        # Build a list of nodes.
-        nodes = 0
-        j = polyCorners - 1
-        nodeX = np.zeros(polyCorners)
-        for i in range(polyCorners):
-            b1 = (polyY[i] < y_cord[pixelY]) and (polyY[j] >= y_cord[pixelY])
-            b2 = (polyY[j] < y_cord[pixelY]) and (polyY[i] >= y_cord[pixelY])
-            if b1 or b2:
-                f1 = pixelY - polyY[i]
-                f2 = polyY[j] - polyY[i]
-                f3 = polyX[j] - polyX[i]
-                nodeX[nodes] = int(polyX[i] +
-                                   (f1 / f2) * f3 + 0.5)  # TODO add 0.5 ?
-                nodes += 1
-
-            j = i
-
-        # Sort the nodes, via a simple "Bubble" sort.
-        i = 0
-        while i < nodes - 1:
-            if nodeX[i] > nodeX[i + 1]:
-                swap = nodeX[i]
-                nodeX[i] = nodeX[i + 1]
-                nodeX[i + 1] = swap
-                if i > 0:
-                    i -= 1
-            else:
-                i += 1
-
-        # Fill the pixels between node pairs.
-        for i in range(0, nodes, 2):
-            if nodeX[i] >= IMAGE_RIGHT:
-                break
-            if nodeX[i + 1] > IMAGE_LEFT:
-                if nodeX[i] < IMAGE_LEFT:
-                    nodeX[i] = IMAGE_LEFT
-                if nodeX[i + 1] > IMAGE_RIGHT:
-                    nodeX[i + 1] = IMAGE_RIGHT
+@njit(cache=True)
+def is_left_of_edge(x0, y0, x1, y1, px, py):
+    """
+        Whether the edge (x0, y0) -> (x1, y1) crossing row py counts for point px on the winding number test,
+        i.e. the point is left of (or on) an upward edge or right of (or on) a downward edge.
+        It is the exact predicate of wn_contains_points, so both tests agree on points lying on edges.
+    """
+    is_left_value = (x1 - x0) * (py - y0) - (px - x0) * (y1 - y0)
+    if y1 > y0:
+        return is_left_value >= 0
+    return is_left_value <= 0
 
-                x1 = nodeX[i]
-                x2 = nodeX[i + 1]
 
-                for pixelX in range(x1, x2):
-                    out[pixelY, pixelX] = True
+@cnjit
+def raster(out, x_lut, y_lut, polygons, offsets):
+    """
+        Even-odd scanline polygon fill.
+        Every edge is assigned to the rows it crosses, so each row only visits its own crossings.
+        All contours of a plane are filled at once, so holes are removed natively.
+        Edge crossings follow the half-open rule of the winding number test (wn_contains_points):
+        an edge crosses row y if min(y0, y1) <= y < max(y0, y1). The first pixel right of each crossing
+        is then settled by the winding number predicate (is_left_of_edge), so pixels lying exactly on
+        edges or vertices get the same result of wn.
+
+    :param out: boolean output mask (len(y_lut), len(x_lut))
+    :param x_lut: ascending x axis in mm
+    :param y_lut: ascending y axis in mm
+    :param polygons: stacked (x,y) vertices of all contours
+    :param offsets: start index of each contour on polygons, plus the total number of vertices
+    :return: boolean mask
+    """
+    n_rows = len(y_lut)
+    n_cols = len(x_lut)
+    n_contours = len(offsets) - 1
+
+    # first pass - count crossings per row
+    row_start = np.zeros(n_rows + 1, dtype=np.int64)
+    for c in range(n_contours):
+        start = offsets[c]
+        end = offsets[c + 1]
+        for k in range(start, end):
+            kn = k + 1 if k + 1 < end else start
+            y0 = polygons[k, 1]
+            y1 = polygons[kn, 1]
+            if y0 == y1:
+                continue
+            r0 = bisect_left(y_lut, min(y0, y1))
+            r1 = bisect_left(y_lut, max(y0, y1))
+            for r in range(r0, r1):
+                row_start[r + 1] += 1
+
+    for r in range(n_rows):
+        row_start[r + 1] += row_start[r]
+
+    # second pass - edge intersections per row
+    nodes = np.zeros(row_start[n_rows])
+    node_edges = np.zeros((row_start[n_rows], 2), dtype=np.int64)
+    filled = row_start[:-1].copy()
+    for c in range(n_contours):
+        start = offsets[c]
+        end = offsets[c + 1]
+        for k in range(start, end):
+            kn = k + 1 if k + 1 < end else start
+            x0 = polygons[k, 0]
+            y0 = polygons[k, 1]
+            x1 = polygons[kn, 0]
+            y1 = polygons[kn, 1]
+            if y0 == y1:
+                continue
+            r0 = bisect_left(y_lut, min(y0, y1))
+            r1 = bisect_left(y_lut, max(y0, y1))
+            slope = (x1 - x0) / (y1 - y0)
+            for r in range(r0, r1):
+                nodes[filled[r]] = x0 + (y_lut[r] - y0) * slope
+                node_edges[filled[r], 0] = k
+                node_edges[filled[r], 1] = kn
+                filled[r] += 1
+
+    # fill the pixels between node pairs
+    for r in range(n_rows):
+        py = y_lut[r]
+        n_nodes = row_start[r + 1] - row_start[r]
+        # first column right of each crossing
+        cols = np.zeros(n_nodes, dtype=np.int64)
+        for i in range(n_nodes):
+            e = row_start[r] + i
+            k = node_edges[e, 0]
+            kn = node_edges[e, 1]
+            x0 = polygons[k, 0]
+            y0 = polygons[k, 1]
+            x1 = polygons[kn, 0]
+            y1 = polygons[kn, 1]
+            # the interpolated node is only a guess, round-off may put it a pixel off
+            j = bisect_right(x_lut, nodes[e])
+            while j > 0 and not is_left_of_edge(x0, y0, x1, y1, x_lut[j - 1], py):
+                j -= 1
+            while j < n_cols and is_left_of_edge(x0, y0, x1, y1, x_lut[j], py):
+                j += 1
+            cols[i] = j
+        cols.sort()
+        for i in range(0, n_nodes - 1, 2):
+            for j in range(cols[i], cols[i + 1]):
+                out[r, j] = True
 
     return out
 
 
-def contour_rasterization_numba(dose_lut, dosegrid_points, contour, xx, yy):
-    # TODO write unit tests and optimize this implementation
-    # Wrap variables and coordinates to raster procedure
-    xi = xx.flatten()
-    yi = yy.flatten()
-    # Convert high resolution grid to integer pixel coordinates
-    raster_x_coord = np.arange(len(xi))
-    raster_y_coord = np.arange(len(yi))
-    raster_fx = interp1d(xi, raster_x_coord, fill_value='extrapolate')
-    raster_fy = interp1d(yi, raster_y_coord, fill_value='extrapolate')
-    poly_x = raster_fx(contour['data'][:, 0])
-    poly_y = raster_fy(contour['data'][:, 1])
-    n = len(dosegrid_points)
-    out = np.zeros(n, dtype=bool)
-    out = out.reshape((len(dose_lut[1]), len(dose_lut[0])))
+def get_contour_mask_scanline(doselut, contours):
+    """
+        Get the even-odd mask of all contours of a plane with respect to the dose plane.
+        It matches the XOR of the wn masks of each contour, apart from self-intersecting contours
+        (even-odd here, non-zero winding on wn).
+    :param doselut: Dicom 3D dose LUT (x,y)
+    :param contours: list of contours, (N, 2) or (N, 3) vertices arrays
+    :return: contours mask on grid
+    """
+    x_lut = np.asarray(doselut[0], dtype=float)
+    y_lut = np.asarray(doselut[1], dtype=float)
+    # the scanline requires ascending axis
+    flip_x = len(x_lut) > 1 and x_lut[0] > x_lut[-1]
+    flip_y = len(y_lut) > 1 and y_lut[0] > y_lut[-1]
+    if flip_x:
+        x_lut = x_lut[::-1].copy()
+    if flip_y:
+        y_lut = y_lut[::-1].copy()
+
+    polygons = np.ascontiguousarray(
+        np.vstack([c[:, :2] for c in contours]), dtype=float)
+    offsets = np.cumsum([0] + [len(c) for c in contours]).astype(np.int64)
+    out = np.zeros((len(y_lut), len(x_lut)), dtype=bool)
+    grid = raster(out, x_lut, y_lut, polygons, offsets)
+
+    if flip_x:
+        grid = grid[:, ::-1]
+    if flip_y:
+        grid = grid[::-1, :]
 
-    return raster(out, poly_x, poly_y, raster_y_coord)
+    return grid
 
 
 def planes_point_cloud(sPlanes_dict):
@@ -1159,8 +1468,8 @@ def get_contour_roi_grid(contour_points, delta_mm=(0, 0), fac=1):
     x_max = x.max() + delta_mm[0] * fac
     y_min = y.min() - delta_mm[1] * fac
     y_max = y.max() + delta_mm[1] * fac
-    x_lut, x_delta = get_axis_grid(delta_mm[0], [x_min, x_max])
-    y_lut, y_delta = get_axis_grid(delta_mm[1], [y_min, y_max])
+    x_lut, x_delta = get_axis_grid_cached(delta_mm[0], [x_min, x_max])
+    y_lut, y_delta = get_axis_grid_cached(delta_mm[1], [y_min, y_max])
     xg, yg = np.meshgrid(x_lut, y_lut)
     xf, yf = xg.flatten(), yg.flatten()
     contour_dose_grid = np.vstack((xf, yf)).T
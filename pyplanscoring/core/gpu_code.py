@@ -2,7 +2,7 @@ import numpy as np
 from numba import cuda, njit
 
 from .calculation import DVHCalculation
-from .geometry import check_contour_inside
+from .geometry import check_contour_inside, get_contour_mask_wn
 
 
 class DVHCalculationGPU(DVHCalculation):
@@ -204,6 +204,9 @@ def get_contour_mask_gpu(doselut, dosegrid_points, poly):
     :param poly: contour
     :return: contour mask on grid
     """
+    if not cuda.is_available():
+        # CPU fallback - winding number test
+        return get_contour_mask_wn(doselut, dosegrid_points, poly)
 
     n = len(dosegrid_points)
     grid = np.zeros(n, dtype=bool)
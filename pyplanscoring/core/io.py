@@ -2,10 +2,23 @@ import bz2
 import json
 import os
 import pickle
+import sqlite3
+import struct
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
+from pydicom.errors import BytesLengthException, InvalidDicomError
 from pydicom.valuerep import IS
 
-from .dicom_reader import PyDicomParser
+from .dicom_reader import get_dicom_header, get_dicom_types
+from .dvhdoses import decode_rle, encode_rle, get_adaptive_knots
+
+# DVH storage formats - as calculated, run-length encoded or adaptive knots
+DVH_FORMATS = ('dense', 'rle', 'adaptive')
+
+# DICOM header columns stored by DicomIndex
+DICOM_INDEX_COLUMNS = ('rt_type', 'sop_class_uid', 'sop_instance_uid', 'frame_of_reference_uid',
+                       'referenced_rtss_uid', 'referenced_plan_uid')
 
 
 def load(filename):
@@ -31,22 +44,86 @@ def save(obj, filename, protocol=-1):
         pickle.dump(obj, f, protocol)
 
 
-def save_dvh_json(dvh_data_dict, file_path_name):
+def encode_dvh(dvh, dvh_format='rle', tolerance=1e-3):
+    """
+        Compact copy of a cumulative DVH dict for storage
+    :param dvh: PyPlanScoring DVH dict
+    :param dvh_format: 'dense' (unchanged), 'rle' (run-length encoded, lossless) or
+        'adaptive' (linear interpolation knots, dense where the DVH bends)
+    :param tolerance: adaptive maximum volume deviation, relative to the structure volume
+    :return: DVH dict
+    """
+    if dvh_format not in DVH_FORMATS:
+        raise ValueError('DVH format should be one of {}'.format(DVH_FORMATS))
+    if dvh_format == 'dense' or 'data' not in dvh:
+        return dvh
+
+    dvh = dict(dvh)
+    data = np.asarray(dvh.pop('data'), dtype=float)
+    if dvh_format == 'rle':
+        values, counts = encode_rle(data)
+        dvh['rle'] = {'values': values, 'counts': counts}
+    else:
+        volume = data[0] if len(data) else 0.0
+        knots = get_adaptive_knots(data, tolerance * volume)
+        dvh['knots'] = {'index': knots, 'volume': data[knots]}
+
+    return dvh
+
+
+def decode_dvh(dvh):
+    """
+        Dense DVH dict from a stored (dense, rle or adaptive) DVH dict
+    :param dvh: DVH dict
+    :return: DVH dict with ndarray data
+    """
+    dvh = dict(dvh)
+    if 'rle' in dvh:
+        rle = dvh.pop('rle')
+        dvh['data'] = decode_rle(np.asarray(rle['values'], dtype=float), rle['counts'])
+    elif 'knots' in dvh:
+        knots = dvh.pop('knots')
+        data = np.interp(np.arange(dvh['bins']), knots['index'], knots['volume'])
+        dvh['data'] = np.round(data, 2)
+    elif 'data' in dvh:
+        dvh['data'] = np.asarray(dvh['data'], dtype=float)
+
+    return dvh
+
+
+def to_json_type(obj):
+    """
+        json.dump default - NumPy arrays and scalars to python lists and numbers
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+
+
+def save_dvh_json(dvh_data_dict, file_path_name, dvh_format='dense', tolerance=1e-3):
     """
         Helper function to save dvh_data into JSON file
     :param dvh_data_dict:
     :param file_path_name:
+    :param dvh_format: DVH storage format - 'dense', 'rle' or 'adaptive'
+    :param tolerance: adaptive format maximum volume deviation, relative to the structure volume
     """
+    if dvh_format != 'dense':
+        dvh_data_dict = {k: encode_dvh(v, dvh_format, tolerance) if isinstance(v, dict) else v
+                         for k, v in dvh_data_dict.items()}
 
     with open(file_path_name, 'w', encoding='utf-8') as json_file:
         json.dump(dvh_data_dict,
                   json_file,
-                  ensure_ascii=False)
+                  ensure_ascii=False,
+                  default=to_json_type)
 
 
 def load_dvh_json(file_path_name):
     """
-
+        Loads DVH data JSON file, decoding compact DVH formats to ndarray data
     :param file_path_name:
     :return:
     """
@@ -54,7 +131,7 @@ def load_dvh_json(file_path_name):
     with open(file_path_name, 'r', encoding='utf-8') as json_file:
         json_dict = json.load(json_file)
         # add pydicom key type (int)
-        json_dict = {IS(k): v for k, v in json_dict.items()}
+        json_dict = {IS(k): decode_dvh(v) if isinstance(v, dict) else v for k, v in json_dict.items()}
         return json_dict
 
 
@@ -113,12 +190,14 @@ class IOHandler:
 
         return self.dvh_data
 
-    def to_json_file(self, file_path_name):
+    def to_json_file(self, file_path_name, dvh_format='dense', tolerance=1e-3):
         """
             Saves serialized dvh data into *.jdvh json file
         :param file_path_name:
+        :param dvh_format: DVH storage format - 'dense', 'rle' or 'adaptive'
+        :param tolerance: adaptive format maximum volume deviation, relative to the structure volume
         """
-        save_dvh_json(self.dvh_data, file_path_name)
+        save_dvh_json(self.dvh_data, file_path_name, dvh_format, tolerance)
 
     def read_json_file(self, file_path_name):
         """
@@ -129,23 +208,31 @@ class IOHandler:
         return self.dvh_data
 
 
-def get_participant_folder_data(root_path):
+def get_dicom_files(root_path):
+    """
+        DICOM files (*.dcm) of a folder and its sub folders
+    :param root_path: folder
+    :return: list of file paths
+    """
+    return [os.path.join(root, name) for root, dirs, files in os.walk(root_path) for name in files if
+            name.endswith(('.dcm', '.DCM'))]
+
+
+def get_participant_folder_data(root_path, index=None):
     """
         Provide all participant required files (RP,RS an RD DICOM FILES)
     :param root_path: participant folder
+    :param index: optional DicomIndex. Only new or changed files are read again.
     :return: Pandas DataFrame containing path to files
     """
-    files = [os.path.join(root, name) for root, dirs, files in os.walk(root_path) for name in files if
-             name.endswith(('.dcm', '.DCM'))]
+    if index is not None:
+        typed_files = index.scan(root_path)
+    else:
+        # only the DICOM headers are read
+        typed_files = get_dicom_types(get_dicom_files(root_path))
 
     filtered_files = {'rtdose': False, 'rtplan': False, 'rtss': False}
-    for f in files:
-        obj = PyDicomParser(filename=f)
-        rt_type = obj.GetSOPClassUID()
-        # fix halcyon SOP class UI
-        if rt_type is None:
-            rt_type = obj.ds.Modality.lower()
-
+    for rt_type, f in typed_files:
         if rt_type in ['rtdose', 'rtplan', 'rtss']:
             filtered_files[rt_type] = f
 
@@ -155,3 +242,151 @@ def get_participant_folder_data(root_path):
         return filtered_files, True
     else:
         return missing_files, False
+
+
+# errors of files that are not DICOM, truncated or corrupt
+DICOM_READ_ERRORS = (AttributeError, InvalidDicomError, BytesLengthException, EOFError, OSError, struct.error,
+                     ValueError)
+
+
+def _read_dicom_header(path):
+    try:
+        return get_dicom_header(path)
+    except DICOM_READ_ERRORS:
+        # unreadable file - indexed without type, so it is not read again until it changes
+        return dict.fromkeys(DICOM_INDEX_COLUMNS)
+
+
+class DicomIndex:
+
+    def __init__(self, index_path):
+        """
+            Persistent SQLite index of DICOM file headers.
+            Each file keeps its size and modification time, so a folder scan only stats the files and
+            reads again the headers of new or changed ones.
+        :param index_path: SQLite database file path, or ':memory:'
+        """
+        self._index_path = index_path
+        self._connection = sqlite3.connect(index_path)
+        with self._connection:
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS dicom_files (
+                                            path TEXT PRIMARY KEY,
+                                            folder TEXT NOT NULL,
+                                            size INTEGER NOT NULL,
+                                            mtime INTEGER NOT NULL,
+                                            rt_type TEXT,
+                                            sop_class_uid TEXT,
+                                            sop_instance_uid TEXT,
+                                            frame_of_reference_uid TEXT,
+                                            referenced_rtss_uid TEXT,
+                                            referenced_plan_uid TEXT)""")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS dicom_files_sop_instance_uid "
+                                     "ON dicom_files (sop_instance_uid)")
+
+    @property
+    def index_path(self):
+        return self._index_path
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return self._connection.execute("SELECT COUNT(*) FROM dicom_files").fetchone()[0]
+
+    @staticmethod
+    def _path_range(root_path):
+        # paths under root_path sort between root/ and root0 (the character after the separator)
+        root_path = os.path.join(os.path.abspath(root_path), '')
+        return root_path, root_path[:-1] + chr(ord(os.sep) + 1)
+
+    def scan(self, root_path, max_workers=None):
+        """
+            Updates the index of the DICOM files (*.dcm) of a folder and its sub folders.
+            Files removed from the folder are dropped from the index.
+            Files that are not DICOM, truncated or corrupt are indexed without type.
+        :param root_path: folder
+        :param max_workers: number of threads reading headers. None uses the ThreadPoolExecutor default.
+        :return: list of (rt_type, filename) in os.walk order
+        """
+        files = get_dicom_files(root_path)
+        abs_files = [os.path.abspath(f) for f in files]
+        stats = {}
+        for path in abs_files:
+            st = os.stat(path)
+            stats[path] = (st.st_size, st.st_mtime_ns)
+
+        indexed = {row[0]: (row[1], row[2], row[3]) for row in self._connection.execute(
+            "SELECT path, size, mtime, rt_type FROM dicom_files WHERE path >= ? AND path < ?",
+            self._path_range(root_path))}
+
+        changed = [path for path in abs_files if indexed.get(path, (None, None))[:2] != stats[path]]
+        removed = [(path,) for path in indexed if path not in stats]
+
+        if len(changed) > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                headers = list(executor.map(_read_dicom_header, changed))
+        else:
+            headers = [_read_dicom_header(path) for path in changed]
+
+        rows = [(path, os.path.dirname(path)) + stats[path] + tuple(header[c] for c in DICOM_INDEX_COLUMNS)
+                for path, header in zip(changed, headers)]
+        with self._connection:
+            self._connection.executemany("DELETE FROM dicom_files WHERE path = ?", removed)
+            self._connection.executemany("INSERT OR REPLACE INTO dicom_files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                         rows)
+
+        rt_types = {path: indexed[path][2] for path in indexed}
+        rt_types.update((row[0], row[4]) for row in rows)
+
+        return [(rt_types[path], f) for path, f in zip(abs_files, files)]
+
+    def _select(self, where='', parameters=()):
+        columns = ('path',) + DICOM_INDEX_COLUMNS
+        query = "SELECT {} FROM dicom_files {} ORDER BY path".format(', '.join(columns), where)
+        return [dict(zip(columns, row)) for row in self._connection.execute(query, parameters)]
+
+    def get_files(self, root_path=None):
+        """
+            Indexed DICOM files, without reading the folder
+        :param root_path: only files under this folder. None returns all indexed files.
+        :return: list of dicts with path, rt_type and UIDs
+        """
+        if root_path is None:
+            return self._select()
+        return self._select("WHERE path >= ? AND path < ?", self._path_range(root_path))
+
+    def get_by_uid(self, sop_instance_uid):
+        """
+            Indexed DICOM files of a SOP Instance UID. Copies of the same object give many files.
+        :param sop_instance_uid: SOP Instance UID
+        :return: list of dicts with path, rt_type and UIDs
+        """
+        return self._select("WHERE sop_instance_uid = ?", (sop_instance_uid,))
+
+    def find_triplets(self, root_path=None, same_folder=False):
+        """
+            Matches RTDOSE, RTPLAN and RTSTRUCT files by UID.
+            The RTDOSE references the RTPLAN that references the RTSTRUCT.
+        :param root_path: only RTDOSE files under this folder. None uses all indexed files.
+        :param same_folder: only triplets with all files in the same folder
+        :return: list of dicts {'rtdose': path, 'rtplan': path, 'rtss': path}
+        """
+        query = """SELECT d.path, p.path, s.path FROM dicom_files d
+                   JOIN dicom_files p ON p.rt_type = 'rtplan' AND p.sop_instance_uid = d.referenced_plan_uid
+                   JOIN dicom_files s ON s.rt_type = 'rtss' AND s.sop_instance_uid = p.referenced_rtss_uid
+                   WHERE d.rt_type = 'rtdose'"""
+        parameters = ()
+        if root_path is not None:
+            query += " AND d.path >= ? AND d.path < ?"
+            parameters = self._path_range(root_path)
+        if same_folder:
+            query += " AND p.folder = d.folder AND s.folder = d.folder"
+        query += " ORDER BY d.path, p.path, s.path"
+
+        return [{'rtdose': rd, 'rtplan': rp, 'rtss': rs} for rd, rp, rs in self._connection.execute(query, parameters)]
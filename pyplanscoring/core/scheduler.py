@@ -0,0 +1,130 @@
+"""
+Task scheduling for DVH calculations.
+Runs independent tasks serially or on a thread, process or loky pool,
+bounded by the number of cores set on the calculation options.
+"""
+import os
+import time
+
+from joblib import Parallel, delayed
+from joblib.externals.loky import get_reusable_executor
+
+MP_BACKENDS = ('serial', 'threading', 'multiprocessing', 'loky')
+
+_BACKEND_ALIASES = {
+    'sequential': 'serial',
+    'thread': 'threading',
+    'threads': 'threading',
+    'process': 'multiprocessing',
+    'processes': 'multiprocessing',
+}
+
+
+def _timed_call(func, args):
+    ts = time.time()
+    result = func(*args)
+    return result, time.time() - ts
+
+
+def get_num_workers(num_cores=-1, n_tasks=None):
+    """
+        Number of workers bounded by the available cpus and the number of tasks
+    :param num_cores: maximum number of cores. Values <= 0 use all cpus.
+    :param n_tasks: number of tasks to run
+    :return: number of workers
+    """
+    n_cpus = os.cpu_count() or 1
+    if num_cores is None or num_cores <= 0:
+        n_workers = n_cpus
+    else:
+        n_workers = min(int(num_cores), n_cpus)
+
+    if n_tasks is not None:
+        n_workers = min(n_workers, n_tasks)
+
+    return max(n_workers, 1)
+
+
+class DVHScheduler:
+    """
+        Runs independent calculation tasks with the selected backend.
+
+    Example::
+
+        scheduler = DVHScheduler('loky', num_cores=4)
+        results = scheduler.map(func, [(arg1, arg2), (arg3, arg4)], costs=[10, 1])
+    """
+
+    def __init__(self, backend='loky', num_cores=-1):
+        """
+        :param backend: 'serial', 'threading', 'multiprocessing' or 'loky'
+        :type backend: str
+        :param num_cores: maximum number of cores. Values <= 0 use all cpus.
+        :type num_cores: int
+        """
+        self._backend = None
+        self.num_cores = num_cores
+        self.timings = []
+        # setters
+        self.backend = backend
+
+    @property
+    def backend(self):
+        return self._backend
+
+    @backend.setter
+    def backend(self, value):
+        value = _BACKEND_ALIASES.get(str(value).lower(), str(value).lower())
+        if value not in MP_BACKENDS:
+            raise ValueError('Backend should be one of {}'.format(MP_BACKENDS))
+        self._backend = value
+
+    @property
+    def uses_processes(self):
+        """
+            True if tasks run on worker processes
+        """
+        return self.backend in ('multiprocessing', 'loky') and get_num_workers(self.num_cores) > 1
+
+    def map(self, func, tasks, costs=None):
+        """
+            Run func(*task) for every task.
+            Tasks are submitted in descending cost order (longest processing time first) and
+            dispatched one at a time to the next free worker, so expensive tasks do not finish last.
+            Elapsed time of each task is stored on timings.
+        :param func: callable
+        :param tasks: list of argument tuples
+        :param costs: estimated cost of each task
+        :return: list of results in the same order as tasks
+        """
+        tasks = list(tasks)
+        if costs is None:
+            order = list(range(len(tasks)))
+        else:
+            if len(costs) != len(tasks):
+                raise ValueError('Tasks and costs lists should be equal sized')
+            order = sorted(range(len(tasks)), key=lambda i: costs[i], reverse=True)
+
+        n_workers = get_num_workers(self.num_cores, len(tasks))
+        if self.backend == 'serial' or n_workers == 1:
+            res = [_timed_call(func, tasks[i]) for i in order]
+        else:
+            res = Parallel(n_jobs=n_workers, backend=self.backend, batch_size=1)(
+                delayed(_timed_call)(func, tasks[i]) for i in order)
+
+        results = [None] * len(tasks)
+        timings = [None] * len(tasks)
+        for i, (r, elapsed) in zip(order, res):
+            results[i] = r
+            timings[i] = elapsed
+        self.timings = timings
+
+        return results
+
+    def shutdown(self):
+        """
+            Stops the loky worker processes, which joblib keeps alive between calls,
+            so they release the files and memory maps they hold
+        """
+        if self.backend == 'loky':
+            get_reusable_executor().shutdown(wait=True)
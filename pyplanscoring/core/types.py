@@ -3,6 +3,10 @@ Classes to enumerate DVH types
 Copyright (c) 2017  Victor Gabriel Leandro Alves
 based on: https://rexcardan.github.io/ESAPIX/
 """
+import mmap
+import threading
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping
 from copy import deepcopy
 from enum import IntEnum, unique
 from typing import List, Tuple
@@ -11,6 +15,16 @@ import numpy as np
 import quantities as pq
 from scipy import interpolate as itp
 
+from .geometry import INDEX_SNAP_TOLERANCE, bilinear_plane, interpolate_z_plane, linear_index_weight, trilinear_points
+
+PlaneCacheInfo = namedtuple('PlaneCacheInfo', 'hits misses maxsize currsize')
+
+# whole grid dose statistics. nonzero_bbox is ((x_min, y_min, z_min), (x_max, y_max, z_max)) in mm
+DoseStatistics = namedtuple('DoseStatistics', 'max argmax min mean nonzero_bbox')
+
+# Dose3D storage - float64, float32 or raw integer pixel data decoded by scaling
+DOSE_PRECISIONS = ('float64', 'float32', 'raw')
+
 
 class DoseUnit:
     Gy = pq.Gy
@@ -151,7 +165,31 @@ class DICOMType:
     EXTERNAL = "EXTERNAL"
 
 
+def interp_linear(x_new, x, y):
+    """
+        Linear interpolation of y(x) with linear extrapolation, x sorted ascending.
+        Same results of scipy interp1d(x, y, fill_value='extrapolate'), without building it.
+    :param x_new: points to evaluate
+    :param x: ascending x values
+    :param y: y values
+    :return: interpolated values
+    """
+    x_new = np.asarray(x_new, dtype=float)
+    hi = np.clip(np.searchsorted(x, x_new), 1, len(x) - 1)
+    lo = hi - 1
+    slope = (y[hi] - y[lo]) / (x[hi] - x[lo])
+    return slope * (x_new - x[lo]) + y[lo]
+
+
 class DVHData:
+    """
+        Cumulative DVH curve queries.
+        Axes and interpolation lookups are built on the first query that needs them.
+    """
+    __slots__ = ('dvh', '_volume', '_dose_units', '_volume_units', '_dose_axis_bkp', '_dose_axis',
+                 '_volume_axis', '_volume_pp', '_curve_data', '_min_dose', '_mean_dose', '_max_dose',
+                 '_bin_width', '_lookup', '_dose_format', '_volume_format')
+
     def __init__(self, dvh):
         self._dose_format = None
         self._volume_format = None
@@ -161,28 +199,51 @@ class DVHData:
         self._volume_units = QuantityRegex.string_to_quantity(
             dvh['volumeunits'])
         # set data according to the given units
-        self._dose_axis_bkp = np.arange(len(dvh['data']) + 1) * dvh['scaling']
-        self._dose_axis = np.arange(len(dvh['data']) + 1) * dvh[
-            'scaling'] * self._dose_units
-        self._volume_axis = np.append(dvh['data'], 0) * self._volume_units
+        self._dose_axis_bkp = None
+        self._dose_axis = None
+        self._volume_axis = None
+        self._volume_pp = None
         self._curve_data = dvh['data']
         self._min_dose = dvh['min']
         self._mean_dose = dvh['mean']
         self._max_dose = dvh['max']
         self._bin_width = dvh['scaling']
-        self.set_interpolation_data()
-        self.set_volume_focused_data()
+        self._lookup = {}
 
     def set_interpolation_data(self):
-        # setting constrain interpolation functions
-        self.fv = itp.interp1d(
-            self.dose_axis, self.volume_pp, fill_value='extrapolate')  # pp
-        self.fv_cc = itp.interp1d(
-            self.dose_axis, self.volume_cc, fill_value='extrapolate')  # cc
-        self.fd = itp.interp1d(
-            self.volume_pp, self.dose_axis, fill_value='extrapolate')  # pp
-        self.fd_cc = itp.interp1d(
-            self.volume_cc, self.dose_axis, fill_value='extrapolate')  # cc
+        # dose or volume axes changed - lookups are rebuilt on demand
+        self._lookup = {}
+
+    def _get_lookup(self, key):
+        """
+            Ascending x and y arrays of the curve interpolation.
+            Volume keyed lookups are sorted stably, the same way interp1d sorts them.
+        """
+        if key not in self._lookup:
+            dose = np.asarray(self.dose_axis, dtype=float)
+            volume = np.asarray(self.volume_pp if key in ('fv', 'fd') else self.volume_cc, dtype=float)
+            if key in ('fv', 'fv_cc'):
+                self._lookup[key] = (dose, volume)
+            else:
+                order = np.argsort(volume, kind='mergesort')
+                self._lookup[key] = (volume[order], dose[order])
+        return self._lookup[key]
+
+    def fv(self, dose):
+        """ relative volume (%) at dose """
+        return interp_linear(dose, *self._get_lookup('fv'))
+
+    def fv_cc(self, dose):
+        """ absolute volume (cc) at dose """
+        return interp_linear(dose, *self._get_lookup('fv_cc'))
+
+    def fd(self, volume):
+        """ dose at relative volume (%) """
+        return interp_linear(volume, *self._get_lookup('fd'))
+
+    def fd_cc(self, volume):
+        """ dose at absolute volume (cc) """
+        return interp_linear(volume, *self._get_lookup('fd_cc'))
 
     def set_volume_focused_data(self):
         """
@@ -205,19 +266,32 @@ class DVHData:
 
     @property
     def volume_focused_format(self):
+        if self._dose_format is None:
+            self.set_volume_focused_data()
         return self._volume_format
 
     @property
     def dose_focused_format(self):
+        if self._dose_format is None:
+            self.set_volume_focused_data()
         return self._dose_format
 
     @property
     def dose_axis(self):
+        if self._dose_axis is None:
+            self._dose_axis = self.dose_axis_bkp * self._dose_units
         return self._dose_axis
 
     @dose_axis.setter
     def dose_axis(self, value):
         self._dose_axis = value
+        self.set_interpolation_data()
+
+    @property
+    def dose_axis_bkp(self):
+        if self._dose_axis_bkp is None:
+            self._dose_axis_bkp = np.arange(len(self._curve_data) + 1) * self._bin_width
+        return self._dose_axis_bkp
 
     @property
     def dose_unit(self):
@@ -225,6 +299,8 @@ class DVHData:
 
     @property
     def volume_cc(self):
+        if self._volume_axis is None:
+            self._volume_axis = np.append(self._curve_data, 0) * self._volume_units
         return self._volume_axis
 
     @property
@@ -237,7 +313,9 @@ class DVHData:
 
     @property
     def volume_pp(self):
-        return self.convert_to_relative_volume(self._volume_axis)
+        if self._volume_pp is None:
+            self._volume_pp = self.convert_to_relative_volume(self.volume_cc)
+        return self._volume_pp
 
     @property
     def max_dose(self):
@@ -360,6 +438,52 @@ class DVHData:
         else:
             return ValueError('Wrong argument - Unknown volume units')
 
+    def get_dose_at_volumes(self, volumes, volume_unit):
+        """
+            Vectorized get_dose_at_volume.
+        :param volumes: volume values in volume_unit
+        :param volume_unit: VolumePresentation
+        :return: dose values in dose_unit, NaN where the volume is larger than the structure volume
+        """
+        volumes = np.asarray(volumes, dtype=float)
+        if volume_unit == VolumePresentation.relative:
+            volume_axis, fd = self.volume_pp, self.fd
+        elif volume_unit == VolumePresentation.absolute_cm3:
+            volume_axis, fd = self.volume_cc, self.fd_cc
+        else:
+            raise ValueError('Wrong argument - Unknown volume units')
+
+        min_vol = float(volume_axis.min())
+        max_vol = float(volume_axis.max())
+        doses = np.where(volumes > max_vol, np.nan, fd(volumes))
+        doses = np.where(np.isclose(volumes, max_vol), self._min_dose, doses)
+        return np.where(volumes <= min_vol, self._max_dose, doses)
+
+    def get_volume_at_doses(self, doses, dose_unit, volume_unit):
+        """
+            Vectorized get_volume_at_dose.
+        :param doses: dose values in dose_unit
+        :param dose_unit: DoseUnit
+        :param volume_unit: VolumePresentation
+        :return: volume values in volume_unit
+        """
+        doses = np.asarray(doses, dtype=float)
+        if DoseValue(0, dose_unit).get_presentation() == DoseValuePresentation.Absolute:
+            if dose_unit != self.dose_unit:
+                doses = (doses * dose_unit).rescale(self.dose_unit).magnitude
+        elif dose_unit != self.dose_unit:
+            raise ValueError('Dose unit %s does not match the DVH dose unit' % dose_unit)
+
+        if volume_unit == VolumePresentation.absolute_cm3:
+            volumes, full_volume = self.fv_cc(doses), float(self._volume)
+        elif volume_unit == VolumePresentation.relative:
+            volumes, full_volume = self.fv(doses), 100.0
+        else:
+            raise ValueError('Wrong argument - Unknown volume units')
+
+        volumes = np.where(doses < self._min_dose, full_volume, volumes)
+        return np.where(doses > self._max_dose, 0.0, volumes)
+
     def get_dose_compliment(self, volume):
         """
               Gets the compliment dose for the specified volume (the cold spot).
@@ -404,13 +528,15 @@ class DVHData:
             if scaling_point.unit != self.dose_unit:
                 scaling_point = scaling_point.rescale(self.dose_unit)
 
-        dose_axis_norm = self._dose_axis_bkp * (100 / scaling_point.value)
+        # the volume focused format keeps the doses of the original curve
+        if self._dose_format is None:
+            self.set_volume_focused_data()
+        dose_axis_norm = self.dose_axis_bkp * (100 / scaling_point.value)
         self._min_dose *= (100 / scaling_point.value)
         self._max_dose *= (100 / scaling_point.value)
         self._mean_dose *= (100 / scaling_point.value)
         self._dose_units = DoseUnit.Percent
         self.dose_axis = dose_axis_norm * self._dose_units
-        self.set_interpolation_data()
 
     @staticmethod
     def convert_to_relative_dose(dvh, scaling_point):
@@ -543,6 +669,7 @@ class StructureBase:
         self._structure_dict = None
         self._contour_spacing = None
         self._planes = None
+        self._bounding_box = None
         self._is_high_resolution = False
 
         # setters original structure
@@ -556,7 +683,7 @@ class StructureBase:
 
     @structure.setter
     def structure(self, value):
-        if isinstance(value, dict):
+        if isinstance(value, Mapping):
             if self._end_cap:
                 self._structure_dict = self.get_capped_structure(
                     value, self._end_cap)
@@ -582,6 +709,7 @@ class StructureBase:
     def planes(self, value):
         if isinstance(value, dict):
             self._planes = value
+            self._bounding_box = None
         else:
             raise TypeError("Not a structure planes dict")
 
@@ -593,6 +721,17 @@ class StructureBase:
     def point_cloud(self):
         return self.planes2array(self.planes)
 
+    @property
+    def bounding_box(self):
+        """
+            Axis aligned bounding box of the contour points, cached until planes change
+        :return: (x_min, y_min, z_min), (x_max, y_max, z_max) in mm
+        """
+        if self._bounding_box is None:
+            points = self.point_cloud
+            self._bounding_box = (points.min(axis=0), points.max(axis=0))
+        return self._bounding_box
+
     @property
     def center_point(self):
         return np.median(self.point_cloud, axis=0)
@@ -707,6 +846,16 @@ class StructureBase:
         return self.__str__()
 
 
+class _MemmapReference(namedtuple('_MemmapReference', 'filename dtype shape offset fortran_order')):
+    """
+        Picklable reference to a memory-mapped dose matrix
+    """
+
+    def open(self):
+        return np.memmap(self.filename, dtype=self.dtype, mode='r', offset=self.offset,
+                         shape=self.shape, order='F' if self.fortran_order else 'C')
+
+
 class Dose3D:
     """
         Class to encapsulate Trilinear dose interpolation
@@ -718,67 +867,323 @@ class Dose3D:
 
     def __init__(self, values: np.ndarray,
                  grid: Tuple[np.ndarray, np.ndarray, np.ndarray],
-                 unit: DoseUnit) -> None:
+                 unit: DoseUnit,
+                 plane_cache_size: int = 32,
+                 scaling: float = 1.0) -> None:
         """
-        :param values: 3D dose matrix
+        :param values: 3D dose matrix. float64, float32 or raw integer pixel data
         :type values: numpy.ndarray
         :param grid: (x_grid, y_grid, z_grid)
         :rype grid: Tuple
         :param unit: Dose Unit ex, Gy, cGy or %
         :type unit: UnitQuantity
+        :param plane_cache_size: maximum number of z interpolated planes kept (LRU)
+        :type plane_cache_size: int
+        :param scaling: factor decoding values to dose, e.g. DICOM DoseGridScaling of raw pixel data
+        :type scaling: float
         """
         self._values = None
         self._grid = None
         self._unit = None
+        self._scaling = 1.0
+        self._interpolators = None
+        self._affine = None
+        self._statistics = None
+        self._histogram = None
+        self.plane_cache_size = plane_cache_size
+        self._plane_cache = OrderedDict()
+        self._plane_cache_lock = threading.Lock()
+        self.plane_cache_hits = 0
+        self.plane_cache_misses = 0
+        # crops map indexes and z planes to the Dose3D they were cut from
+        self._parent = None
+        self._offset = (0, 0, 0)
 
         # setters
         self.values = values
         self.grid = grid
         self.unit = unit
+        self.scaling = scaling
+
+    def __getstate__(self):
+        """
+            Pickle support. Interpolators are dropped and rebuilt lazily in the
+            receiving process. Memory-mapped values are sent as a reference to
+            their file, so worker processes attach a zero-copy view.
+        """
+        state = self.__dict__.copy()
+        state['_interpolators'] = None
+        state['_plane_cache'] = OrderedDict()
+        state['_plane_cache_lock'] = None
+        # crops are sent as standalone sub-volumes
+        state['_parent'] = None
+        state['_offset'] = (0, 0, 0)
+        values = self._values
+        if isinstance(values, np.memmap) and isinstance(values.base, mmap.mmap):
+            state['_values'] = _MemmapReference(values.filename, values.dtype.str,
+                                                values.shape, values.offset,
+                                                np.isfortran(values))
+        return state
+
+    def __setstate__(self, state):
+        if isinstance(state['_values'], _MemmapReference):
+            state['_values'] = state['_values'].open()
+        state['_plane_cache_lock'] = threading.Lock()
+        self.__dict__.update(state)
+
+    def to_memmap(self, filename: str) -> 'Dose3D':
+        """
+            Writes dose values to a .npy file and returns a Dose3D backed by a
+            read-only memory map of it. Pickling it does not copy the values.
+        :param filename: .npy file path
+        :return: Dose3D class
+        """
+        np.save(filename, np.asarray(self.values))
+        values = np.load(filename, mmap_mode='r')
+        return Dose3D(values, self.grid, self.unit, self.plane_cache_size, self.scaling)
 
+    def _setup_interpolators(self):
         # setup regular grid inerpolator
         x_coord = np.arange(len(self.grid[0]))
         y_coord = np.arange(len(self.grid[1]))
         z_coord = np.arange(len(self.grid[2]))
 
         # mapped coordinates
-        self._fx = itp.interp1d(
-            self.grid[0], x_coord, fill_value='extrapolate')
-        self._fy = itp.interp1d(
-            self.grid[1], y_coord, fill_value='extrapolate')
-        self._fz = itp.interp1d(
-            self.grid[2], z_coord, fill_value='extrapolate')
-
-        self._fx_mm = itp.interp1d(
-            x_coord, self.grid[0], fill_value='extrapolate')
-        self._fy_mm = itp.interp1d(
-            y_coord, self.grid[1], fill_value='extrapolate')
-        self._fz_mm = itp.interp1d(
-            z_coord, self.grid[2], fill_value='extrapolate')
+        fx = itp.interp1d(self.grid[0], x_coord, fill_value='extrapolate')
+        fy = itp.interp1d(self.grid[1], y_coord, fill_value='extrapolate')
+        fz = itp.interp1d(self.grid[2], z_coord, fill_value='extrapolate')
+
+        fx_mm = itp.interp1d(x_coord, self.grid[0], fill_value='extrapolate')
+        fy_mm = itp.interp1d(y_coord, self.grid[1], fill_value='extrapolate')
+        fz_mm = itp.interp1d(z_coord, self.grid[2], fill_value='extrapolate')
 
         # DICOM pixel array definition
         mapped_coords = (z_coord, y_coord, x_coord)
-        self._dose_interp = itp.RegularGridInterpolator(
-            mapped_coords, self.values, bounds_error=False, fill_value=0.)
+        dose_interp = itp.RegularGridInterpolator(
+            mapped_coords, self.dose_matrix, bounds_error=False, fill_value=0.)
+
+        self._interpolators = {
+            'fx': fx,
+            'fy': fy,
+            'fz': fz,
+            'fx_mm': fx_mm,
+            'fy_mm': fy_mm,
+            'fz_mm': fz_mm,
+            'dose_interp': dose_interp
+        }
 
-        # set up private variables
-        self._x_coord = x_coord
-        self._y_coord = y_coord
-        self._z_coord = z_coord
+    def _get_interpolator(self, key):
+        if self._interpolators is None:
+            self._setup_interpolators()
+        return self._interpolators[key]
+
+    def _get_affine(self):
+        """
+            Origin and spacing of each uniformly spaced axis (x, y, z), None otherwise
+        """
+        if self._affine is None:
+            affine = []
+            for axis in self.grid:
+                axis = np.asarray(axis, dtype=float)
+                spacing = (axis[-1] - axis[0]) / (len(axis) - 1) if len(axis) > 1 else 0.0
+                uniform = spacing != 0 and np.allclose(np.diff(axis), spacing, rtol=1e-6, atol=1e-6)
+                affine.append((axis[0], spacing) if uniform else None)
+            self._affine = affine
+        return self._affine
+
+    def to_index(self, pos, axis: int) -> np.ndarray:
+        """
+            Maps positions in mm to index coordinates.
+            Uniform axes (DICOM dose grids) are mapped affinely from origin and spacing.
+        :param pos: positions in mm
+        :param axis: 0, 1 or 2 (x, y, z)
+        :return: index coordinates
+        """
+        if self._parent is not None:
+            # integer offsets keep the parent index round trip exact
+            return self._parent.to_index(pos, axis) - self._offset[2 - axis]
+        affine = self._get_affine()[axis]
+        if affine is None:
+            return np.asarray((self.fx, self.fy, self.fz)[axis](pos), dtype=float)
+        return (np.asarray(pos, dtype=float) - affine[0]) / affine[1]
+
+    def crop(self, bbox, margin: float = 0.0) -> 'Dose3D':
+        """
+            Dose3D view of the sub-volume enclosing a bounding box.
+            The voxels bracketing the box are kept, so interpolated doses inside it are unchanged.
+            Indexes are mapped by this instance and z planes come from its plane cache,
+            so crops of many structures share the interpolated planes.
+        :param bbox: (x_min, y_min, z_min), (x_max, y_max, z_max) in mm, e.g. StructureBase.bounding_box
+        :param margin: margin around the box in mm
+        :return: Dose3D sharing the values of this instance
+        """
+        lower = np.asarray(bbox[0], dtype=float) - margin
+        upper = np.asarray(bbox[1], dtype=float) + margin
+        if lower.shape != (3,) or upper.shape != (3,):
+            raise ValueError('Bounding box should be (x_min, y_min, z_min), (x_max, y_max, z_max)')
+
+        slices = []
+        for axis in range(3):
+            t = self.to_index(np.array([lower[axis], upper[axis]]), axis)
+            n = len(self.grid[axis])
+            i0 = int(np.clip(np.floor(t.min()) - 1, 0, n - 1))
+            i1 = int(np.clip(np.ceil(t.max()) + 1, 0, n - 1))
+            slices.append(slice(i0, i1 + 1))
+        sx, sy, sz = slices
+        grid = (self.grid[0][sx], self.grid[1][sy], self.grid[2][sz])
+
+        dose_roi = Dose3D(self.values[sz, sy, sx], grid, self.unit, self.plane_cache_size, self.scaling)
+        parent = self if self._parent is None else self._parent
+        dose_roi._parent = parent
+        dose_roi._offset = tuple(o + sl.start for o, sl in zip(self._offset, (sz, sy, sx)))
+
+        return dose_roi
+
+    def sample_points(self, zi, yi, xi, dtype=None) -> np.ndarray:
+        """
+            Trilinear interpolation at (z, y, x) index coordinates. Points outside the grid are 0.
+        :param zi: z index coordinates
+        :param yi: y index coordinates
+        :param xi: x index coordinates
+        :param dtype: output dtype, defaults to compute_dtype
+        :return: Dose values at points
+        """
+        zi, yi, xi = np.broadcast_arrays(np.asarray(zi, dtype=float), np.asarray(yi, dtype=float),
+                                         np.asarray(xi, dtype=float))
+        out = np.empty(zi.size, dtype=dtype or self.compute_dtype)
+        trilinear_points(self.values, zi.ravel(), yi.ravel(), xi.ravel(), out)
+        return self._decode(out).reshape(zi.shape)
+
+    def sample_plane(self, zi: float, yi: np.ndarray, xi: np.ndarray, dtype=None) -> np.ndarray:
+        """
+            Trilinear interpolation of a plane at z index coordinate over the yi x xi grid.
+            The full resolution z plane comes from the plane cache and is bilinear interpolated on yi x xi.
+            If yi and xi fall on dose voxels the values are read without interpolation.
+        :param zi: z index coordinate
+        :param yi: y index coordinates (rows)
+        :param xi: x index coordinates (columns)
+        :param dtype: output dtype, defaults to compute_dtype
+        :return: 2D dose matrix (len(yi), len(xi))
+        """
+        dtype = dtype or self.compute_dtype
+        yi = np.asarray(yi, dtype=float).ravel()
+        xi = np.asarray(xi, dtype=float).ravel()
+        plane = self.get_index_plane(zi)
+        if plane is None:
+            return np.zeros((len(yi), len(xi)), dtype=dtype)
+
+        y_idx = self._aligned_index(yi, plane.shape[0])
+        x_idx = self._aligned_index(xi, plane.shape[1])
+        if y_idx is not None and x_idx is not None:
+            # aligned fast path - calculation grid on native dose voxels
+            return self._decode(plane[np.ix_(y_idx, x_idx)].astype(dtype))
+
+        out = np.empty((len(yi), len(xi)), dtype=dtype)
+        return self._decode(bilinear_plane(plane, yi, xi, out))
+
+    def _decode(self, out):
+        # values to dose, in place on a new array
+        if self.scaling != 1.0:
+            out *= out.dtype.type(self.scaling)
+        return out
+
+    def get_index_plane(self, zi: float) -> np.ndarray:
+        """
+            Full resolution plane of values (not decoded by scaling) at z index coordinate.
+            Planes between dose voxels are interpolated once and kept on a LRU cache,
+            so structures sharing slice positions reuse them.
+        :param zi: z index coordinate
+        :return: 2D dose matrix or None if zi is outside the dose grid
+        """
+        z0, z1, wz = linear_index_weight(float(zi), self.values.shape[0])
+        if z0 < 0:
+            return None
+        if self._parent is not None:
+            # plane of the parent, keyed by its absolute z index, cut to the crop window
+            oz, oy, ox = self._offset
+            ny, nx = self.values.shape[1:]
+            plane = self._parent.get_index_plane(float(zi) + oz)
+            return plane[oy:oy + ny, ox:ox + nx]
+        if wz == 0.0:
+            return self.values[z0]
+        if wz == 1.0:
+            return self.values[z1]
+
+        key = (z0, wz)
+        with self._plane_cache_lock:
+            plane = self._plane_cache.get(key)
+            if plane is not None:
+                self._plane_cache.move_to_end(key)
+                self.plane_cache_hits += 1
+                return plane
+            self.plane_cache_misses += 1
+
+        plane = np.empty(self.values.shape[1:], dtype=self.compute_dtype)
+        interpolate_z_plane(self.values, z0, z1, wz, plane)
+        if self.plane_cache_size > 0:
+            with self._plane_cache_lock:
+                self._plane_cache[key] = plane
+                while len(self._plane_cache) > self.plane_cache_size:
+                    self._plane_cache.popitem(last=False)
+
+        return plane
+
+    def plane_cache_info(self) -> PlaneCacheInfo:
+        """
+            Plane cache statistics, of the parent for crops
+        :return: hits, misses, maxsize, currsize
+        """
+        if self._parent is not None:
+            return self._parent.plane_cache_info()
+        return PlaneCacheInfo(self.plane_cache_hits, self.plane_cache_misses,
+                              self.plane_cache_size, len(self._plane_cache))
+
+    def clear_plane_cache(self) -> None:
+        with self._plane_cache_lock:
+            self._plane_cache.clear()
+        self.plane_cache_hits = 0
+        self.plane_cache_misses = 0
+
+    @staticmethod
+    def _aligned_index(t, n):
+        idx = np.rint(t)
+        if len(t) and np.all(np.abs(t - idx) < INDEX_SNAP_TOLERANCE) and idx.min() >= 0 and idx.max() <= n - 1:
+            return idx.astype(np.int64)
+        return None
 
     # properties
 
     @property
     def fx(self):
-        return self._fx
+        return self._get_interpolator('fx')
 
     @property
     def fy(self):
-        return self._fy
+        return self._get_interpolator('fy')
 
     @property
     def fz(self):
-        return self._fz
+        return self._get_interpolator('fz')
+
+    @property
+    def fx_mm(self):
+        return self._get_interpolator('fx_mm')
+
+    @property
+    def fy_mm(self):
+        return self._get_interpolator('fy_mm')
+
+    @property
+    def fz_mm(self):
+        return self._get_interpolator('fz_mm')
+
+    @property
+    def dose_interp(self):
+        """
+            Trilinear interpolator over (z, y, x) index coordinates
+        :return: RegularGridInterpolator
+        """
+        return self._get_interpolator('dose_interp')
 
     @property
     def values(self) -> np.ndarray:
@@ -791,6 +1196,53 @@ class Dose3D:
                 values.shape)
             raise ValueError(txt)
         self._values = values
+        self._parent = None
+        self._interpolators = None
+        self.clear_statistics()
+        self.clear_plane_cache()
+
+    @property
+    def scaling(self) -> float:
+        """
+            Factor decoding values to dose
+        """
+        return self._scaling
+
+    @scaling.setter
+    def scaling(self, value: float) -> None:
+        if not float(value) > 0:
+            raise ValueError('Dose scaling should be positive')
+        self._scaling = float(value)
+        self._interpolators = None
+        self.clear_statistics()
+
+    @property
+    def precision(self) -> str:
+        """
+            Storage of the dose matrix
+        :return: 'float64', 'float32' or 'raw'
+        """
+        if np.issubdtype(self.values.dtype, np.integer):
+            return 'raw'
+        if self.values.dtype == np.float32:
+            return 'float32'
+        return 'float64'
+
+    @property
+    def compute_dtype(self):
+        """
+            Dtype of interpolated dose. float32 for compact (float32 or raw) storage.
+        """
+        return np.float64 if self.precision == 'float64' else np.float32
+
+    @property
+    def dose_matrix(self) -> np.ndarray:
+        """
+            Decoded 3D dose matrix (values times scaling)
+        """
+        if self.scaling == 1.0 and self.precision != 'raw':
+            return self.values
+        return self.values.astype(self.compute_dtype) * self.compute_dtype(self.scaling)
 
     @property
     def grid(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
@@ -806,6 +1258,11 @@ class Dose3D:
             txt = 'Grid must be a tuple containing (x_grid, y_grid, z_grid)'
             raise ValueError(txt)
         self._grid = values
+        self._parent = None
+        self._interpolators = None
+        self._affine = None
+        self.clear_statistics()
+        self.clear_plane_cache()
 
     @property
     def unit(self):
@@ -818,12 +1275,54 @@ class Dose3D:
 
         self._unit = value
 
+    @property
+    def statistics(self) -> DoseStatistics:
+        """
+            Whole grid statistics, computed once and kept until values, grid or scaling change
+        :return: DoseStatistics (max, argmax, min, mean, nonzero_bbox)
+        """
+        if self._statistics is None:
+            self._statistics = self._calculate_statistics()
+        return self._statistics
+
+    def _calculate_statistics(self) -> DoseStatistics:
+        values = self.values
+        nonzero_bbox = None
+        nonzero = [np.flatnonzero(np.any(values, axis=axes)) for axes in [(0, 1), (0, 2), (1, 2)]]
+        if len(nonzero[0]):
+            # first and last non zero voxel of each axis (x, y, z)
+            ends = [(self.grid[i][idx[0]], self.grid[i][idx[-1]]) for i, idx in enumerate(nonzero)]
+            nonzero_bbox = (np.array([min(e) for e in ends]), np.array([max(e) for e in ends]))
+
+        return DoseStatistics(max=float(values.max()) * self.scaling,
+                              argmax=int(values.argmax()),
+                              min=float(values.min()) * self.scaling,
+                              mean=float(values.mean()) * self.scaling,
+                              nonzero_bbox=nonzero_bbox)
+
+    @property
+    def histogram(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+            Differential histogram of the whole grid in 0.01 dose unit bins, computed once
+        :return: voxel counts and bin edges
+        """
+        if self._histogram is None:
+            dose_max = self.statistics.max
+            n_bins = max(int(dose_max / 0.01), 1)
+            counts, edges = np.histogram(self.values, bins=n_bins, range=(0, dose_max / self.scaling))
+            self._histogram = (counts, edges * self.scaling)
+        return self._histogram
+
+    def clear_statistics(self) -> None:
+        self._statistics = None
+        self._histogram = None
+
     @property
     def dose_max_3d(self):
         """
         :return:  DoseValue class
         """
-        return DoseValue(self.values.max(), self.unit)
+        return DoseValue(self.statistics.max, self.unit)
 
     @property
     def dose_max_location(self):
@@ -831,13 +1330,13 @@ class Dose3D:
 
         :return: (x,y,z) position in mm
         """
-        index_max = self.values.argmax()
+        index_max = self.statistics.argmax
         # mapped_coords = (z_coord, y_coord, x_coord)
         vec_idx = np.unravel_index(index_max, self.values.shape)
 
-        x_mm = self._fx_mm(vec_idx[2])
-        y_mm = self._fy_mm(vec_idx[1])
-        z_mm = self._fz_mm(vec_idx[0])
+        x_mm = self.fx_mm(vec_idx[2])
+        y_mm = self.fy_mm(vec_idx[1])
+        z_mm = self.fz_mm(vec_idx[0])
 
         return np.array((x_mm, y_mm, z_mm), dtype=float)
 
@@ -886,7 +1385,8 @@ class Dose3D:
         return np.sqrt(self.x_size**2 + self.y_size**2 + self.z_size**2)
 
     def get_z_dose_plane(self, z_pos: float,
-                         xy_lut: List[np.ndarray] = None) -> np.ndarray:
+                         xy_lut: List[np.ndarray] = None,
+                         dtype=None) -> np.ndarray:
         """
             Gets dose slice at position z
 
@@ -894,20 +1394,20 @@ class Dose3D:
         :type z_pos: float
         :param xy_lut: x-y lookup table
         :type xy_lut: numpy.ndarray
+        :param dtype: output dtype, defaults to compute_dtype. numpy.float32 halves the plane memory
         :return: 2D dose matrix at position z
         :rtype: numpy.ndarray
         """
+        if not xy_lut:
+            # return full xy dose plane
+            xy_lut = (self.grid[0], self.grid[1])
+
         # convert mm to index coordinate
-        zi = self.fz(z_pos)
+        zi = self.to_index(z_pos, 2)
+        yi = self.to_index(xy_lut[1], 1)
+        xi = self.to_index(xy_lut[0], 0)
 
-        if xy_lut:
-            # return interpolated dose plane at desired lookup table
-            xi, yi = self.wrap_xy_coordinates(xy_lut)
-            return self._dose_interp((zi, yi, xi))
-        else:
-            # return full xy dose plane
-            xi, yi = self.wrap_xy_coordinates((self.grid[0], self.grid[1]))
-            return self._dose_interp((zi, yi, xi))
+        return self.sample_plane(zi, yi, xi, dtype)
 
     def wrap_xy_coordinates(self, xy_lut):
         """
@@ -934,13 +1434,13 @@ class Dose3D:
         :return: 3D dose matrix
         """
         # convert mm to index coordinate
-        xi = self.fx(grid[0])
-        yi = self.fy(grid[1])
-        zi = self.fz(grid[2])
-        # wrap coordinates
-        zc, yc, xc = np.meshgrid(zi, yi, xi, indexing='ij', sparse=True)
+        xi = self.to_index(grid[0], 0)
+        yi = self.to_index(grid[1], 1)
+        zi = np.atleast_1d(self.to_index(grid[2], 2))
 
-        res = self._dose_interp((zc, yc, xc))
+        res = np.empty((len(zi), len(np.atleast_1d(yi)), len(np.atleast_1d(xi))), dtype=self.compute_dtype)
+        for k, z in enumerate(zi):
+            res[k] = self.sample_plane(z, yi, xi)
 
         return res
 
@@ -952,13 +1452,7 @@ class Dose3D:
         """
         if not len(at) == 3:
             raise ValueError('Should be an array of size 3. (x,y,z) positions')
-        # convert mm to index coordinate
-        xi = self.fx(at[0])
-        yi = self.fy(at[1])
-        zi = self.fz(at[2])
-        dv = float(self._dose_interp((zi, yi, xi)))
-
-        return DoseValue(dv, self.unit)
+        return DoseValue(self.get_value_to_point(at), self.unit)
 
     def get_value_to_point(self, at: np.ndarray) -> float:
         """
@@ -969,10 +1463,24 @@ class Dose3D:
         if not len(at) == 3:
             raise ValueError('Should be an array of size 3. (x,y,z) positions')
 
-        xi = self.fx(at[0])
-        yi = self.fy(at[1])
-        zi = self.fz(at[2])
-        return float(self._dose_interp((zi, yi, xi)))
+        xi = self.to_index(at[0], 0)
+        yi = self.to_index(at[1], 1)
+        zi = self.to_index(at[2], 2)
+        return float(self.sample_points(zi, yi, xi))
+
+    def get_values_to_points(self, points: np.ndarray) -> np.ndarray:
+        """
+            Helper method to interpolate the dose at many points in a single call.
+        :param points: (N, 3) array of [x,y,z] positions in mm
+        :return: Dose values at points
+        """
+        if points.ndim != 2 or points.shape[1] != 3:
+            raise ValueError('Should be an array of shape (N, 3). (x,y,z) positions')
+
+        xi = self.to_index(points[:, 0], 0)
+        yi = self.to_index(points[:, 1], 1)
+        zi = self.to_index(points[:, 2], 2)
+        return self.sample_points(zi, yi, xi)
 
     def get_dose_profile(self, start, stop):
         """
@@ -1032,9 +1540,15 @@ class DoseAccumulation:
             Sum all 3D matrix. It assumes all are same unit, i.e, Gy.
         :return: Dose3D
         """
-        tmp_dose3d = [
-            d.get_interpolated_3d_matrix(self.grid_sum) for d in self.doses_3d
-        ]
-        plan_sum_arr = sum(tmp_dose3d)
+        # accumulate in place, so only two matrices are alive at once
+        plan_sum_arr = None
+        for d in self.doses_3d:
+            tmp_dose3d = d.get_interpolated_3d_matrix(self.grid_sum)
+            if plan_sum_arr is None:
+                plan_sum_arr = tmp_dose3d
+            elif plan_sum_arr.dtype == np.result_type(plan_sum_arr, tmp_dose3d):
+                plan_sum_arr += tmp_dose3d
+            else:
+                plan_sum_arr = plan_sum_arr + tmp_dose3d
         plan_sum = Dose3D(plan_sum_arr, self.grid_sum, self.unit)
         return plan_sum
@@ -2,6 +2,7 @@
 Test cases for DVHCalculator class
 
 """
+from pyplanscoring.core.calculation import DVHCalculator
 
 
 # import os
@@ -35,3 +36,20 @@ def test_calc_setup(dvh_calculator):
 def test_calculate_mp(dvh_calculator, dose_3d):
     dvh_data = dvh_calculator.calculate_mp(dose_3d)
     assert dvh_data
+
+
+def test_scheduler():
+    options = {'mp_backend': 'threading', 'num_cores': 2}
+    d_calc = DVHCalculator(calculation_options=options)
+    scheduler = d_calc.scheduler
+    assert d_calc.scheduler is scheduler
+    assert (scheduler.backend, scheduler.num_cores) == ('threading', 2)
+
+    # built again when the options change
+    options['num_cores'] = 1
+    assert d_calc.scheduler is not scheduler
+    assert d_calc.scheduler.num_cores == 1
+    scheduler = d_calc.scheduler
+    d_calc.calculation_options = {'mp_backend': 'serial', 'num_cores': 1}
+    assert d_calc.scheduler is not scheduler
+    assert d_calc.scheduler.backend == 'serial'
@@ -122,3 +122,45 @@ def test_set_volume_focused_data(dvh):
     v = dvh.volume_focused_format
     d = dvh.dose_focused_format
     assert len(v) == len(d)
+
+
+def test_interp_linear():
+    from scipy.interpolate import interp1d
+    from pyplanscoring.core.types import interp_linear
+
+    # cumulative curve with plateaus, sorted stably as interp1d does
+    volume = np.array([100, 100, 80, 80, 50, 20, 20, 0], dtype=float)
+    dose = np.arange(len(volume)) * 0.5
+    order = np.argsort(volume, kind='mergesort')
+    x_new = np.array([-5, 0, 10, 20, 35, 50, 79.9, 80, 90, 100, 120])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = interp1d(volume[order], dose[order], fill_value='extrapolate')(x_new)
+        np.testing.assert_array_equal(interp_linear(x_new, volume[order], dose[order]), expected)
+    expected = interp1d(dose, volume, fill_value='extrapolate')(2.3)
+    assert interp_linear(2.3, dose, volume) == expected
+
+
+def test_lazy_dvh_data(dvh1):
+    from pyplanscoring.core.types import DVHData
+
+    lazy = DVHData(dvh1.dvh)
+    assert not hasattr(lazy, '__dict__')
+    # nothing is interpolated before the first query
+    assert not lazy._lookup and lazy._dose_format is None
+    dose = lazy.get_dose_at_volume(95 * VolumePresentation.relative)
+    assert set(lazy._lookup) == {'fd'}
+    assert dose == dvh1.get_dose_at_volume(95 * VolumePresentation.relative)
+
+
+def test_vectorized_queries(dvh):
+    volumes = [0, 0.1, 1, 50, 95, 99.9, 100]
+    doses = dvh.get_dose_at_volumes(volumes, VolumePresentation.relative)
+    for v, d in zip(volumes, doses):
+        assert d == float(dvh.get_dose_at_volume(v * VolumePresentation.relative))
+    # larger than the structure volume is undefined
+    assert np.isnan(dvh.get_dose_at_volumes([float(dvh.volume_cc.max()) + 1], VolumePresentation.absolute_cm3)[0])
+
+    dose_values = [0, 10, 3000, 7000, 10000]
+    volumes = dvh.get_volume_at_doses(dose_values, DoseUnit.cGy, VolumePresentation.absolute_cm3)
+    for d, v in zip(dose_values, volumes):
+        assert v == float(dvh.get_volume_at_dose(DoseValue(d, DoseUnit.cGy), VolumePresentation.absolute_cm3))
@@ -1,3 +1,8 @@
+import numpy as np
+import pandas as pd
+
+from pyplanscoring.constraints.metrics import ConstrainMetric, PlanEvaluation, interp_scores
+
 # import os
 #
 # import numpy.testing as npt
@@ -70,3 +75,84 @@
 #     # TODO CHECK DIFFERENCES
 #     # Check difference in PAROTID LD DOSE
 #     npt.assert_array_almost_equal(calc_data, ref_data, decimal=1)
+
+
+def test_interp_scores():
+    values = np.array([-1.0, 0.0, 0.5, 1.0, 1.5, 2.0, 3.0, np.nan])
+    for xp, fp in [([0.0, 2.0], [10.0, 0.0]), ([1.0, 1.0], [0.0, 5.0]), ([2.0, 0.0], [3.0, 7.0])]:
+        np.testing.assert_array_equal(interp_scores(values, xp[0], xp[1], fp[0], fp[1]), np.interp(values, xp, fp))
+
+
+def test_compiled_plan_evaluation(py_planning_item):
+    py_planning_item.calculate_dvh()
+    criteria = pd.DataFrame([['PTV70-BR.PLX 4MM', 'D95%[Gy]', 'min', 66.5, 64, 5],
+                             ['PTV70-BR.PLX 4MM', 'D98%[%]', 'min', 95, 90, 5],
+                             ['PTV70-BR.PLX 4MM', 'V66.5Gy[%]', 'min', 95, 90, 5],
+                             ['PTV70-BR.PLX 4MM', 'HI70Gy[]', 'max', 0.08, 0.13, 2],
+                             ['PTV70-BR.PLX 4MM', 'CI66.5Gy[]', 'min', 0.9, 0.65, 4],
+                             ['OPTIC CHIASM', 'Max[Gy]', 'max', 52, 55, 4],
+                             ['PAROTID LT', 'D50%[Gy]', 'max', 30, 40, 2],
+                             ['PAROTID LT', 'V30Gy[cc]', 'max', 5, 10, 2],
+                             ['LIPS', 'D0.1cc[cGy]', 'max', 3000, 3500, 3],
+                             ['ORAL CAVITY', 'Mean[Gy]', 'max', 40, 45, 3]],
+                            columns=['Structure Name', 'Query', 'Metric Type', 'Target', 'Tolerance', 'Score'])
+    plan_eval = PlanEvaluation()
+    plan_eval.criteria = criteria
+    df = plan_eval.eval_plan(py_planning_item)
+
+    # same results of scoring one ConstrainMetric per row
+    for i, row in criteria.iterrows():
+        cm = ConstrainMetric(row['Structure Name'], row['Query'], row['Metric Type'],
+                             [row['Target'], row['Tolerance']], row['Score'])
+        assert df['Raw score'][i] == cm.metric_function(py_planning_item)
+        assert df['Result'][i] == cm.query_result
+
+    # criteria compiled once and scored for many plans
+    assert plan_eval.compile() is plan_eval.compile()
+    results, scores = plan_eval.compile().evaluate_plans([py_planning_item] * 3)
+    assert scores.shape == (3, len(criteria))
+    np.testing.assert_array_equal(scores[2], df['Raw score'])
+    np.testing.assert_array_equal(results[0], df['Result'])
+
+
+class QueryPlanningItem:
+    """
+        Planning item that only answers execute_query, as PlanningItem with its own QueryExtensions
+    """
+
+    def __init__(self, pi):
+        self._pi = pi
+        self.queries = []
+
+    def execute_query(self, mayo_format_query, ss):
+        self.queries.append((mayo_format_query, ss))
+        return self._pi.execute_query(mayo_format_query, ss)
+
+
+def test_compiled_plan_evaluation_execute_query(py_planning_item):
+    py_planning_item.calculate_dvh()
+    criteria = pd.DataFrame([['PTV70-BR.PLX 4MM', 'D95%[Gy]', 'min', 66.5, 64, 5],
+                             ['PTV70-BR.PLX 4MM', 'CI66.5Gy[]', 'min', 0.9, 0.65, 4],
+                             ['PAROTID LT', 'V30Gy[cc]', 'inside', 5, 10, 2],
+                             ['ORAL CAVITY', 'Mean[Gy]', 'max', 40, 45, 3]],
+                            columns=['Structure Name', 'Query', 'Metric Type', 'Target', 'Tolerance', 'Score'])
+    plan_eval = PlanEvaluation()
+    plan_eval.criteria = criteria
+
+    # planning items other than PyPlanningItem run every query through execute_query
+    pi = QueryPlanningItem(py_planning_item)
+    df = plan_eval.eval_plan(pi)
+    assert pi.queries == list(zip(criteria['Query'], criteria['Structure Name']))
+
+    for i, row in criteria.iterrows():
+        cm = ConstrainMetric(row['Structure Name'], row['Query'], row['Metric Type'],
+                             [row['Target'], row['Tolerance']], row['Score'])
+        score = cm.metric_function(pi)
+        assert df['Result'][i] == cm.query_result
+        # metric types without a score function keep the None score
+        if score is None:
+            assert df['Raw score'][i] is None or np.isnan(df['Raw score'][i])
+        else:
+            assert df['Raw score'][i] == score
+
+    assert plan_eval.eval_plan(py_planning_item).equals(df)
@@ -177,3 +177,29 @@
     # mayo_format_query = 'CV6103.854532025905cGy[%]'
     # dose_1 = py_planning_item.execute_query(mayo_format_query, struc_name)
     # test_case.assertAlmostEqual(dose_1, 5 * VolumePresentation.relative)
+
+
+def test_dvh_cache(py_planning_item):
+    from pyplanscoring.core.types import DoseUnit, DoseValuePresentation, VolumePresentation
+
+    py_planning_item.calculate_dvh()
+    struc_name = 'PTV70-BR.PLX 4MM'
+    dvh_abs = py_planning_item.get_dvh_cumulative_data(struc_name, DoseValuePresentation.Absolute,
+                                                       VolumePresentation.relative)
+    dvh_rel = py_planning_item.get_dvh_cumulative_data(struc_name, DoseValuePresentation.Relative,
+                                                       VolumePresentation.relative)
+    assert dvh_abs.dose_unit == DoseUnit.Gy
+    assert dvh_rel.dose_unit == DoseUnit.Percent
+
+    # same structure and presentations returns the memoized DVHData
+    assert py_planning_item.get_dvh_cumulative_data(struc_name, DoseValuePresentation.Absolute,
+                                                    VolumePresentation.relative) is dvh_abs
+    assert py_planning_item.get_dvh_cumulative_data(struc_name, DoseValuePresentation.Relative,
+                                                    VolumePresentation.relative) is dvh_rel
+
+    # reassigning the DVH data invalidates the cache
+    py_planning_item.dvh_data = py_planning_item.dvh_data
+    dvh_new = py_planning_item.get_dvh_cumulative_data(struc_name, DoseValuePresentation.Absolute,
+                                                       VolumePresentation.relative)
+    assert dvh_new is not dvh_abs
+    assert dvh_new.max_dose == dvh_abs.max_dose
@@ -1,6 +1,7 @@
 import  os
 import matplotlib.pyplot as plt
 import numpy as np
+import pytest
 
 from pyplanscoring.core.calculation import DVHCalculation, PyStructure
 from pyplanscoring.core.dicom_reader import PyDicomParser
@@ -120,6 +121,88 @@ def test_calculate(structures, optic_chiasm, body, ptv70, lens, plot_flag, rd_dc
             plot_dvh_comp(dvh_calculated[roi_number], dvhs[roi_number], structures[roi_number]['name'])
             plt.show()
 
+def test_calculate_stack(optic_chiasm, body, lens, dose_3d):
+    # stacked engine should reproduce the plane by plane DVH
+    for structure, grid in [(body, None), (lens, (0.2, 0.2, 0.2)),
+                            (optic_chiasm, (0.5, 0.5, 0.5))]:
+        dvh_plane = DVHCalculation(
+            PyStructure(structure), dose_3d, calc_grid=grid).calculate()
+        dvh_stack = DVHCalculation(
+            PyStructure(structure), dose_3d, calc_grid=grid,
+            engine='stack').calculate()
+        np.testing.assert_equal(dvh_stack, dvh_plane)
+
+    with pytest.raises(ValueError):
+        DVHCalculation(PyStructure(lens), dose_3d, engine='voxel')
+
+
+def test_calculate_threads(body, lens, dose_3d):
+    # splitting planes across threads should reproduce the serial DVH
+    for structure, grid in [(body, None), (lens, (0.2, 0.2, 0.2))]:
+        for engine in ['plane', 'stack']:
+            dvh_serial = DVHCalculation(
+                PyStructure(structure), dose_3d, calc_grid=grid,
+                engine=engine).calculate()
+            dvh_threads = DVHCalculation(
+                PyStructure(structure), dose_3d, calc_grid=grid,
+                engine=engine, n_threads=4).calculate()
+            np.testing.assert_equal(dvh_threads, dvh_serial)
+
+    with pytest.raises(ValueError):
+        DVHCalculation(PyStructure(lens), dose_3d, n_threads=0)
+
+
+def test_calculate_binning(body, lens, dose_3d):
+    for structure, grid in [(body, None), (lens, (0.2, 0.2, 0.2))]:
+        dvh_fixed = DVHCalculation(PyStructure(structure), dose_3d, calc_grid=grid).calculate()
+        dvh_calc = DVHCalculation(PyStructure(structure), dose_3d, calc_grid=grid,
+                                  binning='relative', bin_width=0.002)
+        assert dvh_calc.n_bins == 500
+        dvh_rel = dvh_calc.calculate()
+        assert dvh_rel['bins'] <= 500
+        assert dvh_rel['scaling'] == pytest.approx(float(dose_3d.dose_max_3d) / 500)
+        assert dvh_rel['data'][0] == pytest.approx(dvh_fixed['data'][0], abs=0.01)
+        assert dvh_rel['mean'] == pytest.approx(dvh_fixed['mean'], abs=dvh_rel['scaling'])
+
+    with pytest.raises(ValueError):
+        DVHCalculation(PyStructure(lens), dose_3d, binning='adaptive')
+    with pytest.raises(ValueError):
+        DVHCalculation(PyStructure(lens), dose_3d, bin_width=0)
+
+
+def test_dose_roi(lens, dose_3d):
+    # planes are interpolated on the dose cropped to the structure bounding box
+    dvh_calc = DVHCalculation(PyStructure(lens), dose_3d, calc_grid=(0.2, 0.2, 0.2))
+    dose_roi = dvh_calc.dose_roi
+    assert dose_roi.values.size < dose_3d.values.size
+    bb_min, bb_max = dvh_calc.structure.bounding_box
+    for axis in range(3):
+        assert dose_roi.grid[axis].min() <= bb_min[axis]
+        assert dose_roi.grid[axis].max() >= bb_max[axis]
+
+    # the cropped doses of every structure share the plane cache of the whole dose
+    dose = Dose3D(dose_3d.values, dose_3d.grid, dose_3d.unit, plane_cache_size=1024)
+    dvh = DVHCalculation(PyStructure(lens), dose, calc_grid=(0.2, 0.2, 0.2)).calculate()
+    hits, misses, _, _ = dose.plane_cache_info()
+    assert misses > 0
+    dvh_cached = DVHCalculation(PyStructure(lens), dose, calc_grid=(0.2, 0.2, 0.2)).calculate()
+    assert dose.plane_cache_info().misses == misses
+    assert dose.plane_cache_info().hits >= hits + misses
+    np.testing.assert_array_equal(dvh_cached['data'], dvh['data'])
+
+
+def test_calculate_dose_precision(rd_dcm, body, ptv70, lens, dose_3d):
+    # compact dose storage keeps DVHs within round-off of the float64 DVH
+    for precision in ['float32', 'raw']:
+        dose = rd_dcm.get_dose_3d(precision)
+        for structure, grid in [(body, None), (ptv70, None), (lens, (0.2, 0.2, 0.2))]:
+            dvh_64 = DVHCalculation(PyStructure(structure), dose_3d, calc_grid=grid).calculate()
+            dvh_c = DVHCalculation(PyStructure(structure), dose, calc_grid=grid).calculate()
+            assert dvh_c['data'][0] == pytest.approx(dvh_64['data'][0], rel=1e-3)
+            assert dvh_c['mean'] == pytest.approx(dvh_64['mean'], abs=0.02)
+            assert dvh_c['max'] == pytest.approx(dvh_64['max'], abs=0.02)
+
+
 # TODO REFACTOR
 # def test_calc_structure_rings(dicom_folder):
 #     """
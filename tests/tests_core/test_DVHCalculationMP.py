@@ -1,3 +1,7 @@
+import logging
+import os
+import shutil
+
 from pyplanscoring.core.calculation import PyStructure, DVHCalculationMP
 
 
@@ -45,3 +49,32 @@ def test_calc_data(lens, body, brain, ptv70, spinal_cord, dose_3d):
     calc_mp = DVHCalculationMP(dose_3d, structures_py, grids)
     struc_dvh = calc_mp.calculate(structures_py[0], grids[0], dose_3d, True)
     assert struc_dvh
+
+
+def test_estimate_cost(lens, body, dose_3d):
+    structures_py = [PyStructure(lens), PyStructure(body)]
+    calc_mp = DVHCalculationMP(dose_3d, structures_py, [None, None])
+    lens_cost = calc_mp.estimate_cost(structures_py[0], None)
+    # bigger structures and finer grids cost more
+    assert calc_mp.estimate_cost(structures_py[1], None) > lens_cost
+    assert calc_mp.estimate_cost(structures_py[0], (0.2, 0.2, 0.2)) > lens_cost
+
+
+def test_remove_tmp_dir(lens, dose_3d, tmpdir, monkeypatch, caplog):
+    calc_mp = DVHCalculationMP(dose_3d, [PyStructure(lens)], [None], mp_backend='loky', num_cores=2)
+    tmp_dir = os.path.join(str(tmpdir), 'dose')
+    os.makedirs(tmp_dir)
+    calc_mp._remove_tmp_dir(tmp_dir)
+    assert not os.path.exists(tmp_dir)
+
+    # files still open are retried after stopping the workers, then logged
+    def rmtree(path):
+        raise PermissionError('file in use: {}'.format(path))
+
+    shutdowns = []
+    monkeypatch.setattr(shutil, 'rmtree', rmtree)
+    monkeypatch.setattr(calc_mp.scheduler, 'shutdown', lambda: shutdowns.append(True))
+    with caplog.at_level(logging.WARNING):
+        calc_mp._remove_tmp_dir(tmp_dir)
+    assert shutdowns == [True]
+    assert 'not removed' in caplog.text
@@ -1,7 +1,15 @@
 import os
 
-from pyplanscoring.core.calculation import PyStructure, DVHCalculationMP
-from pyplanscoring.core.io import IOHandler
+import numpy as np
+import pytest
+
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+from pyplanscoring.core.calculation import DVHCalculation, PyStructure, DVHCalculationMP
+from pyplanscoring.core.dicom_reader import PyDicomParser, get_dicom_type, get_dicom_types
+from pyplanscoring.core.io import DicomIndex, IOHandler, decode_dvh, encode_dvh, get_participant_folder_data
+from tests.conftest import rd, rp, rs
 
 
 def test_dvh_data(lens, body, brain, ptv70, spinal_cord, dose_3d, tmpdir):
@@ -23,7 +31,7 @@ def test_dvh_data(lens, body, brain, ptv70, spinal_cord, dose_3d, tmpdir):
 
     obj = IOHandler(dvh_data)
     f_dvh_dict = obj.read_dvh_file(file_path)
-    assert f_dvh_dict == dvh_data
+    np.testing.assert_equal(f_dvh_dict, dvh_data)
 
     file_path = os.path.join(tmpdir, "test_json_dvh.jdvh")
     obj = IOHandler(dvh_data)
@@ -32,11 +40,196 @@ def test_dvh_data(lens, body, brain, ptv70, spinal_cord, dose_3d, tmpdir):
     obj = IOHandler(dvh_data)
     j_dvh_dict = obj.read_json_file(file_path)
 
-    assert j_dvh_dict == dvh_data
+    np.testing.assert_equal(j_dvh_dict, dvh_data)
+    # DVH data are arrays, converted to lists only in the JSON file
+    assert all(isinstance(dvh['data'], np.ndarray) for dvh in dvh_data.values())
+    assert all(isinstance(dvh['data'], np.ndarray) for dvh in j_dvh_dict.values())
 
     # teardown
     os.remove(os.path.join(tmpdir, "test_dvh.dvh"))
     os.remove(os.path.join(tmpdir, "test_json_dvh.jdvh"))
+
+
+def test_dvh_formats(lens, body, ptv70, dose_3d, tmpdir):
+    dvh_data = {}
+    for structure, grid in [(lens, (0.2, 0.2, 0.2)), (body, None), (ptv70, None)]:
+        dvh = DVHCalculation(PyStructure(structure), dose_3d, calc_grid=grid).calculate()
+        dvh['roi_number'] = structure['id']
+        dvh_data[structure['id']] = dvh
+
+    for dvh in dvh_data.values():
+        # run-length encoding is lossless
+        rle = encode_dvh(dvh, 'rle')
+        assert 'data' not in rle
+        assert len(rle['rle']['values']) < dvh['bins']
+        np.testing.assert_equal(decode_dvh(rle), dvh)
+
+        # adaptive knots stay within the volume tolerance
+        adaptive = encode_dvh(dvh, 'adaptive', tolerance=1e-3)
+        assert len(adaptive['knots']['index']) < dvh['bins']
+        data = decode_dvh(adaptive)['data']
+        assert len(data) == dvh['bins']
+        assert np.max(np.abs(data - dvh['data'])) <= 1e-3 * dvh['data'][0] + 0.005
+
+    sizes = {}
+    for dvh_format in ['dense', 'rle', 'adaptive']:
+        file_path = os.path.join(str(tmpdir), "test_{}.jdvh".format(dvh_format))
+        obj = IOHandler(dvh_data)
+        obj.to_json_file(file_path, dvh_format)
+        sizes[dvh_format] = os.path.getsize(file_path)
+        j_dvh_dict = IOHandler().read_json_file(file_path)
+        if dvh_format != 'adaptive':
+            np.testing.assert_equal(j_dvh_dict, dvh_data)
+    assert sizes['rle'] < sizes['dense']
+    assert sizes['adaptive'] < sizes['dense']
+
+    with pytest.raises(ValueError):
+        encode_dvh(dvh_data[lens['id']], 'bz2')
+
+
+def test_get_dicom_types(tmpdir):
+    files = [rs, rd, rp]
+    # header only classification matches the full DICOM parser
+    for f in files:
+        assert get_dicom_type(f) == PyDicomParser(filename=f).GetSOPClassUID()
+
+    assert get_dicom_types(files, max_workers=2) == [('rtss', rs), ('rtdose', rd), ('rtplan', rp)]
+    assert get_dicom_types([]) == []
+
+    # non DICOM file
+    not_dicom = os.path.join(tmpdir, 'not_dicom.dcm')
+    with open(not_dicom, 'wb') as f:
+        f.write(b'not a dicom file')
+    with pytest.raises(AttributeError):
+        get_dicom_type(not_dicom)
+
+    os.remove(not_dicom)
+    for f, name in zip(files, ['RS.dcm', 'RD.dcm', 'RP.dcm']):
+        with open(f, 'rb') as src, open(os.path.join(tmpdir, name), 'wb') as dst:
+            dst.write(src.read())
+
+    files_dcm, flag = get_participant_folder_data(tmpdir)
+    assert flag
+    assert files_dcm == {'rtdose': os.path.join(tmpdir, 'RD.dcm'),
+                         'rtplan': os.path.join(tmpdir, 'RP.dcm'),
+                         'rtss': os.path.join(tmpdir, 'RS.dcm')}
+
+    os.remove(os.path.join(tmpdir, 'RP.dcm'))
+    files_dcm, flag = get_participant_folder_data(tmpdir)
+    assert not flag
+    assert files_dcm == ['rtplan']
+
+
+def write_rt_object(file_path, rt_type, frame_of_reference_uid, referenced_uid=None):
+    sop_classes = {'rtdose': '1.2.840.10008.5.1.4.1.1.481.2',
+                   'rtplan': '1.2.840.10008.5.1.4.1.1.481.5',
+                   'rtss': '1.2.840.10008.5.1.4.1.1.481.3'}
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.MediaStorageSOPClassUID = sop_classes[rt_type]
+    ds.file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.SOPClassUID = sop_classes[rt_type]
+    ds.SOPInstanceUID = ds.file_meta.MediaStorageSOPInstanceUID
+    ds.Modality = rt_type.upper().replace('RTSS', 'RTSTRUCT')
+    if rt_type == 'rtss':
+        ref_frame = Dataset()
+        ref_frame.FrameOfReferenceUID = frame_of_reference_uid
+        ds.ReferencedFrameOfReferenceSequence = [ref_frame]
+    else:
+        ds.FrameOfReferenceUID = frame_of_reference_uid
+        ref = Dataset()
+        ref.ReferencedSOPInstanceUID = referenced_uid
+        if rt_type == 'rtdose':
+            ds.ReferencedRTPlanSequence = [ref]
+        else:
+            ds.ReferencedStructureSetSequence = [ref]
+    ds.save_as(file_path, write_like_original=False)
+    return ds.SOPInstanceUID
+
+
+def write_participant(folder, frame_of_reference_uid, rtss_uid=None):
+    os.makedirs(folder)
+    if rtss_uid is None:
+        rtss_uid = write_rt_object(os.path.join(folder, 'RS.dcm'), 'rtss', frame_of_reference_uid)
+    plan_uid = write_rt_object(os.path.join(folder, 'RP.dcm'), 'rtplan', frame_of_reference_uid, rtss_uid)
+    write_rt_object(os.path.join(folder, 'RD.dcm'), 'rtdose', frame_of_reference_uid, plan_uid)
+    return rtss_uid
+
+
+def test_dicom_index(tmpdir):
+    frame_uid = generate_uid()
+    root = os.path.join(tmpdir, 'participants')
+    p1 = os.path.join(root, 'p1')
+    p2 = os.path.join(root, 'p2')
+    rtss_uid = write_participant(p1, frame_uid)
+    # plan on the shared structure set of p1
+    write_participant(p2, frame_uid, rtss_uid)
+    with open(os.path.join(p2, 'notes.dcm'), 'wb') as f:
+        f.write(b'not a dicom file')
+
+    index_path = os.path.join(tmpdir, 'dicom_index.sqlite')
+    with DicomIndex(index_path) as index:
+        typed_files = index.scan(root)
+        assert len(index) == 6
+        assert sorted(typed_files, key=lambda t: t[1]) == [
+            ('rtdose', os.path.join(p1, 'RD.dcm')), ('rtplan', os.path.join(p1, 'RP.dcm')),
+            ('rtss', os.path.join(p1, 'RS.dcm')), ('rtdose', os.path.join(p2, 'RD.dcm')),
+            ('rtplan', os.path.join(p2, 'RP.dcm')), (None, os.path.join(p2, 'notes.dcm'))]
+
+        rs_file = index.get_by_uid(rtss_uid)
+        assert [f['path'] for f in rs_file] == [os.path.join(p1, 'RS.dcm')]
+        assert rs_file[0]['frame_of_reference_uid'] == frame_uid
+
+        triplets = index.find_triplets()
+        assert triplets == [{'rtdose': os.path.join(p1, 'RD.dcm'), 'rtplan': os.path.join(p1, 'RP.dcm'),
+                             'rtss': os.path.join(p1, 'RS.dcm')},
+                            {'rtdose': os.path.join(p2, 'RD.dcm'), 'rtplan': os.path.join(p2, 'RP.dcm'),
+                             'rtss': os.path.join(p1, 'RS.dcm')}]
+        assert index.find_triplets(p2) == triplets[1:]
+        assert index.find_triplets(same_folder=True) == triplets[:1]
+
+        # folder data from the index matches reading the files
+        assert get_participant_folder_data(p1, index) == get_participant_folder_data(p1)
+        assert get_participant_folder_data(p2, index) == (['rtss'], False)
+
+    # changed and removed files are read again from a reopened index
+    plan_uid = write_rt_object(os.path.join(p2, 'RP.dcm'), 'rtplan', frame_uid, rtss_uid)
+    os.remove(os.path.join(p2, 'notes.dcm'))
+    with DicomIndex(index_path) as index:
+        assert len(index) == 6
+        index.scan(root)
+        assert len(index) == 5
+        assert index.get_by_uid(plan_uid)[0]['path'] == os.path.join(p2, 'RP.dcm')
+        # the dose still references the old plan
+        assert index.find_triplets(p2) == []
+        assert len(index.get_files(p1)) == 3
+
+
+def test_dicom_index_unreadable_files(tmpdir):
+    folder = os.path.join(tmpdir, 'p1')
+    write_participant(folder, generate_uid())
+    with open(os.path.join(folder, 'RP.dcm'), 'rb') as f:
+        plan_data = f.read()
+    # plan truncated at every length, some stop inside an element
+    for n in range(len(plan_data)):
+        with open(os.path.join(folder, 'RP_%04d.dcm' % n), 'wb') as f:
+            f.write(plan_data[:n])
+    with open(os.path.join(folder, 'junk.dcm'), 'wb') as f:
+        f.write(b'\0' * 128 + b'DICM' + bytes(range(256)) * 4)
+
+    with DicomIndex(':memory:') as index:
+        typed_files = dict((f, rt_type) for rt_type, f in index.scan(folder))
+        assert len(index) == len(plan_data) + 4
+        assert typed_files[os.path.join(folder, 'RP.dcm')] == 'rtplan'
+        assert typed_files[os.path.join(folder, 'junk.dcm')] is None
+        assert typed_files[os.path.join(folder, 'RP_0000.dcm')] is None
+        truncated_types = {typed_files[os.path.join(folder, 'RP_%04d.dcm' % n)] for n in range(len(plan_data))}
+        assert truncated_types == {None, 'rtplan'}
+        # the whole participant is still found
+        assert len(index.find_triplets(folder)) == 1
+
+
 #
 # def test_get_participant_folder_data(dicom_folder, tmpdir):
 #     files_dcm, flag = get_participant_folder_data(dicom_folder)
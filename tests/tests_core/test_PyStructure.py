@@ -68,3 +68,18 @@ def test_structure(brain):
 
     # # test no existing plane
     assert not obj.get_contours_on_image_plane('25.5')
+
+
+def test_bounding_box(brain):
+    obj = PyStructure(brain)
+    bb_min, bb_max = obj.bounding_box
+    np.testing.assert_array_equal(bb_min, obj.point_cloud.min(axis=0))
+    np.testing.assert_array_equal(bb_max, obj.point_cloud.max(axis=0))
+    assert obj.bounding_box is obj.bounding_box
+
+    # end caps and high resolution planes update the box
+    obj1 = PyStructure(brain, brain['thickness'] / 2.0)
+    assert obj1.bounding_box[0][2] < bb_min[2]
+    assert obj1.bounding_box[1][2] > bb_max[2]
+    obj1.to_high_resolution(0.2)
+    np.testing.assert_array_equal(obj1.bounding_box[0], obj1.point_cloud.min(axis=0))
@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+
+from pyplanscoring.core.calculation import DVHCalculation, PyStructure
+from pyplanscoring.core.geometry import (get_axis_grid, get_axis_grid_cached, get_contour_mask_scanline,
+                                         get_contour_mask_wn, get_contour_mask_wn_grid, wn_contains_points)
+
+
+def wn_mask(doselut, contours):
+    xg, yg = np.meshgrid(doselut[0], doselut[1])
+    dosegrid_points = np.vstack((xg.flatten(), yg.flatten())).T
+    grid = np.zeros((len(doselut[1]), len(doselut[0])), dtype=bool)
+    for c in contours:
+        grid = np.logical_xor(get_contour_mask_wn(doselut, dosegrid_points, c), grid)
+    return grid
+
+
+def square(x0, x1, y0, y1, z=0.0):
+    return np.array([[x0, y0, z], [x1, y0, z], [x1, y1, z], [x0, y1, z]], dtype=float)
+
+
+def test_scanline_synthetic():
+    doselut = [np.arange(-10.0, 10.5, 0.5), np.arange(-10.0, 10.5, 0.5)]
+
+    # square with a hole, vertices off the grid nodes
+    contours = [square(-7.3, 7.1, -6.9, 7.2), square(-2.2, 3.1, -3.3, 2.4)]
+    mask = get_contour_mask_scanline(doselut, contours)
+    assert mask.dtype == bool
+    assert mask.shape == (len(doselut[1]), len(doselut[0]))
+    np.testing.assert_array_equal(mask, wn_mask(doselut, contours))
+    assert not mask[20, 20]
+    assert mask[20, 6]
+
+    # triangle with a vertical edge
+    triangle = [np.array([[-8.1, -8.3, 0], [6.7, -2.2, 0], [-8.1, 7.7, 0]])]
+    np.testing.assert_array_equal(get_contour_mask_scanline(doselut, triangle), wn_mask(doselut, triangle))
+
+    # descending lookup tables
+    desc_lut = [doselut[0][::-1], doselut[1][::-1]]
+    np.testing.assert_array_equal(get_contour_mask_scanline(desc_lut, contours), wn_mask(desc_lut, contours))
+
+    # contour outside the lookup table
+    outside = [square(20.3, 30.1, 20.2, 30.4)]
+    assert not get_contour_mask_scanline(doselut, outside).any()
+
+
+def test_scanline_vertices_on_grid():
+    # grid nodes lying exactly on vertices and edges, e.g. the extreme vertices of ROI grids
+    doselut = [np.arange(-20.0, 20.25, 0.25), np.arange(-20.0, 20.25, 0.25)]
+    desc_lut = [doselut[0], doselut[1][::-1]]
+    diamond = np.array([[0.0, -7.0], [7.0, 0.0], [0.0, 7.0], [-7.0, 0.0]])
+    ring = [np.array([[3.0, -7.0], [12.0, 6.0], [-7.0, 4.5], [-12.0, 6.0]]), diamond / 2]
+    for contours in [[diamond], ring]:
+        np.testing.assert_array_equal(get_contour_mask_scanline(doselut, contours), wn_mask(doselut, contours))
+        np.testing.assert_array_equal(get_contour_mask_scanline(desc_lut, contours), wn_mask(desc_lut, contours))
+
+    rng = np.random.RandomState(0)
+    for _ in range(200):
+        n = rng.randint(3, 12)
+        theta = np.sort(rng.uniform(0, 2 * np.pi, n))
+        r = rng.uniform(3, 15, n)
+        # vertices snapped to the grid
+        poly = np.round(np.column_stack((r * np.cos(theta), r * np.sin(theta))) * 2) / 2
+        contours = [poly, poly * 0.2]
+        np.testing.assert_array_equal(get_contour_mask_scanline(doselut, contours), wn_mask(doselut, contours))
+
+
+def test_axis_grid_cache():
+    axis, dt = get_axis_grid(0.2, [-10.13, 25.7])
+    axis_cached, dt_cached = get_axis_grid_cached(0.2, [-10.13, 25.7])
+    np.testing.assert_array_equal(axis_cached, axis)
+    assert dt_cached == dt
+    # same key returns the shared read-only axis
+    assert get_axis_grid_cached(0.2, np.array([-10.13, 25.7]))[0] is axis_cached
+    assert not axis_cached.flags.writeable
+
+    # only first, last and size of the axis define the up sampled axis
+    z_axis = np.arange(-30, 31, 3.0)
+    np.testing.assert_array_equal(get_axis_grid_cached(1.0, z_axis)[0], get_axis_grid(1.0, z_axis)[0])
+
+    # implicit grid gives the same wn mask of materialized grid points
+    doselut = [axis_cached, get_axis_grid_cached(0.25, [-5.2, 30.9])[0]]
+    xg, yg = np.meshgrid(doselut[0], doselut[1])
+    dosegrid_points = np.vstack((xg.flatten(), yg.flatten())).T
+    poly = square(-3.3, 12.1, 1.7, 18.2)[:, :2]
+    np.testing.assert_array_equal(get_contour_mask_wn_grid(doselut, poly),
+                                  get_contour_mask_wn(doselut, dosegrid_points, poly))
+
+
+def test_wn_edge_buckets():
+    # edge buckets should reproduce the brute force winding number test
+    th = np.linspace(0, 2 * np.pi, 500, endpoint=False)
+    r = 8 + 1.5 * np.sin(7 * th)
+    star = np.column_stack((r * np.cos(th), r * np.sin(th)))
+    polygons = [square(-3, 3, -12, 12)[:, :2], np.round(star * 2) / 2, star]
+    for y_lut in [np.arange(-10.0, 10.25, 0.25), np.arange(10.0, -10.25, -0.25)]:
+        doselut = [np.arange(-10.0, 10.5, 0.5), y_lut]
+        xg, yg = np.meshgrid(doselut[0], doselut[1])
+        dosegrid_points = np.vstack((xg.flatten(), yg.flatten())).T
+        for poly in polygons:
+            poly_wn = np.vstack((poly, poly[:1]))
+            expected = wn_contains_points(np.zeros(len(dosegrid_points), dtype=bool), poly_wn, dosegrid_points)
+            mask = get_contour_mask_wn_grid(doselut, poly)
+            np.testing.assert_array_equal(mask, expected.reshape(mask.shape))
+    # rows outside the polygon y-range are empty
+    assert not mask[0].any() and not mask[-1].any()
+
+    # any point set with the size of the grid is tested point by point, not as the doselut grid
+    points = np.random.RandomState(0).uniform(-10, 10, (len(dosegrid_points), 2))
+    expected = wn_contains_points(np.zeros(len(points), dtype=bool), poly_wn, points)
+    np.testing.assert_array_equal(get_contour_mask_wn(doselut, points, poly).ravel(), expected)
+
+
+def test_scanline_structures(body, ptv70, lens, dose_3d):
+    for structure, grid in [(body, None), (ptv70, (1, 1, 1)), (lens, (0.2, 0.2, 0.2))]:
+        struc = PyStructure(structure)
+        dvh_scan = DVHCalculation(struc, dose_3d, calc_grid=grid, mask_backend='scanline')
+        dvh_wn = DVHCalculation(struc, dose_3d, calc_grid=grid, mask_backend='wn')
+        for z in struc.planes.keys():
+            contours, _ = struc.get_plane_contours_areas(z)
+            mask_scan, lut_scan = dvh_scan.get_plane_mask(contours)
+            mask_wn, lut_wn = dvh_wn.get_plane_mask(contours)
+            np.testing.assert_array_equal(lut_scan[0], lut_wn[0])
+            np.testing.assert_array_equal(lut_scan[1], lut_wn[1])
+            np.testing.assert_array_equal(mask_scan, mask_wn)
+
+    with pytest.raises(ValueError):
+        DVHCalculation(PyStructure(lens), dose_3d, mask_backend='raster')
@@ -1,4 +1,11 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
 from pyplanscoring.core.geometry import get_dose_grid_3d, get_contour_roi_grid, calculate_contour_areas
+from pyplanscoring.core.types import Dose3D
 
 
 def test_dose_max_3d_location(dose_3d, rd_dcm):
@@ -67,6 +74,202 @@ def test_get_dose_to_point(dose_3d):
     assert d_teste == dose_max
 
 
+def test_trilinear_sampler(dose_3d):
+    from scipy.interpolate import RegularGridInterpolator
+    mapped_coords = [np.arange(n) for n in dose_3d.values.shape]
+    reference = RegularGridInterpolator(mapped_coords, dose_3d.values, bounds_error=False, fill_value=0.)
+
+    x_lut = np.linspace(dose_3d.grid[0].min() - 10, dose_3d.grid[0].max() + 10, 157)
+    y_lut = np.linspace(dose_3d.grid[1].min() - 10, dose_3d.grid[1].max() + 10, 131)
+    for z in [dose_3d.grid[2][3] + 1.3, dose_3d.grid[2][0], dose_3d.grid[2][-1] + 1.0]:
+        plane = dose_3d.get_z_dose_plane(z, [x_lut, y_lut])
+        xx, yy = np.meshgrid(dose_3d.fx(x_lut), dose_3d.fy(y_lut), sparse=True)
+        expected = reference((dose_3d.fz(z), yy, xx))
+        np.testing.assert_allclose(plane, expected, atol=1e-9)
+
+    # aligned fast path returns the native voxels
+    np.testing.assert_array_equal(dose_3d.get_z_dose_plane(dose_3d.grid[2][5]), dose_3d.values[5])
+
+    plane = dose_3d.get_z_dose_plane(dose_3d.grid[2][3] + 1.3, [x_lut, y_lut])
+    plane_32 = dose_3d.get_z_dose_plane(dose_3d.grid[2][3] + 1.3, [x_lut, y_lut], dtype=np.float32)
+    assert plane_32.dtype == np.float32
+    np.testing.assert_allclose(plane_32, plane, rtol=1e-6)
+
+
+def test_plane_cache(dose_3d):
+    dose = Dose3D(dose_3d.values, dose_3d.grid, dose_3d.unit, plane_cache_size=2)
+    z = [dose.grid[2][i] + 0.7 for i in range(3)]
+    x_lut = np.linspace(dose.grid[0].min(), dose.grid[0].max(), 77)
+    y_lut = np.linspace(dose.grid[1].min(), dose.grid[1].max(), 55)
+
+    plane = dose.get_z_dose_plane(z[0], [x_lut, y_lut])
+    np.testing.assert_array_equal(dose.get_z_dose_plane(z[0], [x_lut, y_lut]), plane)
+    assert dose.plane_cache_info() == (1, 1, 2, 1)
+    # another lookup table at the same z also hits the cached plane
+    dose.get_z_dose_plane(z[0], [x_lut[::2], y_lut])
+    assert dose.plane_cache_hits == 2
+
+    # least recently used planes are evicted
+    dose.get_z_dose_plane(z[1], [x_lut, y_lut])
+    dose.get_z_dose_plane(z[2], [x_lut, y_lut])
+    assert dose.plane_cache_info() == (2, 3, 2, 2)
+    dose.get_z_dose_plane(z[0], [x_lut, y_lut])
+    assert dose.plane_cache_misses == 4
+
+    # planes on dose voxels are not cached
+    dose.get_z_dose_plane(dose.grid[2][5], [x_lut, y_lut])
+    assert dose.plane_cache_info() == (2, 4, 2, 2)
+
+    # changing values clears the cache
+    dose.values = dose.values * 2
+    assert dose.plane_cache_info() == (0, 0, 2, 0)
+    np.testing.assert_allclose(dose.get_z_dose_plane(z[0], [x_lut, y_lut]), plane * 2)
+
+
+def test_dose_3d_memmap_pickle(dose_3d, tmpdir):
+    dose_mm = dose_3d.to_memmap(os.path.join(str(tmpdir), 'dose.npy'))
+    assert isinstance(dose_mm.values, np.memmap)
+    np.testing.assert_array_equal(dose_mm.values, dose_3d.values)
+
+    # memory-mapped values are pickled by reference, not by value
+    data = pickle.dumps(dose_mm)
+    assert len(data) < dose_3d.values.nbytes
+    dose_rec = pickle.loads(data)
+    assert isinstance(dose_rec.values, np.memmap)
+    assert dose_rec.get_value_to_point([0, 0, 0]) == dose_3d.get_value_to_point([0, 0, 0])
+    np.testing.assert_array_equal(dose_rec.dose_max_location, dose_3d.dose_max_location)
+
+    # in memory values are still pickled by value
+    dose_rec = pickle.loads(pickle.dumps(dose_3d))
+    assert not isinstance(dose_rec.values, np.memmap)
+    np.testing.assert_array_equal(dose_rec.values, dose_3d.values)
+
+
+def test_dose_precision(rd_dcm, dose_3d):
+    dose_32 = rd_dcm.get_dose_3d('float32')
+    dose_raw = rd_dcm.get_dose_3d('raw')
+    assert dose_3d.precision == 'float64'
+    assert dose_32.precision == 'float32' and dose_32.compute_dtype == np.float32
+    assert dose_raw.precision == 'raw' and dose_raw.scaling == float(rd_dcm.ds.DoseGridScaling)
+    assert dose_32.values.nbytes * 2 == dose_3d.values.nbytes
+    assert dose_raw.values.nbytes < dose_3d.values.nbytes
+
+    # raw pixel data is decoded on demand
+    np.testing.assert_allclose(dose_raw.dose_matrix, dose_3d.values, rtol=1e-6)
+    assert abs(float(dose_raw.dose_max_3d) - float(dose_3d.dose_max_3d)) < 1e-6
+    z = dose_3d.grid[2][3] + 1.3
+    x_lut = np.linspace(dose_3d.grid[0].min(), dose_3d.grid[0].max(), 157)
+    y_lut = np.linspace(dose_3d.grid[1].min(), dose_3d.grid[1].max(), 131)
+    plane = dose_3d.get_z_dose_plane(z, [x_lut, y_lut])
+    for dose in [dose_32, dose_raw]:
+        plane_c = dose.get_z_dose_plane(z, [x_lut, y_lut])
+        assert plane_c.dtype == np.float32
+        np.testing.assert_allclose(plane_c, plane, rtol=1e-5, atol=1e-5)
+        assert abs(dose.get_value_to_point([0, 0, 0]) - dose_3d.get_value_to_point([0, 0, 0])) < 1e-5
+
+    with pytest.raises(ValueError):
+        rd_dcm.get_dose_3d('float16')
+    with pytest.raises(ValueError):
+        Dose3D(dose_raw.values, dose_raw.grid, dose_raw.unit, scaling=0)
+
+
+def test_dose_3d_dicom_memmap(rd_dcm, dose_3d):
+    pixels = rd_dcm.get_dose_memmap()
+    assert isinstance(pixels, np.memmap)
+    np.testing.assert_array_equal(pixels, rd_dcm.ds.pixel_array)
+
+    dose_mm = rd_dcm.get_dose_3d(memmap=True)
+    assert dose_mm.precision == 'raw'
+    z = dose_3d.grid[2][3] + 1.3
+    np.testing.assert_allclose(dose_mm.get_z_dose_plane(z), dose_3d.get_z_dose_plane(z), rtol=1e-5, atol=1e-5)
+
+    # the DICOM file is pickled by reference
+    data = pickle.dumps(dose_mm)
+    assert len(data) < pixels.nbytes
+    dose_rec = pickle.loads(data)
+    assert isinstance(dose_rec.values, np.memmap)
+    np.testing.assert_array_equal(dose_rec.values, pixels)
+
+
+def test_dose_3d_crop(dose_3d):
+    # box in the central part of the dose grid
+    lower = np.array([g.min() for g in dose_3d.grid])
+    upper = np.array([g.max() for g in dose_3d.grid])
+    bbox = (lower + (upper - lower) * 0.31, upper - (upper - lower) * 0.27)
+    dose_crop = dose_3d.crop(bbox, margin=2.0)
+    assert np.shares_memory(dose_crop.values, dose_3d.values)
+    assert dose_crop.values.size < dose_3d.values.size
+    for axis in range(3):
+        assert dose_crop.grid[axis].min() <= bbox[0][axis] - 2.0
+        assert dose_crop.grid[axis].max() >= bbox[1][axis] + 2.0
+
+    # interpolation inside the box is unchanged
+    x_lut = np.linspace(bbox[0][0], bbox[1][0], 57)
+    y_lut = np.linspace(bbox[0][1], bbox[1][1], 61)
+    for z in np.linspace(bbox[0][2], bbox[1][2], 7):
+        np.testing.assert_array_equal(dose_crop.get_z_dose_plane(z, [x_lut, y_lut]),
+                                      dose_3d.get_z_dose_plane(z, [x_lut, y_lut]))
+    points = np.column_stack((x_lut[:50], y_lut[:50], np.linspace(bbox[0][2], bbox[1][2], 50)))
+    np.testing.assert_array_equal(dose_crop.get_values_to_points(points), dose_3d.get_values_to_points(points))
+
+    # boxes larger than the dose grid keep the whole grid
+    dose_all = dose_3d.crop((np.full(3, -1e4), np.full(3, 1e4)))
+    assert dose_all.values.shape == dose_3d.values.shape
+
+    with pytest.raises(ValueError):
+        dose_3d.crop(([0, 0], [1, 1]))
+
+
+def test_dose_3d_crop_plane_cache(dose_3d):
+    # crops of different boxes share the z planes cached on the dose they were cut from
+    dose = Dose3D(dose_3d.values, dose_3d.grid, dose_3d.unit)
+    lower = np.array([g.min() for g in dose.grid])
+    upper = np.array([g.max() for g in dose.grid])
+    crop_a = dose.crop((lower + (upper - lower) * 0.2, upper - (upper - lower) * 0.4))
+    crop_b = dose.crop((lower + (upper - lower) * 0.3, upper - (upper - lower) * 0.2))
+    # nested crops map to the same dose
+    crop_c = crop_b.crop((lower + (upper - lower) * 0.35, upper - (upper - lower) * 0.3))
+
+    z = dose.grid[2][len(dose.grid[2]) // 2] + 0.3 * dose.z_res
+    x_lut = np.linspace(lower[0] + (upper - lower)[0] * 0.36, upper[0] - (upper - lower)[0] * 0.41, 23)
+    y_lut = np.linspace(lower[1] + (upper - lower)[1] * 0.36, upper[1] - (upper - lower)[1] * 0.41, 29)
+    planes = [d.get_z_dose_plane(z, [x_lut, y_lut]) for d in (crop_a, crop_b, crop_c, dose)]
+    assert dose.plane_cache_info() == (3, 1, dose.plane_cache_size, 1)
+    assert crop_a.plane_cache_info() == dose.plane_cache_info()
+    for plane in planes[:-1]:
+        np.testing.assert_array_equal(plane, planes[-1])
+
+    # a pickled crop is a standalone sub-volume, mapping indexes on its own grid
+    crop_rec = pickle.loads(pickle.dumps(crop_b))
+    np.testing.assert_allclose(crop_rec.get_z_dose_plane(z, [x_lut, y_lut]), planes[1], rtol=1e-12)
+    assert crop_rec.plane_cache_info().misses == 1
+
+
+def test_dose_statistics(dose_3d):
+    dose = Dose3D(dose_3d.values.copy(), dose_3d.grid, dose_3d.unit)
+    stats = dose.statistics
+    assert stats.max == dose.values.max()
+    assert stats.min == dose.values.min()
+    assert stats.argmax == dose.values.argmax()
+    assert stats.mean == pytest.approx(dose.values.mean())
+    # computed once
+    assert dose.statistics is stats
+    assert float(dose.dose_max_3d) == stats.max
+
+    # non zero voxels lie inside the non zero bounding box
+    dose_crop = dose.crop(stats.nonzero_bbox)
+    assert np.count_nonzero(dose_crop.values) == np.count_nonzero(dose.values)
+
+    counts, edges = dose.histogram
+    assert counts.sum() == dose.values.size
+    assert edges[-1] == pytest.approx(stats.max)
+
+    # values assignment invalidates the statistics
+    dose.values = dose.values * 2
+    assert dose.statistics.max == 2 * stats.max
+    assert dose.histogram[1][-1] == pytest.approx(2 * stats.max)
+
+
 def test_sum_dose_3d():
     # TODO add this validation test
     # # path to 4 dicom files
@@ -0,0 +1,94 @@
+"""
+Point in polygon and raster kernels on the test structures.
+The points per second benchmark is opt-in: PYPLANSCORING_BENCHMARK=1 pytest -s
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from pyplanscoring.core.calculation import DVHCalculation, PyStructure
+from pyplanscoring.core.geometry import contains_points, get_contour_mask_scanline, wn_contains_points
+
+
+def get_plane_data(structure, dose_3d, grid):
+    # contours and contour roi grid points of every plane
+    struc = PyStructure(structure)
+    dvh_calc = DVHCalculation(struc, dose_3d, calc_grid=grid)
+    plane_data = []
+    for z in struc.planes.keys():
+        contours, _ = struc.get_plane_contours_areas(z)
+        points = np.vstack([c['data'] for c in contours])
+        grid_points, lut = dvh_calc.get_contour_roi_grid(points, dvh_calc.calc_grid)
+        plane_data.append(([c['data'] for c in contours], grid_points, lut))
+    return plane_data
+
+
+def run_plane(kernel, plane):
+    contours, grid_points, lut = plane
+    masks = []
+    for poly in contours:
+        out = np.zeros(len(grid_points), dtype=bool)
+        if kernel is wn_contains_points:
+            poly = np.vstack((poly, poly[:1]))
+        masks.append(kernel(out, poly, grid_points))
+    return masks
+
+
+def run_kernel(kernel, plane_data):
+    return [mask for plane in plane_data for mask in run_plane(kernel, plane)]
+
+
+def run_raster(plane):
+    return get_contour_mask_scanline(plane[2], plane[0])
+
+
+def points_per_second(func, plane_data, executor=None):
+    # contour grid points tested per second, planes run one by one or on the thread pool
+    n_points = sum(len(grid_points) * len(contours) for contours, grid_points, lut in plane_data)
+    ts = time.perf_counter()
+    if executor is None:
+        list(map(func, plane_data))
+    else:
+        list(executor.map(func, plane_data))
+    return n_points / (time.perf_counter() - ts)
+
+
+def test_kernels(body, lens, dose_3d):
+    for structure, grid in [(body, None), (lens, (0.2, 0.2, 0.2))]:
+        plane_data = get_plane_data(structure, dose_3d, grid)
+
+        wn_masks = run_kernel(wn_contains_points, plane_data)
+        cn_masks = run_kernel(contains_points, plane_data)
+
+        # both point in polygon kernels agree apart from points lying on edges
+        mismatch = sum(np.count_nonzero(a != b) for a, b in zip(wn_masks, cn_masks))
+        total = sum(len(a) for a in wn_masks)
+        assert mismatch <= total * 1e-4
+
+        # kernels release the GIL and run serially, so they are safe to call from thread pools
+        with ThreadPoolExecutor(4) as executor:
+            threaded_masks = list(executor.map(lambda p: get_contour_mask_scanline(p[2], p[0]), plane_data))
+        for (contours, grid_points, lut), mask in zip(plane_data, threaded_masks):
+            np.testing.assert_array_equal(mask, get_contour_mask_scanline(lut, contours))
+
+
+@pytest.mark.skipif(not os.environ.get('PYPLANSCORING_BENCHMARK'), reason='set PYPLANSCORING_BENCHMARK=1 to run')
+def test_kernels_points_per_second(body, lens, dose_3d):
+    kernels = [('wn_contains_points', lambda p: run_plane(wn_contains_points, p)),
+               ('contains_points', lambda p: run_plane(contains_points, p)),
+               ('raster', run_raster)]
+    n_threads = os.cpu_count()
+    for name, structure, grid in [('BODY', body, None), ('LENS LT', lens, (0.2, 0.2, 0.2))]:
+        plane_data = get_plane_data(structure, dose_3d, grid)
+        with ThreadPoolExecutor(n_threads) as executor:
+            for kernel_name, func in kernels:
+                # compile before timing
+                func(plane_data[0])
+                serial_pps = points_per_second(func, plane_data)
+                threaded_pps = points_per_second(func, plane_data, executor)
+                print('\n{} {} - points per second: serial {:.3g}, {} threads {:.3g}'.format(
+                    name, kernel_name, serial_pps, n_threads, threaded_pps))
+                assert serial_pps > 0 and threaded_pps > 0
@@ -1,6 +1,18 @@
 '''
 Test cases DICOM objs
 '''
+import copy
+import pickle
+
+import numpy as np
+import pytest
+from pydicom.dataelem import RawDataElement
+from pydicom.dataset import Dataset
+
+from pyplanscoring.core.calculation import PyStructure
+from pyplanscoring.core.dicom_reader import CONTOUR_DATA_TAG, PyDicomParser
+from pyplanscoring.core.geometry import calc_area, centroid_of_polygon
+from tests.conftest import rd, rs
 
 
 def test_get_tps_data(rp_dcm):
@@ -21,10 +33,119 @@ def test_GetStructures(rs_dcm):
     assert structures
 
 
+def test_get_contour_data(rs_dcm):
+    structures = PyDicomParser(filename=rs).GetStructures()
+    for roi in rs_dcm.ds.ROIContourSequence:
+        if 'ContourSequence' not in roi:
+            continue
+        planes = structures[roi.ReferencedROINumber]['planes']
+        contour = roi.ContourSequence[0]
+        # raw DS bytes decoding gives the same points of the converted ContourData
+        contour_data = rs_dcm.get_contour_data(contour)
+        expected = rs_dcm.GetContourPoints(contour.ContourData)
+        np.testing.assert_array_equal(contour_data, expected)
+        plane = planes['%.2f' % expected[0, 2]]
+        assert any(np.array_equal(p['contourData'], expected) for p in plane)
+
+        # batch centroids match the single polygon calculation
+        for p in plane:
+            x, y = p['contourData'][:, 0], p['contourData'][:, 1]
+            if calc_area(x, y) > 0:
+                np.testing.assert_allclose(p['centroid'], centroid_of_polygon(x, y), rtol=1e-10)
+
+
+def raw_contour(value):
+    contour = Dataset()
+    contour[CONTOUR_DATA_TAG] = RawDataElement(CONTOUR_DATA_TAG, 'DS', len(value), value, 0, False, True)
+    return contour
+
+
+def test_get_contour_data_raw():
+    rs_dcm = PyDicomParser(filename=rs)
+    contour_data = rs_dcm.get_contour_data(raw_contour(b'1.5\\-2\\3E1\\4.0\\5\\ 6.25 '))
+    np.testing.assert_array_equal(contour_data, [[1.5, -2, 30], [4, 5, 6.25]])
+    # malformed values raise instead of being truncated
+    with pytest.raises(ValueError):
+        rs_dcm.get_contour_data(raw_contour(b'1.5\\-2\\3.x\\4.0\\5\\6 '))
+
+
+def test_set_contours_centroids():
+    square = np.array([[0, 0, 1], [2, 0, 1], [2, 2, 1], [0, 2, 1]], dtype=float)
+    line = np.array([[1, 0, 1], [2, 1, 1], [3, 2, 1]], dtype=float)
+    point = np.array([[5, 5, 1]], dtype=float)
+    planes = [{'contourData': c} for c in (square, line, point)]
+    PyDicomParser.set_contours_centroids(planes)
+    np.testing.assert_allclose(planes[0]['centroid'], centroid_of_polygon(square[:, 0], square[:, 1]))
+    # zero area contours keep the vertex mean, the fallback of the single contour calculation
+    assert planes[1]['centroid'] == (2, 1)
+    assert planes[2]['centroid'] == (5, 5)
+
+
 def test_DoseRegularGridInterpolator(rd_dcm):
     dose_interp, (x, y, z), (fx, fy, fz) = rd_dcm.DoseRegularGridInterpolator()
 
 
+def test_pixel_to_patient_affine():
+    rd_dcm = PyDicomParser(filename=rd)
+    ds = rd_dcm.ds
+    affine = rd_dcm.get_pixel_to_patient_affine()
+    assert affine.shape == (4, 4)
+    assert rd_dcm.get_pixel_to_patient_affine() is affine
+    np.testing.assert_array_equal(affine.dot([0, 0, 0, 1])[:3], [float(v) for v in ds.ImagePositionPatient])
+
+    # lookup tables are the patient coordinates of the first row and column pixels
+    x, y = rd_dcm.GetPatientToPixelLUT()
+    assert isinstance(x, list) and isinstance(y, list)
+    # each call returns new lists
+    x[0] = 0
+    assert rd_dcm.GetPatientToPixelLUT()[0][0] == float(ds.ImagePositionPatient[0])
+
+    # oblique image planes have no axis aligned dose grid
+    oblique = PyDicomParser(dataset=copy.deepcopy(ds))
+    c, s = np.cos(np.pi / 6), np.sin(np.pi / 6)
+    oblique.ds.ImageOrientationPatient = [c, 0, -s, 0, 1, 0]
+    assert rd_dcm.is_axis_aligned()
+    assert not oblique.is_axis_aligned()
+    with pytest.raises(ValueError):
+        oblique.get_pixel_to_patient_affine()
+    with pytest.raises(ValueError):
+        oblique.get_grid_3d()
+
+
+@pytest.mark.parametrize('orientation, x, y, z', [
+    # HFS
+    ([1, 0, 0, 0, 1, 0], [-10, -8, -6, -4], [-20, -17, -14], [-30, -27.5, -25]),
+    # HFP
+    ([-1, 0, 0, 0, -1, 0], [-10, -12, -14, -16], [-20, -23, -26], [-30, -32.5, -35]),
+    # FFS
+    ([-1, 0, 0, 0, 1, 0], [-10, -12, -14, -16], [-20, -17, -14], [-30, -32.5, -35]),
+    # FFP
+    ([1, 0, 0, 0, -1, 0], [-10, -8, -6, -4], [-20, -23, -26], [-30, -27.5, -25]),
+])
+def test_get_grid_3d_orientation(orientation, x, y, z):
+    # 4 columns x 3 rows x 3 frames with non square pixels
+    rd_dcm = PyDicomParser(filename=rd)
+    grid = PyDicomParser(dataset=copy.deepcopy(rd_dcm.ds))
+    grid.ds.ImageOrientationPatient = orientation
+    grid.ds.ImagePositionPatient = [-10, -20, -30]
+    grid.ds.PixelSpacing = [2, 3]
+    grid.ds.Columns = 4
+    grid.ds.Rows = 3
+    grid.ds.GridFrameOffsetVector = [0, 2.5, 5]
+
+    assert grid.GetPatientToPixelLUT() == (x, y)
+    gx, gy, gz = grid.get_grid_3d()
+    np.testing.assert_array_equal(gx, x)
+    np.testing.assert_array_equal(gy, y)
+    np.testing.assert_array_equal(gz, z)
+
+    # the affine maps every (column, row, frame offset) to its get_grid_3d point
+    cols, rows, offsets = np.meshgrid(np.arange(4), np.arange(3), grid.ds.GridFrameOffsetVector, indexing='ij')
+    pixels = np.stack([cols.ravel(), rows.ravel(), offsets.ravel(), np.ones(cols.size)])
+    points = np.stack(np.meshgrid(gx, gy, gz, indexing='ij')).reshape(3, -1)
+    np.testing.assert_array_equal(grid.get_pixel_to_patient_affine().dot(pixels)[:3], points)
+
+
 def test_GetDVHs(rd_dcm):
     assert rd_dcm.GetDVHs()
 
@@ -41,3 +162,25 @@ def test_GetPlan(rp_dcm):
 
 def test_GetReferencedBeamsInFraction(rp_dcm):
     assert rp_dcm.GetReferencedBeamsInFraction()
+
+
+def test_get_structures_lazy(rs_dcm):
+    structures = rs_dcm.GetStructures()
+    lazy_structures = PyDicomParser(filename=rs).GetStructures(lazy=True)
+    assert list(lazy_structures) == list(structures)
+
+    # names and types are read without decoding contours
+    roi_number = next(k for k, v in structures.items() if 'planes' in v)
+    lazy = lazy_structures[roi_number]
+    assert lazy['name'] == structures[roi_number]['name']
+    assert not lazy.is_loaded
+
+    # contours are decoded on first access
+    assert lazy['thickness'] == structures[roi_number]['thickness']
+    assert lazy.is_loaded
+    assert list(lazy['planes']) == list(structures[roi_number]['planes'])
+    assert list(lazy) == list(structures[roi_number])
+
+    # copies and pickles as a plain dict
+    assert type(pickle.loads(pickle.dumps(lazy))) is dict
+    assert PyStructure(lazy).volume == PyStructure(structures[roi_number]).volume
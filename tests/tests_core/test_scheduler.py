@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+from pyplanscoring.core.scheduler import DVHScheduler, get_num_workers
+
+
+def square(x):
+    return x * x
+
+
+def test_get_num_workers():
+    n_cpus = os.cpu_count() or 1
+    assert get_num_workers(-1) == n_cpus
+    assert get_num_workers(0) == n_cpus
+    assert get_num_workers(1) == 1
+    assert get_num_workers(n_cpus + 10) == n_cpus
+    assert get_num_workers(-1, n_tasks=1) == 1
+    assert get_num_workers(-1, n_tasks=0) == 1
+
+
+def test_scheduler_backend():
+    assert DVHScheduler('serial').backend == 'serial'
+    assert DVHScheduler('thread').backend == 'threading'
+    assert DVHScheduler('process').backend == 'multiprocessing'
+    assert DVHScheduler('Loky').backend == 'loky'
+    assert not DVHScheduler('serial', num_cores=4).uses_processes
+    assert not DVHScheduler('loky', num_cores=1).uses_processes
+
+    with pytest.raises(ValueError):
+        DVHScheduler('gpu')
+
+
+@pytest.mark.parametrize('backend', ['serial', 'threading', 'multiprocessing', 'loky'])
+def test_scheduler_map(backend):
+    tasks = [(i,) for i in range(10)]
+    costs = [1, 5, 2, 8, 0, 3, 9, 4, 7, 6]
+    scheduler = DVHScheduler(backend, num_cores=2)
+
+    # results are returned in task order whatever the submission order
+    assert scheduler.map(square, tasks) == [i * i for i in range(10)]
+    assert scheduler.map(square, tasks, costs) == [i * i for i in range(10)]
+    assert len(scheduler.timings) == len(tasks)
+    assert all(t >= 0 for t in scheduler.timings)
+
+    with pytest.raises(ValueError):
+        scheduler.map(square, tasks, costs[:-1])
+
+
+def test_scheduler_shutdown():
+    scheduler = DVHScheduler('loky', num_cores=2)
+    assert scheduler.map(square, [(2,), (3,)]) == [4, 9]
+    scheduler.shutdown()
+    # a new pool starts on the next map
+    assert scheduler.map(square, [(2,), (3,)]) == [4, 9]
+    DVHScheduler('serial').shutdown()